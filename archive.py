@@ -0,0 +1,103 @@
+"""Archivage des prêts rendus dans des segments XML découpés par période.
+
+Chaque segment ``library-archive/2023-01.xml`` (par mois) ou
+``library-archive/2023.xml`` (par année) contient, sous une racine
+``<loans period="...">``, les prêts archivés dont la date de sortie tombe dans
+la période. Une recherche sur un intervalle n'ouvre que les segments qui le
+chevauchent.
+
+Les périodes et bornes s'écrivent ``AAAA``, ``AAAA-MM`` ou ``AAAA-MM-JJ`` et
+se comparent comme des chaînes, à la manière des dates ISO des prêts.
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+_PERIOD = re.compile(r"^\d{4}(-\d{2}(-\d{2})?)?$")
+GRANULARITIES = {"month": 7, "year": 4}
+
+
+def is_period(text: str) -> bool:
+    """Indique si ``text`` est une date ou une période acceptée."""
+    return bool(_PERIOD.match(text or ""))
+
+
+def lower_bound(period: str) -> str:
+    """Première date couverte par ``period`` (``2023-06`` → ``2023-06-01``)."""
+    return period + "0000-01-01"[len(period):]
+
+
+def upper_bound(period: str) -> str:
+    """Dernière date couverte par ``period`` (``2023-06`` → ``2023-06-31``)."""
+    return period + "9999-12-31"[len(period):]
+
+
+def segment_period(loan: ET.Element, by: str) -> str:
+    """Période du segment qui reçoit ``loan``, d'après sa date de sortie."""
+    return loan.get("date_out", "")[: GRANULARITIES[by]]
+
+
+def _loan_key(loan: ET.Element) -> tuple:
+    return tuple(loan.get(name) for name in ("book_id", "user_id", "date_out", "date_return"))
+
+
+def segments(directory: Path) -> list[tuple[str, Path]]:
+    """Retourne les couples (période, chemin) des segments, dans l'ordre des périodes."""
+    if not directory.is_dir():
+        return []
+    found = [(path.stem, path) for path in directory.glob("*.xml") if is_period(path.stem)]
+    return sorted(found, key=lambda item: (lower_bound(item[0]), item[0]))
+
+
+def overlapping(directory: Path, start: str | None = None, end: str | None = None):
+    """Segments dont la période chevauche l'intervalle ``[start, end]``."""
+    low = lower_bound(start) if start else ""
+    high = upper_bound(end) if end else "~"
+    return [
+        (period, path)
+        for period, path in segments(directory)
+        if lower_bound(period) <= high and upper_bound(period) >= low
+    ]
+
+
+def write_segments(directory: Path, loans: list[ET.Element], by: str = "month") -> dict[str, int]:
+    """Ajoute ``loans`` aux segments de leur période et retourne le nombre ajouté par segment.
+
+    Un segment existant est relu puis réécrit ; un prêt déjà présent (après
+    un archivage interrompu) n'est pas dupliqué.
+    """
+    groups: dict[str, list[ET.Element]] = {}
+    for loan in loans:
+        groups.setdefault(segment_period(loan, by), []).append(loan)
+    directory.mkdir(parents=True, exist_ok=True)
+    added = {}
+    for period, group in sorted(groups.items()):
+        path = directory / f"{period}.xml"
+        root = ET.parse(path).getroot() if path.exists() else ET.Element("loans", period=period)
+        known = {_loan_key(loan) for loan in root.findall("loan")}
+        fresh = [loan for loan in group if _loan_key(loan) not in known]
+        if not fresh:
+            continue
+        merged = sorted(root.findall("loan") + fresh, key=lambda loan: loan.get("date_out", ""))
+        root[:] = merged
+        temporary = path.with_name(path.name + ".tmp")
+        ET.ElementTree(root).write(temporary, encoding="utf-8", xml_declaration=True)
+        os.replace(temporary, path)
+        added[period] = len(fresh)
+    return added
+
+
+def in_range(loan: ET.Element, start: str | None, end: str | None) -> bool:
+    """Indique si la date de sortie du prêt est dans ``[start, end]``."""
+    date_out = loan.get("date_out", "")
+    return (not start or date_out >= lower_bound(start)) and (not end or date_out <= upper_bound(end))
+
+
+def iter_archived(directory: Path, start: str | None = None, end: str | None = None):
+    """Parcourt les prêts archivés sortis dans ``[start, end]``, segment par segment."""
+    for _, path in overlapping(directory, start, end):
+        for loan in ET.parse(path).getroot().findall("loan"):
+            if in_range(loan, start, end):
+                yield loan
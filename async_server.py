@@ -0,0 +1,126 @@
+"""Serveur asyncio pour un grand nombre de connexions HTTP/1.1 persistantes.
+
+La boucle d'événements ne fait que lire les requêtes et écrire les réponses.
+Chaque requête complète est confiée à un petit groupe de fils qui la fait
+traiter par ``LibraryHandler`` : routes, verrous, validation et compression
+sont ceux du serveur classique, et l'analyse comme l'enregistrement du
+fichier XML ne bloquent jamais la boucle. Ce que le gestionnaire écrit est
+transmis à la boucle au fur et à mesure, si bien qu'une longue page arrive
+par blocs pendant son rendu.
+
+Les connexions restent ouvertes entre deux requêtes (keep-alive) et les
+requêtes envoyées à la suite sans attendre (pipelining) reçoivent leurs
+réponses dans l'ordre.
+"""
+
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from web_app import LibraryHandler
+
+# Taille maximale de la ligne de requête et des en-têtes.
+MAX_HEADER_BYTES = 64 * 1024
+# Durée après laquelle une connexion inactive est fermée, en secondes.
+IDLE_TIMEOUT = 300
+
+
+class _LoopWriter:
+    """Flux d'écriture d'un fil de travail vers la connexion de la boucle.
+
+    Chaque écriture attend que la boucle ait vidé son tampon d'envoi
+    (``drain``) : un client lent ralentit le rendu au lieu de laisser la
+    réponse s'accumuler en mémoire.
+    """
+
+    def __init__(self, loop, writer) -> None:
+        self._loop = loop
+        self._writer = writer
+
+    async def _send(self, data: bytes) -> None:
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def write(self, data) -> int:
+        asyncio.run_coroutine_threadsafe(self._send(bytes(data)), self._loop).result()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+class BufferedLibraryHandler(LibraryHandler):
+    """``LibraryHandler`` qui lit une requête en mémoire et écrit sa réponse dans ``wfile``."""
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, raw_request: bytes, client_address, wfile=None):
+        # Le constructeur parent lirait une socket : on prépare les flux
+        # nous-mêmes puis on traite l'unique requête qu'ils contiennent.
+        self.rfile = io.BytesIO(raw_request)
+        self.wfile = io.BytesIO() if wfile is None else wfile
+        self.client_address = client_address
+        self.server = None
+        self.close_connection = True
+        self.handle_one_request()
+
+
+def _render(raw_request: bytes, client_address, wfile) -> bool:
+    """Traite une requête en écrivant sa réponse dans ``wfile`` ; indique s'il faut fermer la connexion."""
+    handler = BufferedLibraryHandler(raw_request, client_address, wfile)
+    return handler.close_connection
+
+
+def _content_length(head: bytes) -> int:
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            try:
+                return max(int(value.strip()), 0)
+            except ValueError:
+                return 0
+    return 0
+
+
+async def _serve_connection(reader, writer, executor) -> None:
+    loop = asyncio.get_running_loop()
+    peer = writer.get_extra_info("peername") or ("", 0)
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                length = _content_length(head)
+                body = await reader.readexactly(length) if length else b""
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                break
+            stream = _LoopWriter(loop, writer)
+            close = await loop.run_in_executor(executor, _render, head + body, peer[:2], stream)
+            if close:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve(port: int, workers: int) -> None:
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library")
+    server = await asyncio.start_server(
+        lambda reader, writer: _serve_connection(reader, writer, executor),
+        port=port,
+        limit=MAX_HEADER_BYTES,
+    )
+    print(f"Serveur asynchrone demarre sur le port {port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=True)
+
+
+def run_async(port=8000, workers=4):
+    asyncio.run(_serve(port, workers))
+
+
+if __name__ == "__main__":
+    run_async()
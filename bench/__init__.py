@@ -0,0 +1,6 @@
+"""Outils de mesure des performances de la bibliothèque.
+
+- ``python -m bench.generate`` produit une bibliothèque synthétique ;
+- ``python -m bench.run`` chronomètre les commandes et les routes web sur des
+  bibliothèques de plusieurs tailles et écrit les résultats en JSON.
+"""
@@ -0,0 +1,232 @@
+"""Génération de bibliothèques synthétiques reproductibles.
+
+La même graine produit toujours le même fichier. ``size`` est le nombre total
+d'enregistrements, réparti par défaut en 50 % de livres, 10 % d'utilisateurs
+et 40 % de prêts, dont un quart encore en cours (au plus un par livre).
+
+Les auteurs mêlent écrivains sénégalais et français : quelques noms connus
+très empruntés et une longue traîne de noms composés, tirés selon une loi de
+Zipf comme dans un vrai fonds.
+
+Utilisation::
+
+    python -m bench.generate library.xml --size 100000 --seed 42
+"""
+
+import argparse
+import datetime
+import itertools
+import random
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+SENEGALESE_AUTHORS = [
+    "Mariama Bâ",
+    "Cheikh Hamidou Kane",
+    "Ousmane Sembène",
+    "Léopold Sédar Senghor",
+    "Aminata Sow Fall",
+    "Boubacar Boris Diop",
+    "Fatou Diome",
+    "Abdoulaye Sadji",
+    "Birago Diop",
+    "Ken Bugul",
+    "Mohamed Mbougar Sarr",
+    "David Diop",
+]
+FRENCH_AUTHORS = [
+    "Victor Hugo",
+    "Albert Camus",
+    "Émile Zola",
+    "Marguerite Duras",
+    "Annie Ernaux",
+    "Gustave Flaubert",
+    "Simone de Beauvoir",
+    "Marcel Proust",
+    "George Sand",
+    "Jules Verne",
+    "Honoré de Balzac",
+    "Patrick Modiano",
+]
+SENEGALESE_FIRST_NAMES = [
+    "Aminata", "Awa", "Fatou", "Khady", "Mariama", "Ndeye", "Coumba", "Astou",
+    "Abdoulaye", "Cheikh", "Mamadou", "Moussa", "Ousmane", "Ibrahima", "Modou", "Babacar",
+]
+SENEGALESE_LAST_NAMES = [
+    "Diop", "Ndiaye", "Fall", "Sow", "Ba", "Sarr", "Faye", "Diallo",
+    "Gueye", "Mbaye", "Diouf", "Seck", "Thiam", "Cissé", "Kane", "Niang",
+]
+FRENCH_FIRST_NAMES = [
+    "Camille", "Claire", "Élise", "Hélène", "Julie", "Léa", "Manon", "Sophie",
+    "Antoine", "François", "Hugo", "Julien", "Louis", "Mathieu", "Pierre", "Rémi",
+]
+FRENCH_LAST_NAMES = [
+    "Martin", "Bernard", "Dubois", "Lefèvre", "Moreau", "Laurent", "Simon", "Michel",
+    "Garnier", "Rousseau", "Fournier", "Girard", "Mercier", "Bonnet", "Chevalier", "Faure",
+]
+GENRES = [
+    "Roman", "Poésie", "Théâtre", "Essai", "Nouvelles", "Conte",
+    "Biographie", "Histoire", "Policier", "Jeunesse", "Science-fiction", "Philosophie",
+]
+TITLE_WORDS = [
+    "lettre", "aventure", "soleil", "fleuve", "savane", "mémoire", "silence", "nuit",
+    "terre", "mer", "exil", "enfant", "chant", "ombre", "village", "ville",
+    "destin", "voix", "retour", "frontière", "baobab", "pirogue", "vent", "étoile",
+]
+TITLE_PATTERNS = [
+    "Une si longue {a}",
+    "L'{a} ambiguë",
+    "Le {a} du {b}",
+    "La {a} et le {b}",
+    "Les {a}s de la {b}",
+    "{A}",
+    "Chroniques du {a}",
+    "Au-delà du {a}",
+]
+
+# Répartition par défaut des enregistrements.
+BOOK_SHARE = 0.5
+USER_SHARE = 0.1
+ACTIVE_LOAN_SHARE = 0.25
+# Nombre d'auteurs de la longue traîne par millier de livres.
+AUTHORS_PER_THOUSAND_BOOKS = 40
+
+
+def split_size(size: int) -> tuple[int, int, int]:
+    """Répartit ``size`` enregistrements en (livres, utilisateurs, prêts)."""
+    books = max(int(size * BOOK_SHARE), 1)
+    users = max(int(size * USER_SHARE), 1)
+    return books, users, max(size - books - users, 0)
+
+
+def _person(rng: random.Random, senegalese: bool) -> str:
+    if senegalese:
+        return f"{rng.choice(SENEGALESE_FIRST_NAMES)} {rng.choice(SENEGALESE_LAST_NAMES)}"
+    return f"{rng.choice(FRENCH_FIRST_NAMES)} {rng.choice(FRENCH_LAST_NAMES)}"
+
+
+def author_pool(rng: random.Random, books: int, senegalese_share: float = 0.5):
+    """Retourne les auteurs et leurs poids cumulés (loi de Zipf)."""
+    count = max(books * AUTHORS_PER_THOUSAND_BOOKS // 1000, 1)
+    famous = SENEGALESE_AUTHORS + FRENCH_AUTHORS
+    rng.shuffle(famous)
+    authors = famous + [_person(rng, rng.random() < senegalese_share) for _ in range(count)]
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(authors) + 1)))
+    return authors, weights
+
+
+def _title(rng: random.Random) -> str:
+    a, b = rng.sample(TITLE_WORDS, 2)
+    return rng.choice(TITLE_PATTERNS).format(a=a, b=b, A=a.capitalize())
+
+
+def iter_books(rng: random.Random, count: int, senegalese_share: float = 0.5):
+    """Produit ``count`` dictionnaires de livres (title, author, genre, year)."""
+    authors, weights = author_pool(rng, count, senegalese_share)
+    for _ in range(count):
+        yield {
+            "title": _title(rng),
+            "author": rng.choices(authors, cum_weights=weights)[0],
+            "genre": rng.choice(GENRES),
+            "year": str(rng.randint(1900, 2024)),
+        }
+
+
+def iter_users(rng: random.Random, count: int, senegalese_share: float = 0.5):
+    """Produit ``count`` dictionnaires d'utilisateurs (name)."""
+    for _ in range(count):
+        yield {"name": _person(rng, rng.random() < senegalese_share)}
+
+
+def make_loans(rng: random.Random, count: int, books: int, users: int, today: datetime.date):
+    """Retourne ``count`` prêts sur les livres ``1..books`` et utilisateurs ``1..users``.
+
+    Un quart des prêts, pris sur des livres distincts, est encore en cours ;
+    les autres sont rendus. Les prêts sont triés par date de sortie.
+    """
+    active = min(int(count * ACTIVE_LOAN_SHARE), books)
+    active_books = set(rng.sample(range(1, books + 1), active))
+    free_books = [b for b in range(1, books + 1) if b not in active_books] or list(range(1, books + 1))
+    loans = []
+    for _ in range(count - active):
+        date_out = today - datetime.timedelta(days=rng.randint(31, 5 * 365))
+        loans.append({
+            "book_id": str(rng.choice(free_books)),
+            "user_id": str(rng.randint(1, users)),
+            "date_out": date_out.isoformat(),
+            "date_due": (date_out + datetime.timedelta(days=30)).isoformat(),
+            "date_return": (date_out + datetime.timedelta(days=rng.randint(1, 45))).isoformat(),
+        })
+    for book_id in active_books:
+        date_out = today - datetime.timedelta(days=rng.randint(0, 60))
+        loans.append({
+            "book_id": str(book_id),
+            "user_id": str(rng.randint(1, users)),
+            "date_out": date_out.isoformat(),
+            "date_due": (date_out + datetime.timedelta(days=30)).isoformat(),
+        })
+    loans.sort(key=lambda loan: loan["date_out"])
+    return loans
+
+
+def generate_library(
+    path: Path,
+    size: int,
+    seed: int = 0,
+    senegalese_share: float = 0.5,
+    today: datetime.date | None = None,
+) -> dict[str, int]:
+    """Écrit une bibliothèque de ``size`` enregistrements dans ``path``.
+
+    Le fichier est écrit au fil de l'eau, sans construire d'arbre, et porte
+    les compteurs ``next_id`` attendus par ``LibraryStore``.
+    """
+    rng = random.Random(seed)
+    today = today or datetime.date(2025, 1, 1)
+    n_books, n_users, n_loans = split_size(size)
+    with Path(path).open("w", encoding="utf-8") as out:
+        out.write("<?xml version='1.0' encoding='utf-8'?>\n<library>")
+        out.write(f'<books next_id="{n_books + 1}">')
+        for book_id, book in enumerate(iter_books(rng, n_books, senegalese_share), 1):
+            out.write(
+                f'<book id="{book_id}"><title>{escape(book["title"])}</title>'
+                f'<author>{escape(book["author"])}</author><genre>{escape(book["genre"])}</genre>'
+                f'<year>{book["year"]}</year></book>'
+            )
+        out.write(f'</books><users next_id="{n_users + 1}">')
+        for user_id, user in enumerate(iter_users(rng, n_users, senegalese_share), 1):
+            out.write(f'<user id="{user_id}"><name>{escape(user["name"])}</name></user>')
+        out.write("</users><loans>")
+        for loan in make_loans(rng, n_loans, n_books, n_users, today):
+            returned = "date_return" in loan
+            attrs = " ".join(
+                f"{name}={quoteattr(loan[name])}"
+                for name in ("book_id", "user_id", "date_out", "date_due")
+            )
+            extra = f' returned="true" date_return="{loan["date_return"]}"' if returned else ' returned="false"'
+            out.write(f"<loan {attrs}{extra} />")
+        out.write("</loans></library>\n")
+    return {"books": n_books, "users": n_users, "loans": n_loans}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic library.xml")
+    parser.add_argument("output", nargs="?", default="library.xml")
+    parser.add_argument("--size", type=int, default=1000, help="Total number of records")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--senegalese-share",
+        type=float,
+        default=0.5,
+        help="Share of Senegalese authors and users (0 to 1)",
+    )
+    args = parser.parse_args(argv)
+    counts = generate_library(Path(args.output), args.size, args.seed, args.senegalese_share)
+    print(
+        f"Wrote {args.output}: {counts['books']} books, "
+        f"{counts['users']} users, {counts['loans']} loans"
+    )
+
+
+if __name__ == "__main__":
+    main()
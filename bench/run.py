@@ -0,0 +1,293 @@
+"""Chronométrage des commandes et des routes web sur des bibliothèques générées.
+
+Pour chaque taille demandée, une bibliothèque est générée dans un dossier
+temporaire puis chaque commande de ``main`` et chaque route de
+``LibraryHandler`` y est exécutée en processus :
+
+- les consultations sont mesurées à froid (caches vidés, le fichier est
+  analysé) puis à chaud (bibliothèque en cache, ``--repeat`` essais) ; les
+  pages web cachables sont aussi mesurées servies par le cache de pages ;
+- les modifications sont enchaînées sur un livre et un utilisateur créés pour
+  l'occasion et mesurées une fois chacune, enregistrement compris.
+
+Les résultats sont écrits en JSON sur la sortie standard ou dans ``--output``.
+
+Utilisation::
+
+    python -m bench.run --sizes 1000 100000 1000000 --output results.json
+"""
+
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+import main
+import web_app
+from async_server import BufferedLibraryHandler
+from bench.generate import generate_library, iter_books, iter_users
+
+DEFAULT_SIZES = [1000, 100_000, 1_000_000]
+# Nombre de lignes des fichiers passés à ``import`` et ``batch``.
+IMPORT_ROWS = 1000
+BATCH_LINES = 10
+ACTIVE_LOANS_QUERY = (
+    'for $l in loans, $b in books where $l/@returned = "false" and $b/@id = $l/@book_id '
+    "order by $l/@date_due return ($b/title, $l/@date_due)"
+)
+
+
+class QuietHandler(BufferedLibraryHandler):
+    """Gestionnaire en mémoire qui ne journalise pas les requêtes."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _read_commands(ctx: dict) -> list[tuple[str, list[str]]]:
+    return [
+        ("list-books", ["list-books"]),
+        ("list-books --limit", ["list-books", "--limit", "20", "--offset", "1000"]),
+        ("list-books --sort", ["list-books", "--sort", "title", "--limit", "20"]),
+        ("list-books --stream", ["list-books", "--stream", "--limit", "20"]),
+        ("list-users", ["list-users"]),
+        ("list-users --sort", ["list-users", "--sort", "name", "--limit", "20"]),
+        ("list-loans", ["list-loans"]),
+        ("list-loans --sort", ["list-loans", "--sort", "date_due", "--limit", "20"]),
+        ("list-loans --stream", ["list-loans", "--stream", "--limit", "20"]),
+        ("list-loans --from", ["list-loans", "--include-archived", "--from", "2023-01", "--to", "2023-06"]),
+        ("search-books --author", ["search-books", "--author", ctx["author"]]),
+        ("search-books --genre --year", ["search-books", "--genre", "Roman", "--year", "1960"]),
+        ("search-books --year-from", ["search-books", "--year-from", "2000", "--year-to", "2001"]),
+        ("search-books --stream", ["search-books", "--stream", "--author", ctx["author"]]),
+        ("search-books --text", ["search-books", "--text", ctx["author"]]),
+        ("query join", ["query", ACTIVE_LOANS_QUERY]),
+        ("overdue", ["overdue"]),
+        ("search-loans --out-from", ["search-loans", "--out-from", "2024-01", "--out-to", "2024-01"]),
+        ("user-loans", ["user-loans", "1"]),
+        ("stats", ["stats"]),
+    ]
+
+
+def _write_commands(ctx: dict) -> list[tuple[str, object]]:
+    # Les identifiants créés par une étape servent aux suivantes : les
+    # arguments sont donc calculés juste avant chaque exécution.
+    return [
+        ("add-book", lambda: ["add-book", "Bench", "Aminata Sow Fall", "Roman", "1979"]),
+        ("add-user", lambda: ["add-user", "Bench Ndiaye"]),
+        ("loan-book", lambda: ["loan-book", _last_id("books"), _last_id("users")]),
+        ("extend-loan", lambda: ["extend-loan", _last_id("books"), "2099-01-01"]),
+        ("return-book", lambda: ["return-book", _last_id("books")]),
+        ("update-book", lambda: ["update-book", _last_id("books"), "--title", "Bench 2"]),
+        ("update-user", lambda: ["update-user", _last_id("users"), "Bench Fall"]),
+        ("delete-book", lambda: ["delete-book", _last_id("books")]),
+        ("delete-user", lambda: ["delete-user", _last_id("users")]),
+        ("import", lambda: ["import", str(ctx["import_file"])]),
+        ("batch", lambda: ["batch", str(ctx["batch_file"])]),
+        ("compact", lambda: ["compact"]),
+        ("archive-loans", lambda: ["archive-loans", "--before", "2022-01-01"]),
+    ]
+
+
+def _read_routes(ctx: dict) -> list[tuple[str, str]]:
+    return [
+        ("/", "/"),
+        ("/books", "/books"),
+        ("/books?sort", "/books?sort=title&offset=1000"),
+        ("/users", "/users"),
+        ("/loans", "/loans"),
+        ("/loans?sort", "/loans?sort=-date_due"),
+        ("/search-books", "/search-books"),
+        ("/search-books?author", f"/search-books?author={ctx['author']}"),
+        ("/search-books?year_from", "/search-books?year_from=2000&year_to=2001"),
+        ("/search-books?q", f"/search-books?q={quote(ctx['author'])}"),
+        ("/query?q", f"/query?q={quote(ACTIVE_LOANS_QUERY)}"),
+        ("/overdue", "/overdue"),
+        ("/search-loans?out_from", "/search-loans?out_from=2024-01&out_to=2024-01"),
+        ("/user-loans?id", "/user-loans?id=1"),
+        ("/stats", "/stats"),
+        ("/add-book", "/add-book"),
+        ("/update-book", "/update-book"),
+        ("/add-user", "/add-user"),
+        ("/update-user", "/update-user"),
+        ("/loan-book", "/loan-book"),
+        ("/return-book", "/return-book"),
+        ("/extend-loan", "/extend-loan"),
+    ]
+
+
+def _write_routes(ctx: dict) -> list[tuple[str, object]]:
+    return [
+        ("/add-book?title", lambda: "/add-book?title=Bench&author=Fatou+Diome&genre=Roman&year=2003"),
+        ("/add-user?name", lambda: "/add-user?name=Bench+Diallo"),
+        ("/loan-book?book_id", lambda: f"/loan-book?book_id={_last_id('books')}&user_id={_last_id('users')}"),
+        ("/extend-loan?book_id", lambda: f"/extend-loan?book_id={_last_id('books')}&new_date=2099-01-01"),
+        ("/return-book?book_id", lambda: f"/return-book?book_id={_last_id('books')}"),
+        ("/update-book?id", lambda: f"/update-book?id={_last_id('books')}&title=Bench+2"),
+        ("/update-user?id", lambda: f"/update-user?id={_last_id('users')}&name=Bench+Sarr"),
+        ("/delete-book?id", lambda: f"/delete-book?id={_last_id('books')}"),
+        ("/delete-user?id", lambda: f"/delete-user?id={_last_id('users')}"),
+    ]
+
+
+def _last_id(collection: str) -> str:
+    """Identifiant le plus récemment attribué dans ``collection``."""
+    store = main.load_store()
+    container = store.books if collection == "books" else store.users
+    return str(int(container.get("next_id")) - 1)
+
+
+def _cacheable(path: str) -> bool:
+    route, _, query = path.partition("?")
+    return route in web_app.CACHEABLE_PATHS or (route in web_app.FORM_PATHS and not query)
+
+
+def _clear_caches() -> None:
+    main.cache_clear()
+    web_app.PAGE_CACHE.clear()
+
+
+def _timed(func) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def _run_command(parser, argv: list[str]):
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        return main.run_command(parser, argv)
+
+
+def _get(path: str) -> int:
+    raw = f"GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode()
+    handler = QuietHandler(raw, ("127.0.0.1", 0))
+    status_line = handler.wfile.getvalue().split(b"\r\n", 1)[0]
+    return int(status_line.split()[1])
+
+
+def _summary(samples: list[float]) -> dict:
+    return {"min_s": min(samples), "median_s": statistics.median(samples)}
+
+
+def _measure_read(run, repeat: int, cacheable: bool = False) -> dict:
+    _clear_caches()
+    cold, result = _timed(run)
+    warm = []
+    for _ in range(repeat):
+        web_app.PAGE_CACHE.clear()
+        warm.append(_timed(run)[0])
+    measure = {"result": result, "cold_s": cold, "warm": _summary(warm)}
+    if cacheable:
+        # Première requête pour remplir le cache de pages, puis les mesures.
+        run()
+        measure["page_cache"] = _summary([_timed(run)[0] for _ in range(repeat)])
+    return measure
+
+
+def _prepare_inputs(directory: Path, seed: int) -> dict:
+    rng = random.Random(seed + 1)
+    import_file = directory / "books.csv"
+    with import_file.open("w", encoding="utf-8", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=["title", "author", "genre", "year"])
+        writer.writeheader()
+        writer.writerows(iter_books(rng, IMPORT_ROWS))
+    batch_file = directory / "batch.txt"
+    with batch_file.open("w", encoding="utf-8") as handle:
+        for user in iter_users(rng, BATCH_LINES):
+            handle.write(f"add-user '{user['name']}'\n")
+    return {"import_file": import_file, "batch_file": batch_file}
+
+
+def bench_size(size: int, seed: int, repeat: int, log) -> dict:
+    """Génère une bibliothèque de ``size`` enregistrements et chronomètre tout."""
+    with tempfile.TemporaryDirectory(prefix="library-bench-") as tmp:
+        directory = Path(tmp)
+        library = directory / "library.xml"
+        generate_s, counts = _timed(lambda: generate_library(library, size, seed))
+        main.LIBRARY_FILE = library
+        main.JOURNAL_MODE = False
+        ctx = _prepare_inputs(directory, seed)
+        ctx["author"] = "Diop"
+        parser = main.build_parser()
+        results = []
+
+        for name, argv in _read_commands(ctx):
+            log(f"  {name}")
+            measure = _measure_read(lambda: _run_command(parser, argv), repeat)
+            measure["ok"] = measure.pop("result") is not False
+            results.append({"kind": "command", "name": name, "argv": argv, **measure})
+
+        for name, path in _read_routes(ctx):
+            log(f"  GET {path}")
+            measure = _measure_read(lambda: _get(path), repeat, _cacheable(path))
+            measure["status"] = measure.pop("result")
+            results.append({"kind": "route", "name": name, "path": path, **measure})
+
+        for name, make_argv in _write_commands(ctx):
+            argv = make_argv()
+            log(f"  {name}")
+            elapsed, result = _timed(lambda: _run_command(parser, argv))
+            results.append(
+                {"kind": "command", "name": name, "argv": argv, "time_s": elapsed, "ok": result is not False}
+            )
+
+        for name, make_path in _write_routes(ctx):
+            path = make_path()
+            log(f"  GET {path}")
+            elapsed, status = _timed(lambda: _get(path))
+            results.append({"kind": "route", "name": name, "path": path, "time_s": elapsed, "status": status})
+
+        file_bytes = library.stat().st_size
+        _clear_caches()
+    return {
+        "size": size,
+        "records": counts,
+        "file_bytes": file_bytes,
+        "generate_s": generate_s,
+        "results": results,
+    }
+
+
+def main_cli(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark library commands and web routes")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Total records per library"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Warm runs per read benchmark")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr, flush=True)
+
+    report = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "runs": [],
+    }
+    for size in args.sizes:
+        log(f"size {size}")
+        report["runs"].append(bench_size(size, args.seed, args.repeat, log))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,133 @@
+"""Import en masse de livres, d'utilisateurs et de prêts historiques.
+
+Les fichiers CSV (avec ligne d'en-tête) ou JSONL (un objet par ligne) sont lus
+ligne à ligne et appliqués au magasin déjà chargé ; l'appelant n'enregistre
+qu'une seule fois à la fin.
+
+Les colonnes attendues sont :
+
+- livres : ``title``, ``author``, ``genre``, ``year``
+- utilisateurs : ``name``
+- prêts : ``book_id``, ``user_id``, ``date_out``, ``date_due`` et, pour un prêt
+  déjà rendu, ``date_return``
+
+Une colonne ``type`` (``book``, ``user`` ou ``loan``) permet de mélanger les
+trois sortes d'enregistrements dans un même fichier ; à défaut, la sorte est
+donnée par l'option ``--kind`` ou par le nom du fichier (``books.csv``).
+
+Une colonne ``id`` facultative sur les livres et utilisateurs sert uniquement à
+relier les prêts du même import : les enregistrements importés reçoivent
+toujours de nouveaux identifiants.
+"""
+
+import csv
+import datetime
+import json
+from pathlib import Path
+
+from storage import Storage
+
+KINDS = {
+    "book": "book",
+    "books": "book",
+    "user": "user",
+    "users": "user",
+    "loan": "loan",
+    "loans": "loan",
+}
+
+
+class InvalidRow(ValueError):
+    """Ligne d'import rejetée lors de la validation."""
+
+
+def detect_format(path: Path) -> str:
+    """Déduit le format (``csv`` ou ``jsonl``) de l'extension du fichier."""
+    return "jsonl" if path.suffix.lower() in {".jsonl", ".ndjson", ".json"} else "csv"
+
+
+def iter_rows(path: Path, fmt: str):
+    """Produit les couples (numéro de ligne, dictionnaire) du fichier."""
+    with path.open(encoding="utf-8", newline="") as handle:
+        if fmt == "csv":
+            reader = csv.DictReader(handle)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(handle, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_no, None
+
+
+class Importer:
+    """Applique des lignes d'import au magasin en validant chacune d'elles."""
+
+    def __init__(self, store: Storage) -> None:
+        self.store = store
+        self.counts = {"book": 0, "user": 0, "loan": 0}
+        self.rejected = 0
+        # Identifiants source -> identifiants attribués pendant cet import.
+        self._book_ids: dict[str, str] = {}
+        self._user_ids: dict[str, str] = {}
+
+    def add(self, row: dict, kind: str | None = None) -> None:
+        """Valide et applique une ligne ; lève ``InvalidRow`` si elle est invalide."""
+        if not isinstance(row, dict):
+            raise InvalidRow("malformed line")
+        kind = KINDS.get((row.get("type") or kind or "").strip().lower())
+        if kind is None:
+            raise InvalidRow("unknown record type")
+        getattr(self, f"_add_{kind}")(row)
+        self.counts[kind] += 1
+
+    def _add_book(self, row: dict) -> None:
+        title, author, genre = (_required(row, f) for f in ("title", "author", "genre"))
+        year = _required(row, "year")
+        try:
+            year = int(year)
+        except ValueError:
+            raise InvalidRow(f"invalid year {year!r}") from None
+        book = self.store.add_book(title, author, genre, year)
+        if row.get("id"):
+            self._book_ids[str(row["id"])] = book.get("id")
+
+    def _add_user(self, row: dict) -> None:
+        user = self.store.add_user(_required(row, "name"))
+        if row.get("id"):
+            self._user_ids[str(row["id"])] = user.get("id")
+
+    def _add_loan(self, row: dict) -> None:
+        source_book = _required(row, "book_id")
+        source_user = _required(row, "user_id")
+        book_id = self._book_ids.get(source_book, source_book)
+        user_id = self._user_ids.get(source_user, source_user)
+        if self.store.book(book_id) is None:
+            raise InvalidRow(f"unknown book {source_book!r}")
+        if self.store.user(user_id) is None:
+            raise InvalidRow(f"unknown user {source_user!r}")
+        date_out = _date(row, "date_out")
+        date_due = _date(row, "date_due")
+        date_return = _date(row, "date_return") if row.get("date_return") else None
+        if date_return is None and self.store.active_loan(book_id) is not None:
+            raise InvalidRow(f"book {source_book!r} already on loan")
+        self.store.add_loan(book_id, user_id, date_out, date_due, date_return)
+
+
+def _required(row: dict, field: str) -> str:
+    value = row.get(field)
+    if value is None or not str(value).strip():
+        raise InvalidRow(f"missing {field}")
+    return str(value).strip()
+
+
+def _date(row: dict, field: str) -> str:
+    value = _required(row, field)
+    try:
+        datetime.date.fromisoformat(value)
+    except ValueError:
+        raise InvalidRow(f"invalid {field} {value!r}") from None
+    return value
@@ -2,147 +2,762 @@
 
 Ce module permet d'ajouter des livres, des utilisateurs et de suivre les prêts
 grâce à une interface en ligne de commande.
+
+Les données sont lues et écrites par un moteur de stockage (``storage``) :
+``library.xml`` par défaut, ou la base ``library.sqlite`` lorsqu'elle existe
+ou que ``--backend sqlite`` est demandé. ``library.xml`` reste le format
+d'échange (``import-xml`` et ``export-xml``).
 """
 
 import argparse
+import contextlib
 import datetime
+import gc
+import hashlib
+import io
+import itertools
+import json
+import os
+import shlex
+import shutil
+import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou entre processus.
+    fcntl = None
+
+import metrics
+import snapshot
+from archive import GRANULARITIES, in_range, is_period, iter_archived, write_segments
+from importer import Importer, InvalidRow, detect_format, iter_rows
+from query import QueryError, compile_query, display
+from search_index import BookQuery, LoanQuery
+from sqlite_store import SQLiteStore
+from storage import Storage
+from store import COLLECTIONS, SORT_KEYS, LibraryStore
+from streaming import iter_loans_with_names, iter_records
+
 
 LIBRARY_FILE = Path("library.xml")
 
+# En mode journal, chaque enregistrement ajoute les opérations effectuées à
+# ``library.journal`` au lieu de réécrire tout le fichier XML.
+JOURNAL_MODE = False
+# Taille du journal au-delà de laquelle il est replié dans le fichier XML.
+JOURNAL_COMPACT_BYTES = 1024 * 1024
 
-def load_library() -> ET.ElementTree:
-    """Charge le fichier XML de la bibliothèque en le créant si besoin."""
+# Moteur de stockage imposé par --backend (« xml » ou « sqlite ») ; sans
+# choix explicite, la base SQLite est utilisée dès qu'elle existe.
+BACKEND = None
+
+# Tant qu'un lot de commandes est en cours, save_store laisse les
+# modifications en attente dans le magasin ; le lot enregistre à la fin.
+_deferred_saves = 0
+
+# Verrou exclusif entre processus (fichier library.lock), réentrant au sein
+# d'un même processus et partagé par tous ses fils d'exécution.
+_process_lock = threading.RLock()
+_lock_depth = 0
+
+# Magasins déjà chargés, indexés par chemin de fichier : (signature, magasin).
+_library_cache: dict[str, tuple[tuple, Storage]] = {}
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+def journal_path() -> Path:
+    """Retourne le chemin du journal associé au fichier de bibliothèque."""
+    return LIBRARY_FILE.with_suffix(".journal")
+
+
+def snapshot_path() -> Path:
+    """Retourne le chemin de l'instantané binaire associé au fichier XML."""
+    return LIBRARY_FILE.with_suffix(".snapshot")
+
+
+def stats_path() -> Path:
+    """Retourne le chemin des compteurs de statistiques conservés à côté du fichier XML."""
+    return LIBRARY_FILE.with_suffix(".stats")
+
+
+def text_index_path() -> Path:
+    """Retourne le chemin de l'index plein texte conservé à côté du fichier XML."""
+    return LIBRARY_FILE.with_suffix(".textindex")
+
+
+def archived_loans():
+    """Parcourt les prêts des segments d'archive."""
+    return iter_archived(archive_dir())
+
+
+def database_path() -> Path:
+    """Retourne le chemin de la base SQLite associée au fichier XML."""
+    return LIBRARY_FILE.with_suffix(".sqlite")
+
+
+def using_database() -> bool:
+    """Indique si la bibliothèque est stockée dans la base SQLite."""
+    if BACKEND is not None:
+        return BACKEND == "sqlite"
+    return database_path().exists()
+
+
+def split_dir() -> Path:
+    """Retourne le dossier du stockage éclaté (``library/`` à côté de ``library.xml``)."""
+    return LIBRARY_FILE.with_suffix("")
+
+
+def is_split() -> bool:
+    """Indique si la bibliothèque est stockée en un fichier par collection."""
+    return split_dir().is_dir()
+
+
+def collection_file(collection: str) -> Path:
+    """Retourne le fichier qui contient ``collection``."""
+    return split_dir() / f"{collection}.xml" if is_split() else LIBRARY_FILE
+
+
+def archive_dir() -> Path:
+    """Retourne le dossier des segments d'archive des prêts."""
+    return LIBRARY_FILE.with_name(LIBRARY_FILE.stem + "-archive")
+
+
+def library_files() -> list[Path]:
+    """Retourne les fichiers existants de la bibliothèque, journal compris."""
+    if using_database():
+        candidates = [database_path()]
+    elif is_split():
+        candidates = [split_dir() / f"{collection}.xml" for collection in COLLECTIONS]
+    else:
+        candidates = [LIBRARY_FILE, journal_path()]
+    return [path for path in candidates if path.exists()]
+
+
+def _file_signature(path: Path) -> tuple[int, int, int]:
+    """Retourne la signature (mtime, taille, inode) utilisée pour le cache."""
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _library_signature() -> tuple:
+    """Retourne la signature du fichier XML et de son éventuel journal.
+
+    En stockage éclaté, la signature compte un élément par collection ; en
+    base SQLite, elle ne porte que sur le fichier de la base.
+    """
+    if using_database():
+        paths = [database_path()]
+    elif is_split():
+        paths = [split_dir() / f"{collection}.xml" for collection in COLLECTIONS]
+    else:
+        paths = [LIBRARY_FILE, journal_path()]
+    return tuple(_file_signature(path) if path.exists() else None for path in paths)
+
+
+def _cache_key() -> str:
+    return str(database_path() if using_database() else LIBRARY_FILE)
+
+
+def _remember(store: Storage) -> None:
+    """Associe le magasin à l'état actuel des fichiers dans le cache."""
+    _library_cache[_cache_key()] = (_library_signature(), store)
+
+
+def library_version() -> tuple[str, float]:
+    """Retourne un jeton de version de la bibliothèque et sa date de modification.
+
+    Seuls les fichiers sont interrogés, sans analyse XML : le jeton change à
+    chaque enregistrement, quel que soit le processus qui écrit.
+    """
+    if not library_files():
+        load_store()
+    signature = _library_signature()
+    token = hashlib.blake2s(repr(signature).encode(), digest_size=8).hexdigest()
+    modified = max(part[0] for part in signature if part is not None) / 1e9
+    return token, modified
+
+
+def cache_info() -> dict[str, int]:
+    """Retourne les compteurs de succès et d'échecs du cache de chargement."""
+    return {**_cache_stats, "entries": len(_library_cache)}
+
+
+def cache_clear() -> None:
+    """Vide le cache des bibliothèques analysées et remet les compteurs à zéro."""
+    _library_cache.clear()
+    _cache_stats["hits"] = 0
+    _cache_stats["misses"] = 0
+
+
+def _read_journal(path: Path) -> list[dict]:
+    """Lit les opérations du journal en ignorant les lignes incomplètes."""
+    ops = []
+    with path.open(encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                ops.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Écriture interrompue : l'opération n'a jamais été validée.
+                continue
+    return ops
+
+
+@metrics.timed("save")
+def _append_journal(ops: list[dict]) -> None:
+    """Ajoute des opérations à la fin du journal, une par ligne."""
+    with journal_path().open("a+b") as handle:
+        if handle.tell():
+            handle.seek(-1, os.SEEK_END)
+            if handle.read(1) != b"\n":
+                handle.write(b"\n")
+        handle.write(
+            b"".join(
+                json.dumps(op, ensure_ascii=False).encode("utf-8") + b"\n" for op in ops
+            )
+        )
+        handle.flush()
+        os.fsync(handle.fileno())
+
+
+@contextlib.contextmanager
+def library_lock():
+    """Sérialise un cycle chargement/modification/enregistrement.
+
+    Le verrou est posé avec ``flock`` sur ``library.lock`` pour exclure les
+    autres processus (commandes en ligne, serveur) et avec un verrou
+    réentrant pour les autres fils du processus courant.
+    """
+    global _lock_depth
+    with _process_lock:
+        handle = None
+        if _lock_depth == 0 and fcntl is not None:
+            handle = LIBRARY_FILE.with_suffix(".lock").open("a")
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+            if handle is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+
+
+def load_store() -> Storage:
+    """Charge la bibliothèque et ses index en créant le fichier si besoin.
+
+    Le journal éventuel est rejoué par-dessus le dernier instantané XML. Le
+    magasin est conservé en mémoire et réutilisé tant que la date de
+    modification, la taille et l'inode des fichiers restent inchangés.
+    """
+    if using_database():
+        return _open_database()
+    if is_split():
+        return _load_split_store()
     if not LIBRARY_FILE.exists():
         root = ET.Element("library")
         ET.SubElement(root, "books")
         ET.SubElement(root, "users")
         ET.SubElement(root, "loans")
-        tree = ET.ElementTree(root)
-        tree.write(LIBRARY_FILE, encoding="utf-8", xml_declaration=True)
-    return ET.parse(LIBRARY_FILE)
+        save_library(ET.ElementTree(root))
+    key = str(LIBRARY_FILE)
+    signature = _library_signature()
+    cached = _library_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        _cache_stats["hits"] += 1
+        return cached[1]
+    _cache_stats["misses"] += 1
+    with metrics.phase("parse"):
+        store = _load_snapshot() or LibraryStore(ET.parse(LIBRARY_FILE))
+        _restore_states(store)
+        if signature[1] is not None:
+            store.replay(_read_journal(journal_path()))
+    _library_cache[key] = (signature, store)
+    return store
+
+
+def _open_database() -> SQLiteStore:
+    """Ouvre la base SQLite, créée vide si besoin.
+
+    La base se charge d'elle-même de la cohérence entre processus : le
+    magasin n'est rouvert que si le fichier a été remplacé (``import-xml``).
+    """
+    key = str(database_path())
+    cached = _library_cache.get(key)
+    if cached is not None and database_path().exists():
+        if cached[0][0][2] == database_path().stat().st_ino:
+            _cache_stats["hits"] += 1
+            return cached[1]
+    _cache_stats["misses"] += 1
+    with metrics.phase("parse"):
+        store = SQLiteStore(database_path())
+    _remember(store)
+    return store
+
+
+def _load_snapshot() -> LibraryStore | None:
+    """Reconstruit le magasin depuis l'instantané binaire s'il décrit le fichier actuel."""
+    path = snapshot_path()
+    if not path.exists():
+        return None
+    # Des centaines de milliers d'objets sont créés d'un coup : le ramasse-miettes
+    # n'y trouverait rien à libérer.
+    gc.disable()
+    try:
+        loaded = snapshot.read(path, snapshot.source_key(LIBRARY_FILE))
+        if loaded is None:
+            return None
+        tree, indexes = loaded
+        return LibraryStore(tree, indexes=indexes)
+    finally:
+        gc.enable()
+
+
+# États calculés à partir de library.xml et conservés à côté de lui :
+# nom -> (fichier, état du magasin ou None, reprise par le magasin).
+_STATES = {
+    "stats": (stats_path, LibraryStore.stats_state, LibraryStore.restore_stats),
+    "text": (text_index_path, LibraryStore.text_state, LibraryStore.restore_text),
+}
+
+
+def _restore_states(store: LibraryStore) -> None:
+    """Reprend les états conservés pour le ``library.xml`` actuel.
+
+    Les compteurs sont relus tout de suite ; l'index plein texte, plus gros,
+    seulement à la première recherche.
+    """
+    key = snapshot.source_key(LIBRARY_FILE)
+    counters = snapshot.read_state(stats_path(), key)
+    if counters is not None:
+        store.restore_stats(counters)
+    if text_index_path().exists():
+        store.restore_text(lambda: snapshot.read_state(text_index_path(), key))
+
+
+def _write_states(store: Storage, names=tuple(_STATES)) -> None:
+    """Conserve les états ``names`` de ``store`` s'ils décrivent exactement ``library.xml``.
+
+    En base SQLite, en stockage éclaté, ou tant qu'un journal ou des
+    modifications en attente s'y ajoutent, rien n'est écrit ; un état pas
+    encore calculé non plus.
+    """
+    if not isinstance(store, LibraryStore) or is_split() or store.pending or journal_path().exists():
+        return
+    if not LIBRARY_FILE.exists():
+        return
+    key = snapshot.source_key(LIBRARY_FILE)
+    for name in names:
+        path, current, _ = _STATES[name]
+        state = current(store)
+        if state is not None:
+            snapshot.write_state(path(), state, key)
+
+
+@metrics.timed("save")
+def _write_snapshot(store: LibraryStore) -> bool:
+    """Écrit l'instantané binaire de ``store`` ; le supprime si l'arbre ne s'y prête pas."""
+    try:
+        snapshot.write(snapshot_path(), store.tree, store.index_state(), snapshot.source_key(LIBRARY_FILE))
+    except snapshot.Unsupported as exc:
+        snapshot_path().unlink(missing_ok=True)
+        print(f"Snapshot removed: {exc}", file=sys.stderr)
+        return False
+    return True
+
+
+def _load_collection(collection: str) -> ET.Element:
+    """Lit le fichier d'une collection du stockage éclaté."""
+    path = split_dir() / f"{collection}.xml"
+    if not path.exists():
+        return ET.Element(collection)
+    return ET.parse(path).getroot()
+
+
+def _load_split_store() -> LibraryStore:
+    """Charge le stockage éclaté, chaque collection à son premier usage.
+
+    Lorsqu'un autre processus a réécrit certains fichiers, seules les
+    collections correspondantes sont relues à la demande, dans un nouveau
+    magasin.
+    """
+    key = str(LIBRARY_FILE)
+    signature = _library_signature()
+    cached = _library_cache.get(key)
+    if cached is not None and len(cached[0]) == len(signature):
+        previous, store = cached
+        if previous == signature:
+            _cache_stats["hits"] += 1
+            return store
+        _cache_stats["misses"] += 1
+        # Les modifications jamais enregistrées sont abandonnées, comme lors
+        # d'un rechargement complet. Un nouveau magasin reprend les
+        # collections intactes : l'ancien reste entier pour les lecteurs qui
+        # le parcourent encore.
+        stale = store.dirty_collections()
+        stale.update(c for c, old, new in zip(COLLECTIONS, previous, signature) if old != new)
+        store = store.reloaded(stale)
+    else:
+        _cache_stats["misses"] += 1
+        store = LibraryStore(ET.ElementTree(ET.Element("library")), loader=_load_collection)
+    _library_cache[key] = (signature, store)
+    return store
+
+
+def load_library() -> ET.ElementTree:
+    """Charge le fichier XML de la bibliothèque en le créant si besoin."""
+    return load_store().to_tree()
+
+
+@metrics.timed("save")
+def _write_atomic(tree: ET.ElementTree, path: Path) -> None:
+    temporary = path.with_name(path.name + ".tmp")
+    tree.write(temporary, encoding="utf-8", xml_declaration=True)
+    os.replace(temporary, path)
 
 
 def save_library(tree: ET.ElementTree) -> None:
-    """Enregistre l'arbre XML dans le fichier de bibliothèque."""
-    tree.write(LIBRARY_FILE, encoding="utf-8", xml_declaration=True)
+    """Enregistre l'arbre XML complet dans le fichier de bibliothèque.
+
+    L'écriture passe par un fichier temporaire renommé ensuite, puis le
+    journal, désormais intégré à l'instantané, est supprimé. Le magasin
+    correspondant remplace l'entrée du cache afin que le prochain chargement
+    n'ait pas à relire le fichier.
+
+    En stockage éclaté, seuls les fichiers des collections touchées par les
+    opérations en attente sont réécrits. Sinon, l'instantané binaire, s'il a
+    été créé par ``rebuild-snapshot``, est réécrit à la suite.
+    """
+    cached = _library_cache.get(str(LIBRARY_FILE))
+    owned = cached is not None and cached[1].tree is tree
+    if is_split():
+        # Seuls les fichiers des collections modifiées sont réécrits.
+        store = cached[1] if owned else LibraryStore(tree)
+        collections = store.dirty_collections() if owned else COLLECTIONS
+        for collection in collections:
+            _write_atomic(ET.ElementTree(getattr(store, collection)), split_dir() / f"{collection}.xml")
+        store.pending.clear()
+        _remember(store)
+        return
+    _write_atomic(tree, LIBRARY_FILE)
+    journal_path().unlink(missing_ok=True)
+    if owned:
+        store = cached[1]
+        store.pending.clear()
+    else:
+        store = LibraryStore(tree)
+    if snapshot_path().exists():
+        _write_snapshot(store)
+    _write_states(store)
+    _remember(store)
+
+
+def save_store(store: Storage) -> None:
+    """Enregistre les modifications du magasin.
+
+    En mode journal, seules les opérations en attente sont ajoutées au
+    journal ; celui-ci est replié dans le fichier XML lorsqu'il dépasse
+    ``JOURNAL_COMPACT_BYTES``. Sinon le fichier XML est réécrit. Le stockage
+    éclaté n'utilise pas de journal : chaque fichier y est déjà petit. En
+    base SQLite, la transaction en cours est validée.
+    """
+    if _deferred_saves:
+        return
+    if store.loaded("loans") and "loans" in store.dirty_collections():
+        _apply_archive_policy(store)
+    if isinstance(store, SQLiteStore):
+        _commit_database(store)
+        return
+    if not JOURNAL_MODE or is_split():
+        save_library(store.tree)
+        return
+    if store.pending:
+        _append_journal(store.pending)
+        store.pending.clear()
+    journal = journal_path()
+    if journal.exists() and journal.stat().st_size > JOURNAL_COMPACT_BYTES:
+        save_library(store.tree)
+    else:
+        _remember(store)
+
+
+@metrics.timed("save")
+def _commit_database(store: SQLiteStore) -> None:
+    store.commit()
+    _remember(store)
+
+
+def save_all(store: Storage) -> None:
+    """Enregistre tout le magasin sans passer par le journal."""
+    if isinstance(store, SQLiteStore):
+        _commit_database(store)
+    else:
+        save_library(store.tree)
+
+
+def _archive(store: Storage, before: str, by: str) -> int:
+    """Archive les prêts rendus avant ``before`` ; retourne leur nombre.
+
+    Les segments sont écrits avant l'enregistrement de la bibliothèque : une
+    interruption entre les deux laisse au pire des prêts en double, que le
+    prochain archivage ne recopie pas.
+    """
+    archived = store.archive_loans(before)
+    write_segments(archive_dir(), archived, by)
+    return len(archived)
+
+
+def _apply_archive_policy(store: Storage) -> None:
+    """Exécute l'archivage automatique au plus une fois par jour."""
+    policy = store.archive_policy()
+    if policy is None:
+        return
+    after_days, by = policy
+    cutoff = (datetime.date.today() - datetime.timedelta(days=after_days)).isoformat()
+    if store.archived_before() < cutoff:
+        _archive(store, cutoff, by)
+
+
+def discard_changes() -> None:
+    """Abandonne les modifications en mémoire qui n'ont pas été enregistrées.
+
+    Le prochain chargement relira les fichiers depuis le disque ; en base
+    SQLite, la transaction en cours est annulée.
+    """
+    cached = _library_cache.pop(_cache_key(), None)
+    if cached is not None and isinstance(cached[1], SQLiteStore):
+        cached[1].rollback()
+
+
+def compact_library() -> None:
+    """Intègre le journal dans ``library.xml`` et le supprime."""
+    save_all(load_store())
 
 
 def add_book(args) -> None:
     """Ajoute un nouvel ouvrage à la bibliothèque."""
-    tree = load_library()
-    root = tree.getroot()
-    books = root.find("books")
-    # determine next id
-    ids = [int(book.get("id")) for book in books.findall("book")]
-    next_id = max(ids, default=0) + 1
-
-    book = ET.SubElement(books, "book", id=str(next_id))
-    ET.SubElement(book, "title").text = args.title
-    ET.SubElement(book, "author").text = args.author
-    ET.SubElement(book, "genre").text = args.genre
-    ET.SubElement(book, "year").text = str(args.year)
-
-    save_library(tree)
-    print(f"Book added with id {next_id}")
-
-
-def list_books(_args) -> None:
-    """Affiche la liste de tous les livres."""
-    tree = load_library()
-    for book in tree.getroot().findall("books/book"):
+    store = load_store()
+    book = store.add_book(args.title, args.author, args.genre, args.year)
+    save_store(store)
+    print(f"Book added with id {book.get('id')}")
+
+
+def _can_stream(args) -> bool:
+    """Indique si une commande de consultation peut lire le fichier en flux.
+
+    Tant qu'un journal n'est pas replié, qu'un lot garde des modifications
+    en mémoire ou que la bibliothèque est en base SQLite, le fichier XML seul
+    n'est pas à jour : on passe alors par le magasin chargé.
+    """
+    return (
+        args.stream
+        and not using_database()
+        and not _deferred_saves
+        and all(collection_file(collection).exists() for collection in COLLECTIONS)
+        and not journal_path().exists()
+    )
+
+
+def _page(args, collection: str, stream):
+    """Retourne la page demandée par une commande de listing.
+
+    En lecture en flux (sans tri), la page est découpée au fil de la lecture ;
+    sinon elle est extraite des index ordonnés du magasin et un résumé
+    « -- début-fin of total » est écrit sur la sortie d'erreur.
+    """
+    if _can_stream(args) and not args.sort and not args.reverse:
+        stop = None if args.limit is None else args.offset + args.limit
+        return itertools.islice(stream(), args.offset, stop)
+    sort = args.sort or "id"
+    if args.reverse:
+        sort = sort[1:] if sort.startswith("-") else f"-{sort}"
+    store = load_store()
+    items, total = store.page(collection, sort, args.offset, args.limit)
+    _print_range(args, items, total)
+    if collection == "loans":
+        return _loans_with_names(store, items)
+    return items
+
+
+def _print_range(args, items, total: int) -> None:
+    """Écrit « -- début-fin of total » sur la sortie d'erreur pour une page partielle."""
+    if args.limit is not None or args.offset:
+        if items:
+            print(f"-- {args.offset + 1}-{args.offset + len(items)} of {total}", file=sys.stderr)
+        else:
+            print(f"-- 0 of {total}", file=sys.stderr)
+
+
+def list_books(args) -> None:
+    """Affiche la liste des livres, éventuellement paginée et triée."""
+    for book in _page(args, "books", lambda: iter_records(collection_file("books"), {"book"})):
         print(f"[{book.get('id')}] {book.findtext('title')} by {book.findtext('author')}")
 
 
 def search_books(args) -> None:
-    """Recherche des livres selon différents critères."""
-    tree = load_library()
-    for book in tree.getroot().findall("books/book"):
-        if args.author and args.author.lower() not in book.findtext("author").lower():
-            continue
-        if args.genre and args.genre.lower() not in book.findtext("genre").lower():
-            continue
-        if args.year and str(args.year) != book.findtext("year"):
-            continue
+    """Recherche des livres selon différents critères.
+
+    Auteur et genre sont comparés mot à mot, sans tenir compte des accents ni
+    de la casse, chaque mot recherché pouvant être un début de mot. Avec
+    ``--text``, les mots sont cherchés dans le titre, l'auteur et le genre et
+    les livres sont affichés du plus pertinent au moins pertinent ; le
+    classement demande l'index, la lecture en flux est alors ignorée. Avec
+    ``library.xml``, l'index est conservé dans ``library.textindex``.
+    """
+    query = BookQuery(args.author, args.genre, args.year, args.year_from, args.year_to, args.text)
+    if _can_stream(args) and not query.text:
+        books = (b for b in iter_records(collection_file("books"), {"book"}) if query.matches(b))
+    else:
+        store = load_store()
+        # Un index plein texte construit ici est conservé pour les commandes suivantes.
+        unsaved = (
+            query.text
+            and isinstance(store, LibraryStore)
+            and not is_split()
+            and store.text_state() is None
+            and not snapshot.state_current(text_index_path(), snapshot.source_key(LIBRARY_FILE))
+        )
+        books = store.search_books(query)
+        if unsaved:
+            _write_states(store, ["text"])
+    for book in books:
         print(f"[{book.get('id')}] {book.findtext('title')} by {book.findtext('author')}")
 
 
+def run_query(args) -> None:
+    """Évalue une requête FLWOR et affiche une ligne par résultat.
+
+    Les éléments d'une même ligne sont séparés par « | » ; avec ``--explain``,
+    le plan choisi (index, jointures, filtres) est affiché à la place.
+    """
+    text = sys.stdin.read() if args.expression == "-" else args.expression
+    try:
+        compiled = compile_query(text)
+    except QueryError as exc:
+        print(f"Invalid query: {exc}")
+        return False
+    if args.explain:
+        print("\n".join(compiled.explain()))
+        return None
+    store = load_store()
+    try:
+        with metrics.phase("query"):
+            rows = list(itertools.islice(compiled.rows(store), args.limit))
+    except QueryError as exc:
+        print(f"Invalid query: {exc}")
+        return False
+    for row in rows:
+        print(" | ".join(display(item) for item in row))
+
+
 def add_user(args) -> None:
     """Ajoute un utilisateur à la bibliothèque."""
-    tree = load_library()
-    users = tree.getroot().find("users")
-    ids = [int(u.get("id")) for u in users.findall("user")]
-    next_id = max(ids, default=0) + 1
-    user = ET.SubElement(users, "user", id=str(next_id))
-    ET.SubElement(user, "name").text = args.name
-    save_library(tree)
-    print(f"User added with id {next_id}")
+    store = load_store()
+    user = store.add_user(args.name)
+    save_store(store)
+    print(f"User added with id {user.get('id')}")
 
 
 def loan_book(args) -> None:
     """Enregistre le prêt d'un livre à un utilisateur."""
-    tree = load_library()
-    root = tree.getroot()
+    store = load_store()
     # verify book and user exist
-    book = root.find(f"books/book[@id='{args.book_id}']")
-    user = root.find(f"users/user[@id='{args.user_id}']")
-    if book is None:
+    if store.book(args.book_id) is None:
         print("Book not found")
-        return
-    if user is None:
+        return False
+    if store.user(args.user_id) is None:
         print("User not found")
-        return
-    loans = root.find("loans")
-    existing = loans.find(f"loan[@book_id='{args.book_id}'][@returned='false']")
-    if existing is not None:
+        return False
+    if store.active_loan(args.book_id) is not None:
         print("Book already on loan")
-        return
-    loan = ET.SubElement(loans, "loan", book_id=str(args.book_id), user_id=str(args.user_id))
-    loan.set("date_out", args.date_out)
-    loan.set("date_due", args.date_due)
-    loan.set("returned", "false")
-    save_library(tree)
+        return False
+    store.add_loan(args.book_id, args.user_id, args.date_out, args.date_due)
+    save_store(store)
     print("Loan recorded")
 
 
-def _find_book_id(root: ET.Element, identifier: str) -> str | None:
-    """Retourne l'identifiant du livre correspondant à l'id ou au titre."""
-    book = root.find(f"books/book[@id='{identifier}']")
+def _active_loan_for(store: Storage, identifier: str):
+    """Retourne le prêt en cours du livre désigné, ou affiche pourquoi il n'y en a pas.
+
+    Un identifiant de livre emprunté est résolu par le seul index des prêts :
+    en stockage éclaté, le fichier des livres n'est alors pas lu.
+    """
+    loan = store.active_loan(identifier)
+    if loan is not None:
+        return loan
+    book = store.find_book(identifier)
     if book is None:
-        book = root.find(f"books/book[title='{identifier}']")
-    return book.get("id") if book is not None else None
+        print("Book not found")
+        return None
+    loan = store.active_loan(book.get("id"))
+    if loan is None:
+        print("Loan not found")
+    return loan
 
 
 def return_book(args) -> None:
     """Note le retour d'un livre emprunté."""
-    tree = load_library()
-    root = tree.getroot()
-    book_id = _find_book_id(root, args.book_id)
-    if book_id is None:
-        print("Book not found")
-        return
-    loans = root.find("loans")
-    loan = loans.find(f"loan[@book_id='{book_id}'][@returned='false']")
+    store = load_store()
+    loan = _active_loan_for(store, args.book_id)
     if loan is None:
-        print("Loan not found")
-        return
-    loan.set("returned", "true")
-    loan.set("date_return", args.date_return)
-    save_library(tree)
+        return False
+    store.return_loan(loan, args.date_return)
+    save_store(store)
     print("Book returned")
 
 
-def list_loans(_args) -> None:
-    """Affiche l'ensemble des prêts enregistrés."""
-    tree = load_library()
-    root = tree.getroot()
-    for loan in root.findall("loans/loan"):
-        book = root.find(f"books/book[@id='{loan.get('book_id')}']")
-        user = root.find(f"users/user[@id='{loan.get('user_id')}']")
+def _loans_with_names(store: Storage, loans):
+    """Produit chaque prêt avec le titre du livre et le nom de l'utilisateur."""
+    for loan in loans:
+        book = store.book(loan.get("book_id"))
+        user = store.user(loan.get("user_id"))
         book_title = book.findtext("title") if book is not None else loan.get("book_id")
         user_name = user.findtext("name") if user is not None else loan.get("user_id")
+        yield loan, book_title, user_name
+
+
+def _history_page(args):
+    """Page de prêts filtrés par date de sortie, archives comprises si demandé.
+
+    Seuls les segments d'archive qui chevauchent ``--from``/``--to`` sont lus.
+    """
+    store = load_store()
+    loans = []
+    if args.include_archived:
+        loans.extend(iter_archived(archive_dir(), args.date_from, args.date_to))
+    loans.extend(l for l in store.iter_loans() if in_range(l, args.date_from, args.date_to))
+    field = (args.sort or "id").lstrip("-")
+    descending = (args.sort or "").startswith("-") != args.reverse
+    key = SORT_KEYS["loans"][field]
+    if key is not None:
+        loans.sort(key=key, reverse=descending)
+    elif descending:
+        loans.reverse()
+    stop = None if args.limit is None else args.offset + args.limit
+    items = loans[args.offset:stop]
+    _print_range(args, items, len(loans))
+    return _loans_with_names(store, items)
+
+
+def list_loans(args) -> None:
+    """Affiche les prêts enregistrés, éventuellement paginés et triés."""
+    if args.include_archived or args.date_from or args.date_to:
+        rows = _history_page(args)
+    else:
+        rows = _page(
+            args,
+            "loans",
+            lambda: iter_loans_with_names(dict.fromkeys(map(collection_file, COLLECTIONS))),
+        )
+    _print_loans(rows)
+
+
+def _print_loans(rows) -> None:
+    for loan, book_title, user_name in rows:
         status = "returned" if loan.get("returned") == "true" else "on loan"
         print(
             f"Book {book_title} to user {user_name} "
@@ -150,100 +765,552 @@ def list_loans(_args) -> None:
         )
 
 
-def list_users(_args) -> None:
-    """Affiche tous les utilisateurs enregistrés."""
-    tree = load_library()
-    for user in tree.getroot().findall("users/user"):
+def search_loans(args) -> None:
+    """Recherche les prêts par date de sortie ou de retour prévue.
+
+    Seuls les prêts en cours sont concernés, sauf avec ``--include-returned`` ;
+    les index triés par date évitent de parcourir tous les prêts.
+    """
+    query = LoanQuery(args.out_from, args.out_to, args.due_before, args.include_returned)
+    store = load_store()
+    _print_loans(_loans_with_names(store, store.search_loans(query)))
+
+
+def overdue(args) -> None:
+    """Affiche les prêts en cours dont la date de retour prévue est dépassée.
+
+    Les prêts sont lus dans l'index des prêts en cours trié par date de
+    retour prévue, du plus en retard au moins en retard.
+    """
+    on = args.on or datetime.date.today().isoformat()
+    store = load_store()
+    loans = store.search_loans(LoanQuery(due_before=on))
+    for loan, book_title, user_name in _loans_with_names(store, loans):
+        late = _days_between(loan.get("date_due"), on)
+        suffix = f" ({late} days late)" if late is not None else ""
+        print(f"Book {book_title} to user {user_name} was due {loan.get('date_due')}{suffix}")
+    print(f"{len(loans)} overdue loans on {on}", file=sys.stderr)
+
+
+def _days_between(start: str | None, end: str) -> int | None:
+    try:
+        return (datetime.date.fromisoformat(end) - datetime.date.fromisoformat(start or "")).days
+    except ValueError:
+        return None
+
+
+def user_loans(args) -> None:
+    """Affiche l'historique des prêts d'un utilisateur, en cours et rendus.
+
+    Les prêts sont lus dans l'index des prêts par utilisateur, sans parcourir
+    les autres ; avec ``--include-archived``, les segments d'archive sont en
+    revanche lus en entier.
+    """
+    store = load_store()
+    user = store.find_user(args.user_id)
+    if user is None:
+        print("User not found")
+        return False
+    user_id = user.get("id")
+    loans = []
+    if args.include_archived:
+        loans.extend(l for l in iter_archived(archive_dir()) if l.get("user_id") == user_id)
+    loans.extend(store.user_loans(user_id))
+    stop = None if args.limit is None else args.offset + args.limit
+    items = loans[args.offset:stop]
+    _print_range(args, items, len(loans))
+    for loan in items:
+        book = store.book(loan.get("book_id"))
+        book_title = book.findtext("title") if book is not None else loan.get("book_id")
+        if loan.get("returned") == "true":
+            status = f"returned {loan.get('date_return')}"
+        else:
+            status = "on loan"
+        print(f"Book {book_title} from {loan.get('date_out')} to {loan.get('date_due')} - {status}")
+    active = store.open_loans(user_id)
+    print(
+        f"{len(loans)} loans for user {user.findtext('name')}: "
+        f"{active} on loan, {len(loans) - active} returned",
+        file=sys.stderr,
+    )
+
+
+def show_stats(args) -> None:
+    """Affiche les statistiques de circulation des prêts.
+
+    Les compteurs sont tenus à jour à chaque opération ; seuls ceux du
+    rapport sont lus, sans parcourir les prêts. Avec ``library.xml``, ils
+    sont conservés dans ``library.stats`` une fois calculés.
+    """
+    store = load_store()
+    computed = isinstance(store, LibraryStore) and store.stats_state() is None
+    report = store.stats(args.top, archived_loans())
+    if computed:
+        _write_states(store, ["stats"])
+    print(f"Loans: {report['loans']}")
+    if report["average_days"] is not None:
+        print(f"Returned: {report['returned']} (average duration {report['average_days']:.1f} days)")
+    origins = report["origins"]
+    print(
+        f"Authors: Senegalese {origins.get('senegalese', 0)}, "
+        f"French {origins.get('french', 0)}, other {origins.get('other', 0)}"
+    )
+    print("Most borrowed authors:")
+    for author, count in report["authors"]:
+        print(f"  {count:>6}  {author or '(unknown)'}")
+    print("Loans per genre:")
+    for genre, count in report["genres"]:
+        print(f"  {count:>6}  {genre or '(unknown)'}")
+    print("Most active users:")
+    for user_id, count in report["users"]:
+        user = store.user(user_id)
+        print(f"  {count:>6}  {user.findtext('name') if user is not None else user_id} [{user_id}]")
+    print("Loans per month:")
+    per_genre = {}
+    for (month, genre), count in report["genre_months"]:
+        per_genre.setdefault(month, []).append(f"{genre or '(unknown)'} {count}")
+    for month, count in report["months"]:
+        print(f"  {month or '(unknown)'}  {count:>6}  {', '.join(per_genre[month])}")
+
+
+def rebuild_stats(args) -> None:
+    """Recalcule les statistiques à partir des prêts et signale les écarts."""
+    store = load_store()
+    total, changed = store.rebuild_stats(archived_loans())
+    if isinstance(store, SQLiteStore):
+        _commit_database(store)
+    else:
+        _write_states(store, ["stats"])
+    print(f"Statistics rebuilt: {total} counters, {changed} corrected")
+
+
+def list_users(args) -> None:
+    """Affiche les utilisateurs, éventuellement paginés et triés."""
+    for user in _page(args, "users", lambda: iter_records(collection_file("users"), {"user"})):
         print(f"[{user.get('id')}] {user.findtext('name')}")
 
 
 def update_book(args) -> None:
     """Modifie les informations d'un livre."""
-    tree = load_library()
-    book = tree.getroot().find(f"books/book[@id='{args.book_id}']")
+    store = load_store()
+    book = store.book(args.book_id)
     if book is None:
         print("Book not found")
-        return
-    if args.title:
-        book.find("title").text = args.title
-    if args.author:
-        book.find("author").text = args.author
-    if args.genre:
-        book.find("genre").text = args.genre
-    if args.year is not None:
-        book.find("year").text = str(args.year)
-    save_library(tree)
+        return False
+    store.update_book(book, args.title, args.author, args.genre, args.year)
+    save_store(store)
     print("Book updated")
 
 
 def delete_book(args) -> None:
     """Supprime un livre de la bibliothèque."""
-    tree = load_library()
-    books = tree.getroot().find("books")
-    book = books.find(f"book[@id='{args.book_id}']")
+    store = load_store()
+    book = store.book(args.book_id)
     if book is None:
         print("Book not found")
-        return
-    books.remove(book)
-    save_library(tree)
+        return False
+    store.delete_book(book)
+    save_store(store)
     print("Book deleted")
 
 
 def update_user(args) -> None:
     """Met à jour un utilisateur."""
-    tree = load_library()
-    user = tree.getroot().find(f"users/user[@id='{args.user_id}']")
+    store = load_store()
+    user = store.user(args.user_id)
     if user is None:
         print("User not found")
-        return
-    user.find("name").text = args.name
-    save_library(tree)
+        return False
+    store.update_user(user, args.name)
+    save_store(store)
     print("User updated")
 
 
 def delete_user(args) -> None:
     """Supprime un utilisateur."""
-    tree = load_library()
-    users = tree.getroot().find("users")
-    user = users.find(f"user[@id='{args.user_id}']")
+    store = load_store()
+    user = store.user(args.user_id)
     if user is None:
         print("User not found")
-        return
-    users.remove(user)
-    save_library(tree)
+        return False
+    active = store.open_loans(user.get("id"))
+    if active:
+        print(f"User has {active} loans still open")
+        return False
+    store.delete_user(user)
+    save_store(store)
     print("User deleted")
 
 
 def extend_loan(args) -> None:
     """Prolonge la date de retour d'un prêt."""
-    tree = load_library()
-    root = tree.getroot()
-    book_id = _find_book_id(root, args.book_id)
-    if book_id is None:
-        print("Book not found")
-        return
-    loans = root.find("loans")
-    loan = loans.find(f"loan[@book_id='{book_id}'][@returned='false']")
+    store = load_store()
+    loan = _active_loan_for(store, args.book_id)
     if loan is None:
-        print("Loan not found")
-        return
-    loan.set("date_due", args.new_date)
-    save_library(tree)
+        return False
+    store.extend_loan(loan, args.new_date)
+    save_store(store)
     print("Loan extended")
 
 
-def serve(_args) -> None:
+def import_records(args) -> None:
+    """Importe des livres, utilisateurs et prêts depuis des fichiers CSV ou JSONL."""
+    store = load_store()
+    importer = Importer(store)
+    started = time.perf_counter()
+    # Des centaines de milliers d'éléments sont créés sans jamais former de
+    # cycle : le ramasse-miettes ne ferait que reparcourir l'arbre.
+    gc.disable()
+    try:
+        for path in args.files:
+            path = Path(path)
+            fmt = args.format or detect_format(path)
+            kind = args.kind or path.stem.lower()
+            for line_no, row in iter_rows(path, fmt):
+                try:
+                    importer.add(row, kind)
+                except InvalidRow as exc:
+                    importer.rejected += 1
+                    print(f"{path}:{line_no}: {exc}", file=sys.stderr)
+                    if args.strict:
+                        discard_changes()
+                        print("Import aborted, nothing saved")
+                        return False
+        # Un import produit trop d'opérations pour le journal : on écrit
+        # directement un instantané complet.
+        save_all(store)
+    finally:
+        gc.enable()
+    elapsed = time.perf_counter() - started
+    total = sum(importer.counts.values())
+    print(
+        f"Imported {importer.counts['book']} books, {importer.counts['user']} users, "
+        f"{importer.counts['loan']} loans ({importer.rejected} rejected) "
+        f"in {elapsed:.2f}s ({total / elapsed if elapsed else total:.0f} rows/s)"
+    )
+
+
+def batch(args) -> bool:
+    """Exécute une commande par ligne sur une seule bibliothèque chargée.
+
+    Chaque ligne suit la syntaxe de la ligne de commande et passe par le même
+    analyseur que ``main``. Les modifications sont enregistrées une seule fois
+    à la fin ; avec ``--atomic``, le premier échec annule tout le lot.
+    """
+    global _deferred_saves
+    parser = build_parser()
+    source = sys.stdin if args.file == "-" else Path(args.file).open(encoding="utf-8")
+    failures = 0
+    _deferred_saves += 1
+    try:
+        with source:
+            for line_no, line in enumerate(source, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                ok, output = _run_batch_line(parser, line)
+                lines = output.splitlines() or [""]
+                print(f"{line_no} {'ok' if ok else 'FAILED'}: {lines[0]}".rstrip())
+                for extra in lines[1:]:
+                    print(f"    {extra}")
+                if not ok:
+                    failures += 1
+                    if args.atomic:
+                        discard_changes()
+                        print("Batch aborted, nothing saved")
+                        return False
+    finally:
+        _deferred_saves -= 1
+    save_store(load_store())
+    return failures == 0
+
+
+# Commandes refusées dans un lot : elles enregistrent, annulent ou écrivent
+# d'autres fichiers d'elles-mêmes, ce qui romprait l'enregistrement unique
+# (et l'annulation de ``--atomic``) du lot.
+BATCH_EXCLUDED = {
+    "batch",
+    "serve",
+    "import",
+    "compact",
+    "archive-loans",
+    "split-library",
+    "merge-library",
+    "import-xml",
+    "export-xml",
+    "rebuild-stats",
+}
+
+
+def _run_batch_line(parser: argparse.ArgumentParser, line: str) -> tuple[bool, str]:
+    """Exécute une ligne de lot et retourne (succès, sortie produite)."""
+    buffer = io.StringIO()
+    try:
+        argv = shlex.split(line)
+        if argv and argv[0] in BATCH_EXCLUDED:
+            return False, f"{argv[0]} is not allowed in a batch"
+        with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(buffer):
+            result = run_command(parser, argv)
+    except SystemExit:
+        errors = buffer.getvalue().strip().splitlines()
+        return False, errors[-1] if errors else "invalid command"
+    except ValueError as exc:
+        return False, str(exc)
+    return result is not False, buffer.getvalue()
+
+
+def compact(_args) -> None:
+    """Replie le journal des opérations dans le fichier XML."""
+    compact_library()
+    print("Library compacted")
+
+
+def archive_loans(args) -> None:
+    """Déplace les prêts rendus depuis longtemps vers les segments d'archive."""
+    if args.auto is not None and args.auto > 0:
+        args.older_than = args.auto
+    before = args.before or (
+        datetime.date.today() - datetime.timedelta(days=args.older_than)
+    ).isoformat()
+    store = load_store()
+    count = _archive(store, before, args.by)
+    if args.auto is not None:
+        store.set_archive_policy(args.auto, args.by)
+    save_store(store)
+    print(f"Archived {count} loans returned before {before} into {archive_dir()}/")
+    if args.auto:
+        print(f"Loans returned more than {args.auto} days ago will be archived automatically")
+    elif args.auto == 0:
+        print("Automatic archiving disabled")
+
+
+def split_library(_args) -> None:
+    """Passe au stockage éclaté : un fichier par collection dans ``library/``.
+
+    Les fichiers sont écrits dans un dossier temporaire renommé ensuite ;
+    ``library.xml`` et son journal ne sont supprimés qu'après ce renommage.
+    """
+    if using_database():
+        print("Split storage is not available with the SQLite backend")
+        return False
+    if is_split():
+        print("Library is already split")
+        return False
+    store = load_store()
+    directory = split_dir()
+    staging = directory.with_name(directory.name + ".tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+    for collection in COLLECTIONS:
+        _write_atomic(ET.ElementTree(getattr(store, collection)), staging / f"{collection}.xml")
+    os.replace(staging, directory)
+    LIBRARY_FILE.unlink(missing_ok=True)
+    journal_path().unlink(missing_ok=True)
+    snapshot_path().unlink(missing_ok=True)
+    discard_changes()
+    print(f"Library split into {directory}/")
+
+
+def merge_library(_args) -> None:
+    """Revient au fichier unique ``library.xml`` depuis le stockage éclaté."""
+    if not is_split():
+        print("Library is not split")
+        return False
+    store = load_store()
+    root = ET.Element("library", seq=str(store.seq))
+    root.extend(getattr(store, collection) for collection in COLLECTIONS)
+    _write_atomic(ET.ElementTree(root), LIBRARY_FILE)
+    journal_path().unlink(missing_ok=True)
+    shutil.rmtree(split_dir())
+    discard_changes()
+    print(f"Library merged into {LIBRARY_FILE}")
+
+
+def rebuild_snapshot(args) -> None:
+    """Recrée l'instantané binaire à partir de ``library.xml``, ou le supprime.
+
+    Une fois créé, l'instantané est tenu à jour à chaque réécriture du fichier
+    XML et utilisé par les chargements tant qu'il lui correspond.
+    """
+    if args.remove:
+        snapshot_path().unlink(missing_ok=True)
+        print(f"Removed {snapshot_path()}")
+        return None
+    if is_split() or using_database():
+        print("Snapshots are only used with a single library.xml")
+        return False
+    if not LIBRARY_FILE.exists():
+        load_store()
+    started = time.perf_counter()
+    # L'instantané décrit library.xml seul : le journal est rejoué par-dessus.
+    with metrics.phase("parse"):
+        store = LibraryStore(ET.parse(LIBRARY_FILE))
+    if not _write_snapshot(store):
+        return False
+    print(
+        f"Wrote {snapshot_path()} ({snapshot_path().stat().st_size} bytes) "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+
+
+def _xml_tree() -> ET.ElementTree:
+    """Arbre complet de la bibliothèque XML, journal et stockage éclaté compris."""
+    global BACKEND
+    previous, BACKEND = BACKEND, "xml"
+    try:
+        return load_store().to_tree()
+    finally:
+        BACKEND = previous
+
+
+def import_xml(args) -> None:
+    """Remplit la base SQLite à partir d'un fichier XML, ``library.xml`` par défaut.
+
+    La base est construite dans un fichier temporaire renommé ensuite : en cas
+    d'erreur, l'ancienne base reste intacte. Les commandes suivantes utilisent
+    la nouvelle base.
+    """
+    source = Path(args.file) if args.file else LIBRARY_FILE
+    with metrics.phase("parse"):
+        tree = _xml_tree() if source == LIBRARY_FILE else ET.parse(source)
+    path = database_path()
+    temporary = path.with_name(path.name + ".tmp")
+    temporary.unlink(missing_ok=True)
+    try:
+        with metrics.phase("save"):
+            store = SQLiteStore.create(temporary, tree, archived_loans())
+    except ValueError as exc:
+        temporary.unlink(missing_ok=True)
+        print(f"Import failed: {exc}")
+        return False
+    counts = store.counts()
+    store.close()
+    discard_changes()
+    os.replace(temporary, path)
+    print(
+        f"Imported {counts['books']} books, {counts['users']} users and "
+        f"{counts['loans']} loans from {source} into {path}"
+    )
+
+
+def export_xml(args) -> None:
+    """Écrit toute la bibliothèque dans un fichier XML, ``library.xml`` par défaut.
+
+    Exporter vers ``library.xml`` y intègre aussi le journal, supprimé ensuite.
+    """
+    target = Path(args.file) if args.file else LIBRARY_FILE
+    store = load_store()
+    tree = store.to_tree()
+    _write_atomic(tree, target)
+    if target == LIBRARY_FILE:
+        journal_path().unlink(missing_ok=True)
+    counts = store.counts()
+    print(
+        f"Exported {counts['books']} books, {counts['users']} users and "
+        f"{counts['loans']} loans to {target}"
+    )
+
+
+def serve(args) -> None:
     """Lance le serveur web et ouvre la page dans un navigateur."""
     import webbrowser
-    from web_app import run
 
-    webbrowser.open("http://localhost:8000")
-    run()
+    import rpc
+    from web_app import STORE_LOCK
+
+    webbrowser.open(f"http://localhost:{args.port}")
+    # Les commandes lancées pendant ce temps sont exécutées par le serveur.
+    with rpc.listening(STORE_LOCK):
+        if args.use_async:
+            from async_server import run_async
+
+            run_async(port=args.port, workers=args.workers or 4)
+        else:
+            from web_app import run
+
+            run(port=args.port, workers=args.workers or 1)
+
+
+# Commandes qui modifient la bibliothèque et doivent donc tenir le verrou.
+WRITE_COMMANDS = {
+    add_book,
+    update_book,
+    delete_book,
+    add_user,
+    update_user,
+    delete_user,
+    loan_book,
+    return_book,
+    extend_loan,
+    import_records,
+    batch,
+    compact,
+    archive_loans,
+    split_library,
+    merge_library,
+    rebuild_snapshot,
+    rebuild_stats,
+    import_xml,
+    export_xml,
+}
+
+
+def _add_paging_arguments(parser: argparse.ArgumentParser, collection: str) -> None:
+    """Ajoute --sort, --limit et --offset à une commande de listing."""
+    fields = ", ".join(SORT_KEYS[collection])
+
+    def sort_field(value: str) -> str:
+        if value.lstrip("-") not in SORT_KEYS[collection]:
+            raise argparse.ArgumentTypeError(f"unknown sort field (choose from {fields})")
+        return value
+
+    parser.add_argument(
+        "--sort",
+        type=sort_field,
+        help=f"Sort by {fields}; a leading - sorts in descending order, written --sort=-FIELD "
+        "so that it is not taken for an option (same as --reverse)",
+    )
+    parser.add_argument("--reverse", action="store_true", help="Reverse the sort order")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--offset", type=int, default=0)
+
+
+def _period(value: str) -> str:
+    if not is_period(value):
+        raise argparse.ArgumentTypeError("expected YYYY, YYYY-MM or YYYY-MM-DD")
+    return value
+
+
+def _date(value: str) -> str:
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected YYYY-MM-DD") from None
 
 
 def build_parser() -> argparse.ArgumentParser:
     """Construit l'analyseur de ligne de commande."""
     parser = argparse.ArgumentParser(description="Gestionnaire de bibliothèque XML")
+    parser.add_argument(
+        "--journal",
+        action="store_true",
+        help="Append changes to library.journal instead of rewriting library.xml",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print the time spent parsing, querying, rendering and saving to stderr",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["xml", "sqlite"],
+        help="Storage engine (default: library.sqlite if it exists, else library.xml)",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Run the command in this process even if a server is running",
+    )
     sub = parser.add_subparsers(dest="command")
 
     badd = sub.add_parser("add-book", help="Add a new book")
@@ -254,6 +1321,8 @@ def build_parser() -> argparse.ArgumentParser:
     badd.set_defaults(func=add_book)
 
     blist = sub.add_parser("list-books", help="List all books")
+    blist.add_argument("--stream", action="store_true", help="Read library.xml incrementally")
+    _add_paging_arguments(blist, "books")
     blist.set_defaults(func=list_books)
 
     bupd = sub.add_parser("update-book", help="Update a book")
@@ -269,16 +1338,28 @@ def build_parser() -> argparse.ArgumentParser:
     bdel.set_defaults(func=delete_book)
 
     bsearch = sub.add_parser("search-books", help="Search books")
+    bsearch.add_argument("--text", help="Words to find in title, author or genre; results ranked by relevance")
     bsearch.add_argument("--author")
     bsearch.add_argument("--genre")
     bsearch.add_argument("--year", type=int)
+    bsearch.add_argument("--year-from", type=int)
+    bsearch.add_argument("--year-to", type=int)
+    bsearch.add_argument("--stream", action="store_true", help="Read library.xml incrementally")
     bsearch.set_defaults(func=search_books)
 
+    qry = sub.add_parser("query", help="Run a FLWOR query over books, users and loans")
+    qry.add_argument("expression", help="Query text, or - to read it from stdin")
+    qry.add_argument("--explain", action="store_true", help="Show the query plan instead of results")
+    qry.add_argument("--limit", type=int, help="Print at most N results")
+    qry.set_defaults(func=run_query)
+
     uadd = sub.add_parser("add-user", help="Add a new user")
     uadd.add_argument("name")
     uadd.set_defaults(func=add_user)
 
     ulist = sub.add_parser("list-users", help="List users")
+    ulist.add_argument("--stream", action="store_true", help="Read library.xml incrementally")
+    _add_paging_arguments(ulist, "users")
     ulist.set_defaults(func=list_users)
 
     uupd = sub.add_parser("update-user", help="Update a user")
@@ -316,23 +1397,159 @@ def build_parser() -> argparse.ArgumentParser:
     ext.set_defaults(func=extend_loan)
 
     llist = sub.add_parser("list-loans", help="List loans")
+    llist.add_argument("--stream", action="store_true", help="Read library.xml incrementally")
+    llist.add_argument(
+        "--include-archived", action="store_true", help="Also list loans from the archive segments"
+    )
+    llist.add_argument("--from", dest="date_from", type=_period, help="Loaned out on or after YYYY[-MM[-DD]]")
+    llist.add_argument("--to", dest="date_to", type=_period, help="Loaned out on or before YYYY[-MM[-DD]]")
+    _add_paging_arguments(llist, "loans")
     llist.set_defaults(func=list_loans)
 
+    sloans = sub.add_parser("search-loans", help="Search current loans by date")
+    sloans.add_argument("--out-from", type=_period, help="Loaned out on or after YYYY[-MM[-DD]]")
+    sloans.add_argument("--out-to", type=_period, help="Loaned out on or before YYYY[-MM[-DD]]")
+    sloans.add_argument("--due-before", type=_date, help="Due strictly before YYYY-MM-DD")
+    sloans.add_argument("--include-returned", action="store_true", help="Also search returned loans")
+    sloans.set_defaults(func=search_loans)
+
+    late = sub.add_parser("overdue", help="List current loans past their due date")
+    late.add_argument("--on", type=_date, help="Reference date (default: today)")
+    late.set_defaults(func=overdue)
+
+    uloans = sub.add_parser("user-loans", help="Show the current and past loans of a user")
+    uloans.add_argument("user_id", help="User id or name")
+    uloans.add_argument(
+        "--include-archived", action="store_true", help="Also list loans from the archive segments"
+    )
+    uloans.add_argument("--limit", type=int)
+    uloans.add_argument("--offset", type=int, default=0)
+    uloans.set_defaults(func=user_loans)
+
+    st = sub.add_parser(
+        "stats",
+        help="Show loan statistics per genre, author, month and user (archived loans included)",
+        description="Counters are kept up to date by every operation: in the database with SQLite, "
+        "in library.stats next to library.xml otherwise.",
+    )
+    st.add_argument("--top", type=int, default=10, help="Number of authors and users listed (default: 10)")
+    st.set_defaults(func=show_stats)
+
+    rst = sub.add_parser("rebuild-stats", help="Recompute the loan statistics from scratch")
+    rst.set_defaults(func=rebuild_stats)
+
+    imp = sub.add_parser("import", help="Import books, users and loans from CSV/JSONL")
+    imp.add_argument("files", nargs="+")
+    imp.add_argument("--kind", choices=["books", "users", "loans"])
+    imp.add_argument("--format", choices=["csv", "jsonl"])
+    imp.add_argument("--strict", action="store_true", help="Abort without saving on the first invalid row")
+    imp.set_defaults(func=import_records)
+
+    bat = sub.add_parser("batch", help="Run one command per line from a file or stdin")
+    bat.add_argument("file", nargs="?", default="-")
+    bat.add_argument("--atomic", action="store_true", help="Save nothing if any line fails")
+    bat.set_defaults(func=batch)
+
+    cmp = sub.add_parser("compact", help="Fold the journal into library.xml")
+    cmp.set_defaults(func=compact)
+
+    arc = sub.add_parser("archive-loans", help="Move old returned loans into archive segments")
+    arc.add_argument("--before", type=_date, help="Archive loans returned before this date")
+    arc.add_argument(
+        "--older-than", type=int, default=365, help="Archive loans returned more than N days ago"
+    )
+    arc.add_argument("--by", choices=sorted(GRANULARITIES), default="month", help="Segment size")
+    arc.add_argument(
+        "--auto",
+        type=int,
+        metavar="DAYS",
+        help="Also archive automatically on later saves (0 disables)",
+    )
+    arc.set_defaults(func=archive_loans)
+
+    spl = sub.add_parser("split-library", help="Store books, users and loans in separate files")
+    spl.set_defaults(func=split_library)
+
+    mrg = sub.add_parser("merge-library", help="Go back to a single library.xml")
+    mrg.set_defaults(func=merge_library)
+
+    snp = sub.add_parser("rebuild-snapshot", help="Rebuild the binary snapshot used for fast loading")
+    snp.add_argument("--remove", action="store_true", help="Delete the snapshot instead")
+    snp.set_defaults(func=rebuild_snapshot)
+
+    imx = sub.add_parser("import-xml", help="Load an XML library into the SQLite backend")
+    imx.add_argument("file", nargs="?", help="XML file to load (default: library.xml)")
+    imx.set_defaults(func=import_xml)
+
+    exx = sub.add_parser("export-xml", help="Write the whole library to an XML file")
+    exx.add_argument("file", nargs="?", help="Target file (default: library.xml)")
+    exx.set_defaults(func=export_xml)
+
     srv = sub.add_parser("serve", help="Lance l'interface web")
+    srv.add_argument("--port", type=int, default=8000)
+    srv.add_argument("--workers", type=int, help="Number of threads serving requests")
+    srv.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Serve connections from an asyncio event loop",
+    )
     srv.set_defaults(func=serve)
 
     return parser
 
 
-def main(argv=None) -> None:
-    """Point d'entrée du programme."""
+def run_command(parser: argparse.ArgumentParser, argv):
+    """Analyse ``argv`` et exécute la commande correspondante."""
+    return run_parsed(parser, parser.parse_args(argv))
+
+
+def run_parsed(parser: argparse.ArgumentParser, args):
+    """Exécute la commande décrite par ``args``, déjà analysés."""
+    global BACKEND, JOURNAL_MODE
+    if args.journal:
+        JOURNAL_MODE = True
+    if args.backend:
+        BACKEND = args.backend
+    if not hasattr(args, "func"):
+        parser.print_help()
+        return None
+    if using_database() and not database_path().exists() and args.func is not import_xml:
+        # Une base vide créée ici deviendrait le moteur par défaut et
+        # masquerait le catalogue XML : seul import-xml la crée.
+        print(f"No SQLite library at {database_path()}, run import-xml first", file=sys.stderr)
+        return False
+    if args.func is serve:
+        return serve(args)
+    lock = library_lock() if args.func in WRITE_COMMANDS else contextlib.nullcontext()
+    start = time.perf_counter()
+    with metrics.collect() as breakdown, lock, metrics.phase("render"):
+        result = args.func(args)
+    if args.timings:
+        print(metrics.format_breakdown(breakdown, time.perf_counter() - start), file=sys.stderr)
+    return result
+
+
+def main(argv=None):
+    """Point d'entrée du programme.
+
+    Si un serveur tourne sur la même bibliothèque, la commande lui est confiée
+    (voir ``rpc``) plutôt que d'être exécutée dans ce processus.
+    """
     parser = build_parser()
+    argv = sys.argv[1:] if argv is None else list(argv)
     args = parser.parse_args(argv)
-    if hasattr(args, "func"):
-        args.func(args)
-    else:
-        parser.print_help()
+    import rpc
+
+    forwarded, result = rpc.forward(args, argv)
+    if forwarded:
+        return result
+    return run_parsed(parser, args)
 
 
 if __name__ == "__main__":
-    main()
+    # Exécuté comme script, ce fichier est le module « __main__ » ; on passe
+    # par le module « main » pour partager configuration et cache avec web_app.
+    import main as library
+
+    library.main()
@@ -0,0 +1,168 @@
+"""Mesures de durée par phase et par route, au format texte de Prometheus.
+
+Une requête ou une commande se décompose en phases :
+
+- ``parse`` : analyse de ``library.xml`` et rejeu du journal ;
+- ``query`` : recherches dans les index, tri et découpage des pages ;
+- ``render`` : construction du HTML ou de l'affichage, et le reste du
+  traitement ;
+- ``save`` : écriture du fichier XML ou du journal.
+
+Les phases s'imbriquent (un chargement au milieu d'un rendu) : chacune ne
+compte que son temps propre, celui de ses sous-phases étant retranché, de
+sorte que la somme des phases égale la durée totale.
+"""
+
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+PHASES = ("parse", "query", "render", "save")
+# Bornes supérieures des seaux des histogrammes, en secondes.
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class Histogram:
+    """Histogramme cumulatif à seaux fixes."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list[str]:
+        prefix = labels + "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class Registry:
+    """Compteurs et histogrammes partagés par les fils du processus."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.phases = {name: Histogram() for name in PHASES}
+        self.requests: dict[tuple[str, int], int] = {}
+        self.latency: dict[str, Histogram] = {}
+
+    def observe_phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name].observe(seconds)
+
+    def observe_request(self, route: str, status: int, seconds: float) -> None:
+        with self._lock:
+            self.requests[route, status] = self.requests.get((route, status), 0) + 1
+            histogram = self.latency.get(route)
+            if histogram is None:
+                histogram = self.latency[route] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self, gauges: list[str] = ()) -> str:
+        """Retourne toutes les mesures, suivies des lignes ``gauges``."""
+        lines = [
+            "# HELP library_phase_seconds Time spent in each processing phase.",
+            "# TYPE library_phase_seconds histogram",
+        ]
+        with self._lock:
+            for name, histogram in self.phases.items():
+                lines += histogram.lines("library_phase_seconds", f'phase="{name}"')
+            lines += [
+                "# HELP library_requests_total HTTP requests by route and status.",
+                "# TYPE library_requests_total counter",
+            ]
+            for (route, status), count in sorted(self.requests.items()):
+                lines.append(f'library_requests_total{{route="{route}",status="{status}"}} {count}')
+            lines += [
+                "# HELP library_request_duration_seconds HTTP request latency by route.",
+                "# TYPE library_request_duration_seconds histogram",
+            ]
+            for route, histogram in sorted(self.latency.items()):
+                lines += histogram.lines("library_request_duration_seconds", f'route="{route}"')
+        return "\n".join(lines + list(gauges)) + "\n"
+
+
+def gauge(name: str, help_text: str, values: dict[str, float]) -> list[str]:
+    """Lignes d'une jauge ; les clés de ``values`` sont les étiquettes (``""`` : aucune)."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in values.items():
+        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+
+REGISTRY = Registry()
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """Mesure le temps propre passé dans la phase ``name``."""
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    frame = [0.0]  # temps passé dans les sous-phases
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        own = elapsed - frame[0]
+        REGISTRY.observe_phase(name, own)
+        breakdown = getattr(_local, "breakdown", None)
+        if breakdown is not None:
+            breakdown[name] = breakdown.get(name, 0.0) + own
+
+
+def timed(name: str):
+    """Décorateur plaçant tout l'appel dans la phase ``name``."""
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+@contextlib.contextmanager
+def collect():
+    """Recueille, pour le fil courant, la durée cumulée de chaque phase.
+
+    Un recueil imbriqué (ligne d'un lot) reverse ses durées au recueil
+    englobant.
+    """
+    previous = getattr(_local, "breakdown", None)
+    breakdown = _local.breakdown = {}
+    try:
+        yield breakdown
+    finally:
+        _local.breakdown = previous
+        if previous is not None:
+            for name, seconds in breakdown.items():
+                previous[name] = previous.get(name, 0.0) + seconds
+
+
+def format_breakdown(breakdown: dict[str, float], total: float) -> str:
+    """Résumé d'une ligne : ``parse 12.0 ms | query 0.3 ms | ... | total 15.1 ms``."""
+    parts = [f"{name} {breakdown.get(name, 0.0) * 1000:.1f} ms" for name in PHASES]
+    return " | ".join(parts + [f"total {total * 1000:.1f} ms"])
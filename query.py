@@ -0,0 +1,780 @@
+"""Requêtes de type XQuery sur la bibliothèque.
+
+Le langage reprend le sous-ensemble FLWOR d'XQuery :
+
+    for $l in loans, $b in books
+    where $l/@returned = "false" and $b/@id = $l/@book_id
+    order by $b/title
+    return ($b/title, $l/@date_due)
+
+- sources : ``books``, ``users``, ``loans`` (ou ``//book``, ``//user``,
+  ``//loan``) et toute expression produisant une séquence ;
+- clauses ``for``, ``let $x := expr``, ``where``, ``order by ... [descending]``
+  et ``return`` ; un FLWOR peut être imbriqué dans une expression ;
+- chemins ``$b/title``, ``$l/@book_id``, ``$b/*``, ``$b/title/text()`` ;
+- comparaisons générales ``= != < <= > >=`` (numériques si une valeur est un
+  nombre), ``and``, ``or`` ;
+- fonctions ``count``, ``sum``, ``avg``, ``min``, ``max``, ``distinct-values``,
+  ``contains``, ``starts-with``, ``ends-with``, ``lower-case``,
+  ``upper-case``, ``concat``, ``string``, ``number``, ``not``, ``exists``,
+  ``empty``.
+
+Le planificateur rattache chaque condition du ``where`` à la première clause
+où toutes ses variables sont liées, et choisit pour chaque ``for`` un accès par
+index (identifiant, titre, nom, année, auteur, genre, prêts en cours) ou une
+jointure par table de hachage plutôt qu'un parcours complet. Les requêtes
+compilées sont gardées en cache selon leur texte.
+"""
+
+import functools
+import re
+import xml.etree.ElementTree as ET
+
+from storage import INDEXED_FIELDS
+
+COLLECTIONS = {"books": "books", "users": "users", "loans": "loans"}
+PATH_SOURCES = {"book": "books", "user": "users", "loan": "loans"}
+COMPARISONS = {"=", "!=", "<", "<=", ">", ">="}
+_FLIPPED = {"=": "=", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+_TOKEN = re.compile(
+    r"""
+    (?P<space>\s+|\(:.*?:\))
+  | (?P<string>"[^"]*"|'[^']*')
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<var>\$[A-Za-z_][\w-]*)
+  | (?P<symbol>:=|!=|<=|>=|//|[=<>/@(),*])
+  | (?P<name>[A-Za-z_][\w-]*)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+class QueryError(ValueError):
+    """Requête mal formée ou impossible à évaluer."""
+
+
+# -- valeurs -------------------------------------------------------------
+
+
+def _atomize(items) -> list:
+    """Remplace les éléments d'une séquence par leur texte."""
+    return [
+        "".join(item.itertext()) if isinstance(item, ET.Element) else item for item in items
+    ]
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _truth(items) -> bool:
+    """Valeur booléenne effective d'une séquence."""
+    if not items:
+        return False
+    first = items[0]
+    if isinstance(first, ET.Element):
+        return True
+    if isinstance(first, str):
+        return bool(first)
+    return bool(first)
+
+
+def _compare(op: str, left, right) -> bool:
+    if isinstance(left, (int, float)) or isinstance(right, (int, float)):
+        left, right = _number(left), _number(right)
+        if left is None or right is None:
+            return op == "!="
+    else:
+        left, right = str(left), str(right)
+    if op == "=":
+        return left == right
+    if op == "!=":
+        return left != right
+    if op == "<":
+        return left < right
+    if op == "<=":
+        return left <= right
+    if op == ">":
+        return left > right
+    return left >= right
+
+
+def _sort_key(items):
+    """Clé de tri : vide d'abord, puis nombres (y compris « 1960 »), puis textes."""
+    values = _atomize(items)
+    if not values:
+        return (0, 0, "")
+    number = _number(values[0])
+    if number is not None and not isinstance(values[0], bool):
+        return (1, number, "")
+    return (2, 0, str(values[0]).casefold())
+
+
+def display(item) -> str:
+    """Texte affiché pour un élément de résultat."""
+    if isinstance(item, ET.Element):
+        if len(item) or item.attrib:
+            return ET.tostring(item, encoding="unicode").strip()
+        return item.text or ""
+    if isinstance(item, bool):
+        return "true" if item else "false"
+    if isinstance(item, float):
+        return str(int(item)) if item.is_integer() else f"{item:.6g}"
+    return str(item)
+
+
+def _hash_key(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# -- arbre des expressions -----------------------------------------------
+
+
+class Node:
+    """Expression compilée ; ``vars`` contient les variables qu'elle lit."""
+
+    vars: frozenset = frozenset()
+    text = ""
+
+    def evaluate(self, env: dict, ctx: "Context") -> list:
+        raise NotImplementedError
+
+    def plan(self, bound: frozenset) -> None:
+        """Prépare les FLWOR imbriqués, ``bound`` étant les variables déjà liées."""
+
+
+class Literal(Node):
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, env, ctx):
+        return [self.value]
+
+
+class Path(Node):
+    """Variable suivie d'étapes : ``$b/title``, ``$l/@book_id``."""
+
+    def __init__(self, var: str, steps: list[str]):
+        self.var = var
+        self.steps = steps
+        self.vars = frozenset({var})
+
+    def evaluate(self, env, ctx):
+        try:
+            items = env[self.var]
+        except KeyError:
+            raise QueryError(f"undefined variable ${self.var}") from None
+        for step in self.steps:
+            items = _step(items, step)
+        return items
+
+
+def _step(items, step: str) -> list:
+    result = []
+    for item in items:
+        if not isinstance(item, ET.Element):
+            continue
+        if step.startswith("@"):
+            value = item.get(step[1:])
+            if value is not None:
+                result.append(value)
+        elif step == "text()":
+            result.append(item.text or "")
+        elif step == "*":
+            result.extend(item)
+        else:
+            result.extend(item.findall(step))
+    return result
+
+
+class Steps(Node):
+    """Étapes appliquées à une autre expression : ``books/genre``."""
+
+    def __init__(self, base: Node, steps: list[str]):
+        self.base, self.steps = base, steps
+        self.vars = base.vars
+
+    def evaluate(self, env, ctx):
+        items = self.base.evaluate(env, ctx)
+        for step in self.steps:
+            items = _step(items, step)
+        return items
+
+    def plan(self, bound):
+        self.base.plan(bound)
+
+
+class Collection(Node):
+    def __init__(self, name: str):
+        self.name = name
+
+    def evaluate(self, env, ctx):
+        return list(ctx.iterate(self.name))
+
+
+class Sequence(Node):
+    def __init__(self, parts: list[Node]):
+        self.parts = parts
+        self.vars = frozenset().union(*(p.vars for p in parts))
+
+    def evaluate(self, env, ctx):
+        result = []
+        for part in self.parts:
+            result.extend(part.evaluate(env, ctx))
+        return result
+
+    def plan(self, bound):
+        for part in self.parts:
+            part.plan(bound)
+
+
+class Compare(Node):
+    def __init__(self, op: str, left: Node, right: Node):
+        self.op, self.left, self.right = op, left, right
+        self.vars = left.vars | right.vars
+
+    def evaluate(self, env, ctx):
+        left = _atomize(self.left.evaluate(env, ctx))
+        right = _atomize(self.right.evaluate(env, ctx))
+        return [any(_compare(self.op, a, b) for a in left for b in right)]
+
+    def plan(self, bound):
+        self.left.plan(bound)
+        self.right.plan(bound)
+
+
+class Logical(Node):
+    def __init__(self, op: str, parts: list[Node]):
+        self.op, self.parts = op, parts
+        self.vars = frozenset().union(*(p.vars for p in parts))
+
+    def evaluate(self, env, ctx):
+        if self.op == "and":
+            return [all(_truth(p.evaluate(env, ctx)) for p in self.parts)]
+        return [any(_truth(p.evaluate(env, ctx)) for p in self.parts)]
+
+    def plan(self, bound):
+        for part in self.parts:
+            part.plan(bound)
+
+
+def _aggregate(func):
+    def apply(values):
+        numbers = [n for n in map(_number, _atomize(values)) if n is not None]
+        return [func(numbers)] if numbers else []
+
+    return apply
+
+
+def _string_function(func):
+    def apply(*args):
+        texts = [display(a[0]) if a else "" for a in args]
+        return [func(*texts)]
+
+    return apply
+
+
+FUNCTIONS = {
+    "count": (1, lambda items: [len(items)]),
+    "sum": (1, lambda items: [sum(n for n in map(_number, _atomize(items)) if n is not None)]),
+    "avg": (1, _aggregate(lambda numbers: sum(numbers) / len(numbers))),
+    "min": (1, _aggregate(min)),
+    "max": (1, _aggregate(max)),
+    "distinct-values": (1, lambda items: list(dict.fromkeys(_atomize(items)))),
+    "contains": (2, _string_function(lambda a, b: b in a)),
+    "starts-with": (2, _string_function(lambda a, b: a.startswith(b))),
+    "ends-with": (2, _string_function(lambda a, b: a.endswith(b))),
+    "lower-case": (1, _string_function(str.lower)),
+    "upper-case": (1, _string_function(str.upper)),
+    "string": (1, _string_function(lambda a: a)),
+    "number": (1, lambda items: [_number(_atomize(items)[0]) if items else None]),
+    "concat": (None, _string_function(lambda *parts: "".join(parts))),
+    "not": (1, lambda items: [not _truth(items)]),
+    "exists": (1, lambda items: [bool(items)]),
+    "empty": (1, lambda items: [not items]),
+}
+
+
+class Call(Node):
+    def __init__(self, name: str, args: list[Node]):
+        if name not in FUNCTIONS:
+            raise QueryError(f"unknown function {name}()")
+        arity, self.func = FUNCTIONS[name]
+        if arity is not None and len(args) != arity:
+            raise QueryError(f"{name}() takes {arity} argument(s)")
+        self.name, self.args = name, args
+        self.vars = frozenset().union(*(a.vars for a in args))
+
+    def evaluate(self, env, ctx):
+        result = self.func(*(a.evaluate(env, ctx) for a in self.args))
+        return [r for r in result if r is not None]
+
+    def plan(self, bound):
+        for arg in self.args:
+            arg.plan(bound)
+
+
+# -- FLWOR ---------------------------------------------------------------
+
+
+class Clause:
+    """Clause ``for`` ou ``let`` ; ``access`` est choisi par le planificateur."""
+
+    def __init__(self, kind: str, var: str, expr: Node):
+        self.kind, self.var, self.expr = kind, var, expr
+        self.filters: list[Node] = []
+        self.access = None
+
+    def items(self, env, ctx):
+        if self.access is not None:
+            found = self.access.candidates(env, ctx)
+            if found is not None:
+                return found
+        if isinstance(self.expr, Collection):
+            return ctx.iterate(self.expr.name)
+        return self.expr.evaluate(env, ctx)
+
+
+class IndexAccess:
+    """Candidats fournis par ``LibraryStore.lookup``."""
+
+    def __init__(self, collection: str, field: str, op: str, key: Node):
+        self.collection, self.field, self.op, self.key = collection, field, op, key
+
+    def candidates(self, env, ctx):
+        values = _atomize(self.key.evaluate(env, ctx))
+        if len(values) != 1:
+            return None
+        return ctx.store.lookup(self.collection, self.field, self.op, values[0])
+
+    def describe(self) -> str:
+        return f"index {self.field} {self.op} {self.key.text}"
+
+
+class HashJoin:
+    """Table de hachage construite une fois par exécution sur un chemin de la collection."""
+
+    def __init__(self, collection: str, steps: list[str], key: Node):
+        self.collection, self.steps, self.key = collection, steps, key
+
+    def candidates(self, env, ctx):
+        table = ctx.tables.get(id(self))
+        if table is None:
+            table = ctx.tables[id(self)] = {}
+            for item in ctx.iterate(self.collection):
+                values = [item]
+                for step in self.steps:
+                    values = _step(values, step)
+                for value in dict.fromkeys(_hash_key(v) for v in _atomize(values)):
+                    table.setdefault(value, []).append(item)
+        keys = dict.fromkeys(_hash_key(v) for v in _atomize(self.key.evaluate(env, ctx)))
+        if len(keys) == 1:
+            return table.get(next(iter(keys)), [])
+        seen = {}
+        for key in keys:
+            for item in table.get(key, []):
+                seen[id(item)] = item
+        return list(seen.values())
+
+    def describe(self) -> str:
+        return f"hash join on {'/'.join(self.steps)} = {self.key.text}"
+
+
+class FLWOR(Node):
+    def __init__(self, clauses: list[Clause], where: Node | None, order: list, result: Node):
+        self.clauses, self.where, self.order, self.result = clauses, where, order, result
+        self.prefilters: list[Node] = []
+        local = {clause.var for clause in clauses}
+        used = frozenset().union(
+            *(c.expr.vars for c in clauses),
+            where.vars if where is not None else frozenset(),
+            *(key.vars for key, _ in order),
+            result.vars,
+        )
+        self.vars = used - local
+
+    def plan(self, bound: frozenset) -> None:
+        """Rattache les conditions aux clauses et choisit les accès."""
+        positions = {}
+        scope = set(bound)
+        for position, clause in enumerate(self.clauses):
+            clause.expr.plan(frozenset(scope))
+            scope.add(clause.var)
+            positions[clause.var] = position
+        conjuncts = []
+        if self.where is not None:
+            self.where.plan(frozenset(scope))
+            if isinstance(self.where, Logical) and self.where.op == "and":
+                conjuncts = self.where.parts
+            else:
+                conjuncts = [self.where]
+        for conjunct in conjuncts:
+            local = [positions[v] for v in conjunct.vars if v in positions]
+            if local:
+                self.clauses[max(local)].filters.append(conjunct)
+            else:
+                self.prefilters.append(conjunct)
+        for key, _ in self.order:
+            key.plan(frozenset(scope))
+        self.result.plan(frozenset(scope))
+        for clause in self.clauses:
+            if clause.kind == "for" and isinstance(clause.expr, Collection):
+                clause.access = _choose_access(clause)
+
+    def tuples(self, env, ctx):
+        if all(_truth(f.evaluate(env, ctx)) for f in self.prefilters):
+            yield from self._bind(env, ctx, 0)
+
+    def _bind(self, env, ctx, position):
+        if position == len(self.clauses):
+            yield env
+            return
+        clause = self.clauses[position]
+        if clause.kind == "let":
+            bindings = [clause.expr.evaluate(env, ctx)]
+        else:
+            bindings = ([item] for item in clause.items(env, ctx))
+        for value in bindings:
+            inner = {**env, clause.var: value}
+            if all(_truth(f.evaluate(inner, ctx)) for f in clause.filters):
+                yield from self._bind(inner, ctx, position + 1)
+
+    def rows(self, env, ctx):
+        """Produit, pour chaque tuple retenu, la séquence renvoyée par ``return``."""
+        tuples = self.tuples(env, ctx)
+        if self.order:
+            tuples = list(tuples)
+            for key, descending in reversed(self.order):
+                tuples.sort(key=lambda t: _sort_key(key.evaluate(t, ctx)), reverse=descending)
+        for bound in tuples:
+            yield self.result.evaluate(bound, ctx)
+
+    def evaluate(self, env, ctx):
+        result = []
+        for row in self.rows(env, ctx):
+            result.extend(row)
+        return result
+
+    def explain(self, depth: int = 0) -> list[str]:
+        indent = "  " * depth
+        lines = [f"{indent}filter {f.text}" for f in self.prefilters]
+        for clause in self.clauses:
+            if clause.kind == "let":
+                lines.append(f"{indent}let ${clause.var} := {clause.expr.text}")
+            else:
+                access = clause.access.describe() if clause.access else "scan"
+                lines.append(f"{indent}for ${clause.var} in {clause.expr.text}: {access}")
+            for nested in _nested_flwors(clause.expr):
+                lines += nested.explain(depth + 2)
+            lines += [f"{indent}  filter {f.text}" for f in clause.filters]
+        if self.order:
+            keys = ", ".join(k.text + (" descending" if d else "") for k, d in self.order)
+            lines.append(f"{indent}order by {keys}")
+        lines.append(f"{indent}return {self.result.text}")
+        return lines
+
+
+def _nested_flwors(node: Node) -> list[FLWOR]:
+    if isinstance(node, FLWOR):
+        return [node]
+    children = []
+    for attr in ("parts", "args"):
+        children.extend(getattr(node, attr, []))
+    for attr in ("left", "right", "base"):
+        if hasattr(node, attr):
+            children.append(getattr(node, attr))
+    return [flwor for child in children for flwor in _nested_flwors(child)]
+
+
+def _choose_access(clause: Clause):
+    """Choisit l'accès le plus sélectif pour ``for $v in collection``.
+
+    Par ordre de préférence : identifiant, autre index, jointure par hachage
+    sur une valeur venant d'une autre variable. La condition reste vérifiée
+    comme filtre, ce qui couvre les index approximatifs (par mots).
+    """
+    collection = clause.expr.name
+    best = None
+    for conjunct in clause.filters:
+        if not isinstance(conjunct, Compare) or conjunct.op == "!=":
+            continue
+        for path, key, op in (
+            (conjunct.left, conjunct.right, conjunct.op),
+            (conjunct.right, conjunct.left, _FLIPPED[conjunct.op]),
+        ):
+            if not isinstance(path, Path) or path.var != clause.var or clause.var in key.vars:
+                continue
+            field = path.steps[0] if len(path.steps) == 1 else None
+            if (collection, field) == ("loans", "@returned") and not _is_literal(key, "false"):
+                continue
+            # L'index des années compare des nombres : une clé texte serait
+            # comparée comme chaîne par le filtre, et donnerait d'autres lignes.
+            if field == "year" and not _is_number(key):
+                continue
+            if op in INDEXED_FIELDS.get((collection, field), ()):
+                candidate = (0 if field == "@id" else 1, IndexAccess(collection, field, op, key))
+            elif op == "=" and key.vars and path.steps:
+                candidate = (2, HashJoin(collection, path.steps, key))
+            else:
+                continue
+            if best is None or candidate[0] < best[0]:
+                best = candidate
+    return best[1] if best else None
+
+
+def _is_literal(node: Node, value) -> bool:
+    return isinstance(node, Literal) and node.value == value
+
+
+def _is_number(node: Node) -> bool:
+    return isinstance(node, Literal) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool)
+
+
+# -- analyse syntaxique --------------------------------------------------
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = []
+        position = 0
+        while position < len(text):
+            match = _TOKEN.match(text, position)
+            if match is None:
+                raise QueryError(f"unexpected character {text[position]!r} at {position}")
+            if match.lastgroup != "space":
+                self.tokens.append((match.lastgroup, match.group(), match.start(), match.end()))
+            position = match.end()
+        self.index = 0
+
+    def peek(self, offset: int = 0):
+        position = self.index + offset
+        return self.tokens[position] if position < len(self.tokens) else (None, None, len(self.text), len(self.text))
+
+    def accept(self, value: str) -> bool:
+        kind, text, _, _ = self.peek()
+        if text == value and kind in ("symbol", "name"):
+            self.index += 1
+            return True
+        return False
+
+    def expect(self, value: str) -> None:
+        if not self.accept(value):
+            found = self.peek()[1]
+            raise QueryError(f"expected {value!r} but found {found or 'end of query'!r}")
+
+    def _finish(self, node: Node, start: int) -> Node:
+        end = self.tokens[self.index - 1][3] if self.index else start
+        node.text = self.text[start:end]
+        return node
+
+    def parse(self) -> Node:
+        node = self.expr()
+        if self.peek()[0] is not None:
+            raise QueryError(f"unexpected {self.peek()[1]!r}")
+        return node
+
+    def expr(self) -> Node:
+        if self.peek()[1] in ("for", "let") and self.peek(1)[0] == "var":
+            return self.flwor()
+        return self.or_expr()
+
+    def flwor(self) -> Node:
+        start = self.peek()[2]
+        clauses = []
+        while self.peek()[1] in ("for", "let") and self.peek(1)[0] == "var":
+            kind = self.peek()[1]
+            self.index += 1
+            while True:
+                var = self.variable()
+                if kind == "for":
+                    self.expect("in")
+                else:
+                    self.expect(":=")
+                clauses.append(Clause(kind, var, self.source() if kind == "for" else self.expr()))
+                if not self.accept(","):
+                    break
+        where = self.expr() if self.accept("where") else None
+        order = []
+        if self.accept("order"):
+            self.expect("by")
+            while True:
+                key = self.or_expr()
+                descending = self.accept("descending")
+                if not descending:
+                    self.accept("ascending")
+                order.append((key, descending))
+                if not self.accept(","):
+                    break
+        self.expect("return")
+        result = self.expr()
+        return self._finish(FLWOR(clauses, where, order, result), start)
+
+    def variable(self) -> str:
+        kind, text, _, _ = self.peek()
+        if kind != "var":
+            raise QueryError(f"expected a variable but found {text or 'end of query'!r}")
+        self.index += 1
+        return text[1:]
+
+    def source(self) -> Node:
+        start = self.peek()[2]
+        if self.accept("//"):
+            kind, name, _, _ = self.peek()
+            if name not in PATH_SOURCES:
+                raise QueryError(f"unknown source //{name}")
+            self.index += 1
+            return self._finish(Collection(PATH_SOURCES[name]), start)
+        return self.or_expr()
+
+    def or_expr(self) -> Node:
+        start = self.peek()[2]
+        parts = [self.and_expr()]
+        while self.accept("or"):
+            parts.append(self.and_expr())
+        return parts[0] if len(parts) == 1 else self._finish(Logical("or", parts), start)
+
+    def and_expr(self) -> Node:
+        start = self.peek()[2]
+        parts = [self.comparison()]
+        while self.accept("and"):
+            parts.append(self.comparison())
+        return parts[0] if len(parts) == 1 else self._finish(Logical("and", parts), start)
+
+    def comparison(self) -> Node:
+        start = self.peek()[2]
+        left = self.primary()
+        kind, op, _, _ = self.peek()
+        if kind == "symbol" and op in COMPARISONS:
+            self.index += 1
+            return self._finish(Compare(op, left, self.primary()), start)
+        return left
+
+    def primary(self) -> Node:
+        start = self.peek()[2]
+        node = self.atom()
+        steps = []
+        while not isinstance(node, Path) and self.accept("/"):
+            steps.append(self.step())
+        return self._finish(Steps(node, steps), start) if steps else node
+
+    def atom(self) -> Node:
+        kind, text, start, _ = self.peek()
+        if kind == "string":
+            self.index += 1
+            return self._finish(Literal(text[1:-1]), start)
+        if kind == "number":
+            self.index += 1
+            return self._finish(Literal(float(text)), start)
+        if kind == "var":
+            self.index += 1
+            steps = []
+            while self.accept("/"):
+                steps.append(self.step())
+            return self._finish(Path(text[1:], steps), start)
+        if text == "//":
+            return self.source()
+        if text == "(":
+            self.index += 1
+            if self.accept(")"):
+                return self._finish(Sequence([]), start)
+            parts = [self.expr()]
+            while self.accept(","):
+                parts.append(self.expr())
+            self.expect(")")
+            return parts[0] if len(parts) == 1 else self._finish(Sequence(parts), start)
+        if kind == "name":
+            self.index += 1
+            if self.accept("("):
+                args = []
+                if not self.accept(")"):
+                    args.append(self.expr())
+                    while self.accept(","):
+                        args.append(self.expr())
+                    self.expect(")")
+                return self._finish(Call(text, args), start)
+            if text in COLLECTIONS:
+                return self._finish(Collection(COLLECTIONS[text]), start)
+            raise QueryError(f"unknown name {text!r}")
+        raise QueryError(f"unexpected {text or 'end of query'!r}")
+
+    def step(self) -> str:
+        if self.accept("@"):
+            kind, name, _, _ = self.peek()
+            if kind != "name":
+                raise QueryError("expected an attribute name after '@'")
+            self.index += 1
+            return "@" + name
+        if self.accept("*"):
+            return "*"
+        kind, name, _, _ = self.peek()
+        if kind != "name":
+            raise QueryError(f"expected a step but found {name or 'end of query'!r}")
+        self.index += 1
+        if name == "text" and self.accept("("):
+            self.expect(")")
+            return "text()"
+        return name
+
+
+# -- exécution -----------------------------------------------------------
+
+
+class Context:
+    """État d'une exécution : magasin interrogé et tables de hachage construites."""
+
+    def __init__(self, store):
+        self.store = store
+        self.tables: dict[int, dict] = {}
+
+    def iterate(self, collection: str):
+        if collection == "books":
+            return self.store.iter_books()
+        if collection == "users":
+            return self.store.iter_users()
+        return self.store.iter_loans()
+
+
+class CompiledQuery:
+    """Requête analysée et planifiée, réutilisable sur n'importe quel magasin."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.root = _Parser(text).parse()
+        if self.root.vars:
+            names = ", ".join(f"${v}" for v in sorted(self.root.vars))
+            raise QueryError(f"undefined variable {names}")
+        self.root.plan(frozenset())
+
+    def rows(self, store):
+        """Produit les lignes de résultat (chacune est une séquence d'items)."""
+        ctx = Context(store)
+        if isinstance(self.root, FLWOR):
+            yield from self.root.rows({}, ctx)
+        else:
+            for item in self.root.evaluate({}, ctx):
+                yield [item]
+
+    def explain(self) -> list[str]:
+        if isinstance(self.root, FLWOR):
+            return self.root.explain()
+        lines = [f"evaluate {self.root.text}"]
+        for nested in _nested_flwors(self.root):
+            lines += nested.explain(1)
+        return lines
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(text: str) -> CompiledQuery:
+    """Analyse et planifie ``text`` ; le résultat est mis en cache selon le texte."""
+    return CompiledQuery(text)
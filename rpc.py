@@ -0,0 +1,284 @@
+"""Exécution des commandes en ligne par le serveur en cours.
+
+Pendant ``python main.py serve``, le serveur écoute aussi sur une socket Unix
+(``library.sock``), ou à défaut sur un port local, et l'annonce dans
+``library.pid``. Une commande lancée dans le même dossier y est envoyée au
+lieu d'analyser puis de réécrire elle-même la bibliothèque : le serveur
+l'exécute sur son magasin déjà chargé, sous le même verrou que les pages
+web, et renvoie sa sortie.
+
+Le protocole tient en une ligne JSON dans chaque sens par connexion :
+``{"argv": [...], "stdin": "...", "token": "..."}`` puis ``{"stdout": ...,
+"stderr": ..., "result": ...}``. Le jeton, tiré au hasard à chaque
+démarrage, est écrit dans ``library.token``, lisible par le seul
+propriétaire : le port local de repli est ouvert à tous les utilisateurs de
+la machine, qui ne doivent pas pouvoir y faire exécuter de commande.
+"""
+
+import contextlib
+import hmac
+import io
+import json
+import os
+import secrets
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from pathlib import Path
+
+import main
+
+# Délai d'établissement de la connexion au serveur, en secondes.
+CONNECT_TIMEOUT = 1.0
+
+
+def pid_path() -> Path:
+    """Retourne le chemin du fichier qui annonce le serveur en cours."""
+    return main.LIBRARY_FILE.with_suffix(".pid")
+
+
+def socket_path() -> Path:
+    """Retourne le chemin de la socket Unix du serveur."""
+    return main.LIBRARY_FILE.with_suffix(".sock")
+
+
+def token_path() -> Path:
+    """Retourne le chemin du fichier qui contient le jeton du serveur."""
+    return main.LIBRARY_FILE.with_suffix(".token")
+
+
+def _write_private(path: Path, text: str) -> None:
+    """Écrit ``path`` avec des droits réservés au propriétaire (0600)."""
+    with contextlib.suppress(FileNotFoundError):
+        path.unlink()
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, "w", encoding="utf-8") as handle:
+        handle.write(text)
+
+
+def forwardable(args) -> bool:
+    """Indique si la commande analysée peut être confiée au serveur.
+
+    ``serve`` et les options qui changent la configuration du processus
+    (``--journal``, ``--backend``) s'exécutent toujours localement, de même
+    que toute commande lancée avec ``--local``.
+    """
+    return (
+        hasattr(args, "func")
+        and args.func is not main.serve
+        and not (args.local or args.journal or args.backend)
+    )
+
+
+def _reads_stdin(args) -> bool:
+    return (args.func is main.batch and args.file == "-") or (
+        args.func is main.run_query and args.expression == "-"
+    )
+
+
+# -- client --------------------------------------------------------------
+
+
+def _connect() -> socket.socket | None:
+    """Ouvre une connexion vers le serveur annoncé, ou ``None`` s'il n'y en a pas."""
+    try:
+        announce = json.loads(pid_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if "socket" in announce and hasattr(socket, "AF_UNIX"):
+        family, address = socket.AF_UNIX, announce["socket"]
+    elif "port" in announce:
+        family, address = socket.AF_INET, ("127.0.0.1", announce["port"])
+    else:
+        return None
+    connection = socket.socket(family, socket.SOCK_STREAM)
+    connection.settimeout(CONNECT_TIMEOUT)
+    try:
+        connection.connect(address)
+    except OSError:
+        # Serveur arrêté sans avoir pu retirer son annonce.
+        connection.close()
+        return None
+    connection.settimeout(None)
+    return connection
+
+
+def forward(args, argv: list[str]):
+    """Envoie la commande au serveur et reproduit sa sortie.
+
+    Retourne ``(True, résultat)`` si le serveur l'a exécutée, ``(False,
+    None)`` s'il n'y a pas de serveur joignable : la commande est alors
+    exécutée localement.
+    """
+    if not forwardable(args):
+        return False, None
+    try:
+        token = token_path().read_text(encoding="utf-8")
+    except OSError:
+        # Serveur d'un autre utilisateur, ou arrêté.
+        return False, None
+    connection = _connect()
+    if connection is None:
+        return False, None
+    request = {"argv": argv, "stdin": sys.stdin.read() if _reads_stdin(args) else "", "token": token}
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        # La commande a pu être appliquée : la relancer risquerait de la doubler.
+        print("Server closed the connection before answering", file=sys.stderr)
+        return True, False
+    response = json.loads(line)
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return True, response["result"]
+
+
+# -- serveur -------------------------------------------------------------
+
+
+class _ThreadStream:
+    """Flux standard redirigé vers le tampon du fil courant, s'il en a un.
+
+    Les autres fils (journal des requêtes HTTP notamment) continuent
+    d'écrire dans le flux d'origine.
+    """
+
+    def __init__(self, default) -> None:
+        self._default = default
+        self._local = threading.local()
+
+    def _stream(self):
+        return getattr(self._local, "stream", None) or self._default
+
+    @contextlib.contextmanager
+    def redirect(self, stream):
+        self._local.stream = stream
+        try:
+            yield
+        finally:
+            self._local.stream = None
+
+    def __getattr__(self, name):
+        return getattr(self._stream(), name)
+
+    def __iter__(self):
+        return iter(self._stream())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # Le tampon appartient à la requête : rien à fermer.
+        pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        if not hmac.compare_digest(str(request.get("token", "")), self.server.token):
+            response = {"stdout": "", "stderr": "Invalid server token\n", "result": False}
+        else:
+            response = self.server.execute(request.get("argv", []), request.get("stdin", ""))
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+class _Server:
+    """Exécute les commandes reçues sous le verrou lecteurs/écrivain du serveur web."""
+
+    def __init__(self, lock) -> None:
+        self.lock = lock
+        self.token = secrets.token_hex(16)
+        # Construire l'analyseur coûte plus que la plupart des commandes.
+        self.parser = main.build_parser()
+
+    def execute(self, argv: list[str], stdin: str) -> dict:
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with (
+            sys.stdout.redirect(stdout),
+            sys.stderr.redirect(stderr),
+            sys.stdin.redirect(io.StringIO(stdin)),
+        ):
+            result = self._run(argv)
+        return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "result": result}
+
+    def _run(self, argv: list[str]):
+        try:
+            args = self.parser.parse_args(argv)
+        except SystemExit:
+            return False
+        if not forwardable(args):
+            print(f"{argv[0] if argv else 'This command'} cannot be run by the server", file=sys.stderr)
+            return False
+        write = args.func in main.WRITE_COMMANDS
+        with self.lock.write() if write else self.lock.read():
+            try:
+                return main.run_parsed(self.parser, args)
+            except Exception:
+                # Comme un processus qui échoue, la commande n'enregistre rien.
+                if write:
+                    main.discard_changes()
+                traceback.print_exc()
+                return False
+            except SystemExit:
+                return False
+
+
+def _bind(server: _Server) -> tuple[socketserver.BaseServer, dict]:
+    """Ouvre la socket Unix, ou un port local si elle n'est pas disponible."""
+    if hasattr(socketserver, "ThreadingUnixStreamServer"):
+        path = os.path.abspath(socket_path())
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        try:
+            listener = socketserver.ThreadingUnixStreamServer(path, _Handler)
+        except OSError:
+            # Chemin trop long pour une socket Unix, par exemple.
+            pass
+        else:
+            listener.execute, listener.token = server.execute, server.token
+            return listener, {"socket": path}
+    listener = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _Handler)
+    listener.execute, listener.token = server.execute, server.token
+    return listener, {"port": listener.server_address[1]}
+
+
+@contextlib.contextmanager
+def listening(lock):
+    """Accepte les commandes en ligne pendant la durée du bloc.
+
+    ``lock`` est le verrou lecteurs/écrivain qui protège le magasin partagé
+    avec les pages web.
+    """
+    server = _Server(lock)
+    listener, address = _bind(server)
+    listener.daemon_threads = True
+    streams = sys.stdin, sys.stdout, sys.stderr
+    sys.stdin, sys.stdout, sys.stderr = (_ThreadStream(stream) for stream in streams)
+    thread = threading.Thread(target=listener.serve_forever, name="library-rpc", daemon=True)
+    thread.start()
+    _write_private(token_path(), server.token)
+    announce = pid_path()
+    temporary = announce.with_name(announce.name + ".tmp")
+    temporary.write_text(json.dumps({"pid": os.getpid(), **address}), encoding="utf-8")
+    os.replace(temporary, announce)
+    try:
+        yield address
+    finally:
+        with contextlib.suppress(OSError, ValueError):
+            # Un autre serveur a pu prendre la relève entre-temps.
+            if json.loads(announce.read_text(encoding="utf-8"))["pid"] == os.getpid():
+                announce.unlink()
+                token_path().unlink(missing_ok=True)
+        listener.shutdown()
+        listener.server_close()
+        if "socket" in address:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(address["socket"])
+        sys.stdin, sys.stdout, sys.stderr = streams
@@ -0,0 +1,420 @@
+"""Index secondaires utilisés par la recherche de livres.
+
+Les textes sont normalisés (accents retirés, casse repliée) puis découpés en
+mots : « Sembène » et « sembene » ont la même clé. Un mot de la requête
+correspond à tout mot indexé qui commence par lui.
+
+``TextIndex`` couvre titre, auteur et genre à la fois et classe les livres
+trouvés par pertinence (BM25) : un mot rare pèse plus qu'un mot courant, un
+mot du titre plus qu'un mot du genre, et une notice courte plus qu'une
+longue.
+"""
+
+import bisect
+import itertools
+import math
+import re
+import unicodedata
+
+from archive import lower_bound, upper_bound
+
+_WORD = re.compile(r"\w+")
+
+# Poids de chaque champ dans l'index plein texte : un mot du titre y compte
+# trois fois, un mot de l'auteur deux fois.
+TEXT_FIELDS = {"title": 3, "author": 2, "genre": 1}
+# Paramètres de BM25 : saturation de la fréquence et normalisation par longueur.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def fold(text: str) -> str:
+    """Retire les accents et replie la casse de ``text``."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text: str) -> list[str]:
+    """Découpe ``text`` normalisé en mots."""
+    return _WORD.findall(fold(text))
+
+
+def _prefixed(tokens: list[str], prefix: str):
+    """Mots de la liste triée ``tokens`` qui commencent par ``prefix``."""
+    for position in range(bisect.bisect_left(tokens, prefix), len(tokens)):
+        if not tokens[position].startswith(prefix):
+            break
+        yield tokens[position]
+
+
+class TokenIndex:
+    """Associe chaque mot normalisé à l'ensemble des identifiants qui le contiennent."""
+
+    def __init__(self) -> None:
+        self._postings: dict[str, set[str]] = {}
+        # Mots triés pour la recherche par préfixe ; reconstruit à la demande
+        # après un chargement, puis tenu à jour par insertion.
+        self._sorted: list[str] | None = None
+
+    def add(self, key: str, text: str) -> None:
+        for token in set(tokenize(text)):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                if self._sorted is not None:
+                    bisect.insort(self._sorted, token)
+            postings.add(key)
+
+    def remove(self, key: str, text: str) -> None:
+        for token in set(tokenize(text)):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(key)
+            if not postings:
+                del self._postings[token]
+                if self._sorted is not None:
+                    del self._sorted[bisect.bisect_left(self._sorted, token)]
+
+    def _expand(self, prefix: str) -> list[set[str]]:
+        """Retourne les ensembles d'identifiants des mots commençant par ``prefix``."""
+        if self._sorted is None:
+            self._sorted = sorted(self._postings)
+        return [self._postings[token] for token in _prefixed(self._sorted, prefix)]
+
+    def state(self) -> dict[str, set[str]]:
+        """Identifiants par mot, pour l'instantané binaire."""
+        return self._postings
+
+    @classmethod
+    def from_state(cls, postings: dict[str, set[str]]) -> "TokenIndex":
+        index = cls()
+        index._postings = postings
+        return index
+
+    def estimate(self, query: str) -> int:
+        """Majorant du nombre de résultats, sans construire d'ensemble."""
+        return min(
+            (sum(len(p) for p in self._expand(token)) for token in set(tokenize(query))),
+            default=0,
+        )
+
+    def lookup(self, query: str) -> set[str]:
+        """Identifiants dont le texte contient un mot commençant par chaque mot de ``query``."""
+        candidates = []
+        for token in set(tokenize(query)):
+            matches = self._expand(token)
+            candidates.append(set().union(*matches) if len(matches) != 1 else set(matches[0]))
+        if not candidates:
+            return set()
+        candidates.sort(key=len)
+        result = candidates[0]
+        for other in candidates[1:]:
+            result &= other
+            if not result:
+                break
+        return result
+
+
+def text_terms(book) -> dict[str, int]:
+    """Fréquences des mots d'un élément ``<book>``, pondérées par ``TEXT_FIELDS``.
+
+    La longueur de la notice, pour BM25, est la somme de ces fréquences.
+    """
+    terms: dict[str, int] = {}
+    for field, weight in TEXT_FIELDS.items():
+        for token in tokenize(book.findtext(field)):
+            terms[token] = terms.get(token, 0) + weight
+    return terms
+
+
+def _key_order(key: str):
+    return (0, int(key), "") if key.isdigit() else (1, 0, key)
+
+
+def bm25_rank(matches, documents: int, total_length: int, lengths) -> list[tuple[str, float]]:
+    """Classe les identifiants qui contiennent chaque mot de la requête.
+
+    ``matches`` donne, pour chaque mot de la requête, la liste des
+    ``{identifiant: fréquence}`` des mots indexés qui commencent par lui ;
+    ``lengths`` associe chaque identifiant à la longueur de sa notice. Un mot
+    de la requête rapporte le meilleur score BM25 de ses mots indexés.
+    Retourne les paires (identifiant, score), de la plus pertinente à la
+    moins pertinente, puis dans l'ordre des identifiants.
+    """
+    if not matches or not documents:
+        return []
+    average = total_length / documents or 1
+    scores: dict[str, float] | None = None
+    # Le mot le moins fréquent d'abord : il borne les candidats suivants.
+    for postings_list in sorted(matches, key=lambda postings: sum(map(len, postings))):
+        found: dict[str, float] = {}
+        for postings in postings_list:
+            idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                if scores is not None and key not in scores:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[key] / average)
+                score = idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                if score > found.get(key, 0.0):
+                    found[key] = score
+        scores = found if scores is None else {key: scores[key] + score for key, score in found.items()}
+        if not scores:
+            return []
+    return sorted(scores.items(), key=lambda item: (-item[1], _key_order(item[0])))
+
+
+class TextIndex:
+    """Index plein texte des livres (titre, auteur, genre) classé par BM25.
+
+    Chaque mot normalisé est associé aux identifiants qui le contiennent et à
+    sa fréquence pondérée (voir ``text_terms``) ; la longueur de chaque
+    notice est conservée pour la normalisation.
+    """
+
+    def __init__(self) -> None:
+        self._postings: dict[str, dict[str, int]] = {}
+        self._lengths: dict[str, int] = {}
+        self._total = 0
+        self._sorted: list[str] | None = None
+
+    def add(self, key: str, terms: dict[str, int]) -> None:
+        for token, frequency in terms.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                if self._sorted is not None:
+                    bisect.insort(self._sorted, token)
+            postings[key] = frequency
+        length = sum(terms.values())
+        self._total += length - self._lengths.get(key, 0)
+        self._lengths[key] = length
+
+    def remove(self, key: str, terms: dict[str, int]) -> None:
+        for token in terms:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[token]
+                if self._sorted is not None:
+                    del self._sorted[bisect.bisect_left(self._sorted, token)]
+        self._total -= self._lengths.pop(key, 0)
+
+    def _expand(self, prefix: str) -> list[dict[str, int]]:
+        if self._sorted is None:
+            self._sorted = sorted(self._postings)
+        return [self._postings[token] for token in _prefixed(self._sorted, prefix)]
+
+    def state(self) -> dict:
+        """Fréquences par mot et longueurs des notices, pour l'instantané binaire."""
+        return {"postings": self._postings, "lengths": self._lengths}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "TextIndex":
+        index = cls()
+        index._postings = state["postings"]
+        index._lengths = state["lengths"]
+        index._total = sum(index._lengths.values())
+        return index
+
+    def search(self, query: str) -> list[tuple[str, float]]:
+        """Identifiants contenant un début de mot de chaque mot de ``query``, classés."""
+        matches = [self._expand(token) for token in sorted(set(tokenize(query)))]
+        return bm25_rank(matches, len(self._lengths), self._total, self._lengths)
+
+
+class RangeIndex:
+    """Associe des clés entières (années) aux identifiants, avec parcours par intervalle."""
+
+    def __init__(self) -> None:
+        self._postings: dict[int, set[str]] = {}
+        self._sorted: list[int] | None = None
+
+    def add(self, key: str, value) -> None:
+        number = _as_int(value)
+        if number is None:
+            return
+        postings = self._postings.get(number)
+        if postings is None:
+            postings = self._postings[number] = set()
+            if self._sorted is not None:
+                bisect.insort(self._sorted, number)
+        postings.add(key)
+
+    def remove(self, key: str, value) -> None:
+        number = _as_int(value)
+        postings = self._postings.get(number)
+        if postings is None:
+            return
+        postings.discard(key)
+        if not postings:
+            del self._postings[number]
+            if self._sorted is not None:
+                del self._sorted[bisect.bisect_left(self._sorted, number)]
+
+    def _range(self, low: int | None, high: int | None) -> list[set[str]]:
+        if low is not None and low == high:
+            postings = self._postings.get(low)
+            return [postings] if postings else []
+        if self._sorted is None:
+            self._sorted = sorted(self._postings)
+        start = 0 if low is None else bisect.bisect_left(self._sorted, low)
+        stop = len(self._sorted) if high is None else bisect.bisect_right(self._sorted, high)
+        return [self._postings[k] for k in self._sorted[start:stop]]
+
+    def state(self) -> dict[int, set[str]]:
+        """Identifiants par année, pour l'instantané binaire."""
+        return self._postings
+
+    @classmethod
+    def from_state(cls, postings: dict[int, set[str]]) -> "RangeIndex":
+        index = cls()
+        index._postings = postings
+        return index
+
+    def estimate(self, low: int | None, high: int | None) -> int:
+        return sum(len(p) for p in self._range(low, high))
+
+    def lookup(self, low: int | None, high: int | None) -> set[str]:
+        return set().union(*self._range(low, high))
+
+
+def _as_int(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class BookQuery:
+    """Critères d'une recherche de livres.
+
+    ``year`` demande une année exacte ; ``year_from`` et ``year_to`` bornent
+    un intervalle inclusif. ``text`` cherche ses mots dans le titre, l'auteur
+    et le genre à la fois, et les résultats sont alors classés par pertinence.
+    """
+
+    def __init__(self, author=None, genre=None, year=None, year_from=None, year_to=None, text=None):
+        # Un critère sans aucun mot (ponctuation seule) est ignoré.
+        self.author = author if tokenize(author) else None
+        self.genre = genre if tokenize(genre) else None
+        self.text = text if tokenize(text) else None
+        if year not in (None, ""):
+            year_from = year_to = year
+        self.year_from = _as_int(year_from) if year_from not in (None, "") else None
+        self.year_to = _as_int(year_to) if year_to not in (None, "") else None
+        # Une borne illisible ne peut correspondre à aucune année.
+        self.impossible = (year_from not in (None, "") and self.year_from is None) or (
+            year_to not in (None, "") and self.year_to is None
+        )
+
+    @property
+    def has_year(self) -> bool:
+        return self.year_from is not None or self.year_to is not None
+
+    def matches(self, book) -> bool:
+        """Vérifie directement un élément ``<book>``, sans index."""
+        if self.impossible:
+            return False
+        if self.author and not _words_match(self.author, book.findtext("author")):
+            return False
+        if self.genre and not _words_match(self.genre, book.findtext("genre")):
+            return False
+        if self.text and not _words_match(self.text, " ".join(book.findtext(f) or "" for f in TEXT_FIELDS)):
+            return False
+        if self.has_year:
+            year = _as_int(book.findtext("year"))
+            if year is None:
+                return False
+            if self.year_from is not None and year < self.year_from:
+                return False
+            if self.year_to is not None and year > self.year_to:
+                return False
+        return True
+
+
+class LoanQuery:
+    """Critères d'une recherche de prêts.
+
+    ``out_from`` et ``out_to`` bornent la date de sortie (``AAAA``,
+    ``AAAA-MM`` ou ``AAAA-MM-JJ``, bornes incluses) ; ``due_before`` garde les
+    prêts dont le retour était prévu avant cette date (exclue). Seuls les
+    prêts en cours sont retenus, sauf avec ``include_returned``.
+    """
+
+    def __init__(self, out_from=None, out_to=None, due_before=None, include_returned=False):
+        self.out_low = lower_bound(out_from) if out_from else None
+        self.out_high = upper_bound(out_to) if out_to else None
+        self.due_before = due_before or None
+        self.include_returned = include_returned
+
+    @property
+    def has_out(self) -> bool:
+        return self.out_low is not None or self.out_high is not None
+
+    def matches(self, loan) -> bool:
+        """Vérifie directement un élément ``<loan>``, sans index."""
+        if not self.include_returned and loan.get("returned") != "false":
+            return False
+        date_out = loan.get("date_out") or ""
+        if self.out_low is not None and date_out < self.out_low:
+            return False
+        if self.out_high is not None and date_out > self.out_high:
+            return False
+        if self.due_before is not None and (loan.get("date_due") or "") >= self.due_before:
+            return False
+        return True
+
+
+def _words_match(query: str, text: str) -> bool:
+    words = tokenize(text)
+    return all(any(w.startswith(t) for w in words) for t in tokenize(query))
+
+
+class SortedIndex:
+    """Éléments triés selon une clé, pour paginer sans trier toute la collection.
+
+    Les égalités de clé sont départagées par l'ordre d'insertion. L'index se
+    découpe comme une liste (``index[a:b]``) et renvoie alors les éléments.
+    """
+
+    def __init__(self, key, elements) -> None:
+        self._key = key
+        self._counter = itertools.count()
+        self._entries = sorted((key(e), next(self._counter), e) for e in elements)
+        self._by_element = {entry[2]: entry for entry in self._entries}
+
+    def add(self, element) -> None:
+        entry = (self._key(element), next(self._counter), element)
+        bisect.insort(self._entries, entry)
+        self._by_element[element] = entry
+
+    def remove(self, element) -> None:
+        entry = self._by_element.pop(element, None)
+        if entry is not None:
+            del self._entries[bisect.bisect_left(self._entries, entry)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def between(self, low=None, high=None, inclusive: bool = True) -> list:
+        """Éléments dont la clé est comprise entre ``low`` et ``high``, dans l'ordre.
+
+        Chaque borne est facultative ; ``high`` est exclue si ``inclusive`` est
+        faux. Deux recherches dichotomiques délimitent la tranche : le coût est
+        en O(log n + k) pour k éléments renvoyés.
+        """
+        start = 0 if low is None else bisect.bisect_left(self._entries, (low,))
+        if high is None:
+            stop = len(self._entries)
+        elif inclusive:
+            # Après toutes les entrées de clé ``high``, quel que soit leur rang.
+            stop = bisect.bisect_right(self._entries, (high, math.inf))
+        else:
+            stop = bisect.bisect_left(self._entries, (high,))
+        return self[start:max(start, stop)]
+
+    def __getitem__(self, window: slice) -> list:
+        return [entry[2] for entry in self._entries[window]]
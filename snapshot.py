@@ -0,0 +1,201 @@
+"""Instantané binaire de la bibliothèque pour accélérer les démarrages à froid.
+
+``library.snapshot`` reprend l'arbre de ``library.xml`` rangé par colonnes
+(une liste de valeurs par attribut et par sous-élément) ainsi que les index
+par mots et par année du magasin, le tout sérialisé avec ``marshal``. Le
+relire évite l'analyse du texte XML et, surtout, la normalisation de chaque
+auteur et genre.
+
+L'en-tête porte un numéro de format ainsi que la date de modification et la
+taille du fichier XML décrit : l'instantané n'est utilisé que s'il
+correspond exactement au fichier actuel, qui reste la référence.
+
+Seuls les arbres de la forme habituelle sont pris en charge (racine,
+conteneurs, enregistrements dont les sous-éléments sont de simples textes) ;
+pour tout autre arbre, aucun instantané n'est écrit.
+
+``write_state`` et ``read_state`` conservent de la même façon, à côté de
+``library.xml``, un état calculé à partir de lui (les compteurs de
+statistiques dans ``library.stats``, l'index plein texte dans
+``library.textindex``), valable tant que le fichier est inchangé.
+"""
+
+import marshal
+import os
+import struct
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+MAGIC = b"LIBSNAP\0"
+# Fichiers d'état (``write_state``) : mêmes en-tête et règle de validité.
+STATE_MAGIC = b"LIBSTATE"
+VERSION = 1
+# Format, date de modification (ns) et taille du fichier XML décrit.
+_HEADER = struct.Struct("<8sHqq")
+
+
+class Unsupported(ValueError):
+    """L'arbre contient une forme que l'instantané ne sait pas représenter."""
+
+
+def source_key(path: Path) -> tuple[int, int]:
+    """Clé (mtime en ns, taille) du fichier XML que l'instantané décrit."""
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _encode_container(container: ET.Element) -> tuple:
+    """Range les enregistrements d'un conteneur par colonnes.
+
+    Chaque enregistrement renvoie à une « forme » : noms de ses attributs et
+    balises de ses sous-éléments, dans l'ordre. Une valeur absente vaut
+    ``False`` afin de la distinguer d'un texte vide (``None``).
+    """
+    shapes: dict[tuple, int] = {}
+    attributes: dict[str, list] = {}
+    children: dict[str, tuple[list, list]] = {}
+    tags, shape_of, texts, tails = [], [], [], []
+    for position, record in enumerate(container):
+        child_tags = tuple(child.tag for child in record)
+        if len(set(child_tags)) != len(child_tags):
+            raise Unsupported(f"repeated child in <{record.tag}>")
+        shape = (tuple(record.attrib), child_tags)
+        shape_of.append(shapes.setdefault(shape, len(shapes)))
+        tags.append(record.tag)
+        texts.append(record.text)
+        tails.append(record.tail)
+        for name, value in record.attrib.items():
+            column = attributes.get(name)
+            if column is None:
+                column = attributes[name] = [False] * position
+            column.append(value)
+        for child in record:
+            if len(child) or child.attrib:
+                raise Unsupported(f"nested element <{child.tag}> in <{record.tag}>")
+            columns = children.get(child.tag)
+            if columns is None:
+                columns = children[child.tag] = ([False] * position, [False] * position)
+            columns[0].append(child.text)
+            columns[1].append(child.tail)
+        count = position + 1
+        for column in attributes.values():
+            if len(column) < count:
+                column.append(False)
+        for column_texts, column_tails in children.values():
+            if len(column_texts) < count:
+                column_texts.append(False)
+                column_tails.append(False)
+    return (
+        container.tag,
+        dict(container.attrib),
+        container.text,
+        container.tail,
+        list(shapes),
+        shape_of,
+        tags,
+        texts,
+        tails,
+        attributes,
+        children,
+    )
+
+
+def _decode_container(data: tuple) -> ET.Element:
+    tag, attrib, text, tail, shapes, shape_of, tags, texts, tails, attributes, children = data
+    container = ET.Element(tag, attrib)
+    container.text, container.tail = text, tail
+    # Colonnes utiles à chaque forme, résolues une fois pour toutes.
+    prepared = [
+        ([(name, attributes[name]) for name in names], [(child, *children[child]) for child in child_tags])
+        for names, child_tags in shapes
+    ]
+    element = ET.Element
+    sub_element = ET.SubElement
+    records = []
+    for position, shape in enumerate(shape_of):
+        names, child_columns = prepared[shape]
+        record = element(tags[position], {name: column[position] for name, column in names})
+        record.text = texts[position]
+        record.tail = tails[position]
+        for child_tag, child_texts, child_tails in child_columns:
+            child = sub_element(record, child_tag)
+            child.text = child_texts[position]
+            child.tail = child_tails[position]
+        records.append(record)
+    container.extend(records)
+    return container
+
+
+def write(path: Path, tree: ET.ElementTree, indexes: dict, key: tuple[int, int]) -> None:
+    """Écrit l'instantané de ``tree`` et de ``indexes`` pour le fichier de clé ``key``.
+
+    Lève ``Unsupported`` si l'arbre sort de la forme prise en charge.
+    """
+    root = tree.getroot()
+    payload = {
+        "root": (root.tag, dict(root.attrib), root.text, root.tail),
+        "containers": [_encode_container(container) for container in root],
+        "indexes": indexes,
+    }
+    temporary = path.with_name(path.name + ".tmp")
+    with temporary.open("wb") as handle:
+        handle.write(_HEADER.pack(MAGIC, VERSION, *key))
+        handle.write(marshal.dumps(payload))
+    os.replace(temporary, path)
+
+
+def read(path: Path, key: tuple[int, int]) -> tuple[ET.ElementTree, dict] | None:
+    """Retourne l'arbre et les index de l'instantané, ou ``None`` s'il est absent ou périmé."""
+    try:
+        data = path.read_bytes()
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, *saved_key = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or tuple(saved_key) != tuple(key):
+            return None
+        # ``loads`` sur les octets déjà lus est bien plus rapide que ``load``
+        # sur le fichier, qui lit par petits morceaux.
+        payload = marshal.loads(memoryview(data)[_HEADER.size:])
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    tag, attrib, text, tail = payload["root"]
+    root = ET.Element(tag, attrib)
+    root.text, root.tail = text, tail
+    root.extend(_decode_container(container) for container in payload["containers"])
+    return ET.ElementTree(root), payload["indexes"]
+
+
+def write_state(path: Path, state, key: tuple[int, int]) -> None:
+    """Écrit ``state`` (sérialisable par ``marshal``) pour le fichier XML de clé ``key``."""
+    temporary = path.with_name(path.name + ".tmp")
+    with temporary.open("wb") as handle:
+        handle.write(_HEADER.pack(STATE_MAGIC, VERSION, *key))
+        handle.write(marshal.dumps(state))
+    os.replace(temporary, path)
+
+
+def state_current(path: Path, key: tuple[int, int]) -> bool:
+    """Indique si ``path`` contient un état écrit pour le fichier de clé ``key``, sans le relire."""
+    try:
+        with path.open("rb") as handle:
+            header = handle.read(_HEADER.size)
+    except OSError:
+        return False
+    if len(header) < _HEADER.size:
+        return False
+    magic, version, *saved_key = _HEADER.unpack(header)
+    return magic == STATE_MAGIC and version == VERSION and tuple(saved_key) == tuple(key)
+
+
+def read_state(path: Path, key: tuple[int, int]):
+    """Retourne l'état écrit par ``write_state``, ou ``None`` s'il est absent ou périmé."""
+    try:
+        data = path.read_bytes()
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, *saved_key = _HEADER.unpack_from(data)
+        if magic != STATE_MAGIC or version != VERSION or tuple(saved_key) != tuple(key):
+            return None
+        return marshal.loads(memoryview(data)[_HEADER.size:])
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
@@ -0,0 +1,815 @@
+"""Stockage de la bibliothèque dans une base SQLite.
+
+La base ``library.sqlite`` reprend le contenu de ``library.xml`` table par
+table ; les modifications s'y font en place, dans une transaction validée
+par ``commit`` (la ligne de commande le fait à chaque enregistrement), sans
+réécrire tout le catalogue. Les index de la base servent les recherches par
+identifiant, titre, nom, année, prêt en cours et les tris des listes ; les mots
+des auteurs et des genres, normalisés comme dans ``search_index``, sont rangés
+dans ``book_words`` pour la recherche par début de mot, et ceux du titre, de
+l'auteur et du genre dans ``book_terms`` avec leur fréquence pondérée pour la
+recherche plein texte classée (la longueur de chaque notice est dans
+``book_text``, leur nombre et leur somme dans ``meta``).
+
+Les lectures renvoient des éléments ``<book>``, ``<user>`` et ``<loan>``
+construits à la volée : les modifier ne change pas la base, il faut passer
+par les opérations de ``storage.Storage``.
+
+``create`` remplit une base à partir d'un arbre XML et ``to_tree`` refait
+l'arbre : les attributs de la racine et des conteneurs, l'ordre du document
+et les champs absents sont conservés, seule la mise en forme (indentation)
+est perdue. Un arbre qu'elle ne saurait pas restituer à l'identique est
+refusé.
+"""
+
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import metrics
+from search_index import TEXT_FIELDS, BookQuery, LoanQuery, bm25_rank, fold, text_terms, tokenize
+from storage import COLLECTIONS, INDEXED_FIELDS, Storage, as_key, year_bounds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    element TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (element, name)
+);
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    pos INTEGER NOT NULL,
+    title TEXT,
+    author TEXT,
+    genre TEXT,
+    year TEXT,
+    title_key TEXT NOT NULL,
+    author_key TEXT NOT NULL,
+    year_num INTEGER
+);
+CREATE INDEX IF NOT EXISTS books_pos ON books (pos);
+CREATE INDEX IF NOT EXISTS books_title ON books (title, pos);
+CREATE INDEX IF NOT EXISTS books_title_key ON books (title_key, pos);
+CREATE INDEX IF NOT EXISTS books_author_key ON books (author_key, pos);
+CREATE INDEX IF NOT EXISTS books_year ON books (year_num, pos);
+CREATE TABLE IF NOT EXISTS book_words (
+    field TEXT NOT NULL,
+    word TEXT NOT NULL,
+    book_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS book_words_word ON book_words (field, word);
+CREATE INDEX IF NOT EXISTS book_words_book ON book_words (book_id);
+CREATE TABLE IF NOT EXISTS book_terms (
+    term TEXT NOT NULL,
+    book_id INTEGER NOT NULL,
+    weight INTEGER NOT NULL,
+    PRIMARY KEY (term, book_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS book_terms_book ON book_terms (book_id);
+CREATE TABLE IF NOT EXISTS book_text (
+    book_id INTEGER PRIMARY KEY,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    pos INTEGER NOT NULL,
+    name TEXT,
+    name_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_pos ON users (pos);
+CREATE INDEX IF NOT EXISTS users_name ON users (name, pos);
+CREATE INDEX IF NOT EXISTS users_name_key ON users (name_key, pos);
+CREATE TABLE IF NOT EXISTS loans (
+    pos INTEGER PRIMARY KEY,
+    book_id TEXT,
+    user_id TEXT,
+    date_out TEXT,
+    date_due TEXT,
+    returned TEXT,
+    date_return TEXT
+);
+CREATE INDEX IF NOT EXISTS loans_active ON loans (book_id, pos) WHERE returned = 'false';
+CREATE INDEX IF NOT EXISTS loans_date_return ON loans (date_return) WHERE returned = 'true';
+CREATE INDEX IF NOT EXISTS loans_date_out ON loans (date_out, pos);
+CREATE INDEX IF NOT EXISTS loans_date_due ON loans (date_due, pos);
+CREATE INDEX IF NOT EXISTS loans_active_out ON loans (date_out, pos) WHERE returned = 'false';
+CREATE INDEX IF NOT EXISTS loans_active_due ON loans (date_due, pos) WHERE returned = 'false';
+CREATE INDEX IF NOT EXISTS loans_user ON loans (user_id, pos);
+CREATE INDEX IF NOT EXISTS loans_user_open ON loans (user_id) WHERE returned = 'false';
+CREATE TABLE IF NOT EXISTS stats (
+    kind TEXT,
+    key TEXT,
+    month TEXT,
+    value INTEGER,
+    PRIMARY KEY (kind, key, month)
+) WITHOUT ROWID;
+"""
+
+BOOK_FIELDS = ("title", "author", "genre", "year")
+LOAN_FIELDS = ("book_id", "user_id", "date_out", "date_due", "returned", "date_return")
+# Mots indexés pour la recherche par début de mot.
+WORD_FIELDS = ("author", "genre")
+
+_BOOK_COLUMNS = "id, title, author, genre, year"
+_USER_COLUMNS = "id, name"
+_LOAN_COLUMNS = ", ".join(LOAN_FIELDS)
+# Prêt en cours : le premier prêt non rendu de son livre, comme dans ``LibraryStore``.
+_ACTIVE = (
+    "returned = 'false' AND pos = (SELECT MIN(other.pos) FROM loans AS other "
+    "WHERE other.book_id = loans.book_id AND other.returned = 'false')"
+)
+
+# Clauses ORDER BY des champs de tri (mêmes noms que ``store.SORT_KEYS``) ;
+# ``pos`` reproduit l'ordre du document et départage les égalités.
+ORDERS = {
+    "books": {
+        "id": ("pos",),
+        "title": ("title_key", "pos"),
+        "author": ("author_key", "pos"),
+        "year": ("year_num IS NULL", "year_num", "COALESCE(year, '')", "pos"),
+    },
+    "users": {"id": ("pos",), "name": ("name_key", "pos")},
+    "loans": {
+        "id": ("pos",),
+        "date_out": ("COALESCE(date_out, '')", "pos"),
+        "date_due": ("COALESCE(date_due, '')", "pos"),
+    },
+}
+
+
+def _year_number(year: str | None) -> int | None:
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        return None
+
+
+def _identifier(value) -> int | None:
+    """Identifiant numérique, ou ``None`` si ``value`` ne peut pas en être un."""
+    text = as_key(value)
+    return int(text) if text.isdigit() and str(int(text)) == text else None
+
+
+def _prefix_end(prefix: str) -> str:
+    """Plus petite chaîne supérieure à toutes celles qui commencent par ``prefix``."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _text(value: str | None) -> str | None:
+    # Un sous-élément vide est gardé comme chaîne vide, un absent comme NULL.
+    return value or None
+
+
+def _book(row) -> ET.Element:
+    book = ET.Element("book", id=str(row[0]))
+    for tag, text in zip(BOOK_FIELDS, row[1:]):
+        if text is not None:
+            ET.SubElement(book, tag).text = _text(text)
+    return book
+
+
+def _user(row) -> ET.Element:
+    user = ET.Element("user", id=str(row[0]))
+    if row[1] is not None:
+        ET.SubElement(user, "name").text = _text(row[1])
+    return user
+
+
+def _loan(row) -> ET.Element:
+    return ET.Element("loan", {name: value for name, value in zip(LOAN_FIELDS, row) if value is not None})
+
+
+class SQLiteStore(Storage):
+    """Bibliothèque rangée dans une base SQLite, une connexion par fil d'exécution."""
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self.path = Path(path)
+        self._local = threading.local()
+        self._db.executescript(SCHEMA)
+        if self._meta("stats", "built") is None:
+            # Base créée avant les statistiques : les compteurs partent des prêts
+            # existants ; ``rebuild-stats`` y ajoute les prêts archivés.
+            self.rebuild_stats()
+            self._db.commit()
+        if self._meta("text", "documents") is None:
+            # Base créée avant l'index plein texte.
+            self._rebuild_text()
+            self._db.commit()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=30)
+        return connection
+
+    def commit(self) -> None:
+        """Valide les modifications du fil courant."""
+        self._db.commit()
+        self.pending.clear()
+
+    def rollback(self) -> None:
+        """Abandonne les modifications du fil courant."""
+        self._db.rollback()
+        self.pending.clear()
+
+    def close(self) -> None:
+        """Ferme la connexion du fil courant."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    # -- attributs des conteneurs --------------------------------------
+
+    def _meta(self, element: str, name: str) -> str | None:
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE element = ? AND name = ?", (element, name)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, element: str, name: str, value: str) -> None:
+        # La mise à jour sur place garde l'ordre d'origine des attributs.
+        self._db.execute(
+            "INSERT INTO meta (element, name, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (element, name) DO UPDATE SET value = excluded.value",
+            (element, name, value),
+        )
+
+    def _attributes(self, element: str) -> dict[str, str]:
+        rows = self._db.execute(
+            "SELECT name, value FROM meta WHERE element = ? ORDER BY rowid", (element,)
+        )
+        return dict(rows.fetchall())
+
+    @property
+    def seq(self) -> int:
+        return int(self._meta("library", "seq") or 0)
+
+    @seq.setter
+    def seq(self, value: int) -> None:
+        self._set_meta("library", "seq", str(value))
+
+    def _record_seq(self) -> None:
+        # ``seq`` est écrit dans la base à chaque affectation.
+        pass
+
+    def _allocate_id(self, collection: str) -> str:
+        allocated = int(self._meta(collection, "next_id") or self._highest_id(collection) + 1)
+        self._set_meta(collection, "next_id", str(allocated + 1))
+        return str(allocated)
+
+    def _highest_id(self, collection: str) -> int:
+        return self._db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {collection}").fetchone()[0]
+
+    def _bump_sequence(self, collection: str, used_id: int) -> None:
+        """Garantit que le compteur ``next_id`` dépasse un identifiant rejoué."""
+        if int(self._meta(collection, "next_id") or 1) <= used_id:
+            self._set_meta(collection, "next_id", str(used_id + 1))
+
+    def _next_pos(self, collection: str) -> int:
+        return self._db.execute(f"SELECT COALESCE(MAX(pos), 0) + 1 FROM {collection}").fetchone()[0]
+
+    # -- lectures ------------------------------------------------------
+
+    def book(self, book_id: str) -> ET.Element | None:
+        """Retourne le livre portant cet identifiant."""
+        identifier = _identifier(book_id)
+        if identifier is None:
+            return None
+        row = self._db.execute(f"SELECT {_BOOK_COLUMNS} FROM books WHERE id = ?", (identifier,)).fetchone()
+        return _book(row) if row else None
+
+    def user(self, user_id: str) -> ET.Element | None:
+        """Retourne l'utilisateur portant cet identifiant."""
+        identifier = _identifier(user_id)
+        if identifier is None:
+            return None
+        row = self._db.execute(f"SELECT {_USER_COLUMNS} FROM users WHERE id = ?", (identifier,)).fetchone()
+        return _user(row) if row else None
+
+    def find_book(self, identifier: str) -> ET.Element | None:
+        """Retourne le livre correspondant à l'id ou, à défaut, au titre."""
+        book = self.book(identifier)
+        if book is None:
+            row = self._db.execute(
+                f"SELECT {_BOOK_COLUMNS} FROM books WHERE title = ? ORDER BY pos LIMIT 1", (identifier,)
+            ).fetchone()
+            book = _book(row) if row else None
+        return book
+
+    def find_user(self, identifier: str) -> ET.Element | None:
+        """Retourne l'utilisateur correspondant à l'id ou, à défaut, au nom."""
+        user = self.user(identifier)
+        if user is None:
+            row = self._db.execute(
+                f"SELECT {_USER_COLUMNS} FROM users WHERE name = ? ORDER BY pos LIMIT 1", (identifier,)
+            ).fetchone()
+            user = _user(row) if row else None
+        return user
+
+    def _active_pos(self, book_id: str) -> int | None:
+        row = self._db.execute(
+            "SELECT pos FROM loans WHERE book_id = ? AND returned = 'false' ORDER BY pos LIMIT 1",
+            (str(book_id),),
+        ).fetchone()
+        return row[0] if row else None
+
+    def active_loan(self, book_id: str) -> ET.Element | None:
+        """Retourne le prêt en cours du livre, s'il existe."""
+        row = self._db.execute(
+            f"SELECT {_LOAN_COLUMNS} FROM loans WHERE book_id = ? AND returned = 'false' "
+            "ORDER BY pos LIMIT 1",
+            (str(book_id),),
+        ).fetchone()
+        return _loan(row) if row else None
+
+    def user_loans(self, user_id: str) -> list[ET.Element]:
+        """Retourne les prêts de l'utilisateur, en cours ou rendus, dans l'ordre du document."""
+        rows = self._db.execute(
+            f"SELECT {_LOAN_COLUMNS} FROM loans WHERE user_id = ? ORDER BY pos", (str(user_id),)
+        )
+        return [_loan(row) for row in rows]
+
+    def open_loans(self, user_id: str) -> int:
+        """Nombre de prêts non rendus de l'utilisateur."""
+        return self._db.execute(
+            "SELECT COUNT(*) FROM loans WHERE user_id = ? AND returned = 'false'", (str(user_id),)
+        ).fetchone()[0]
+
+    def counts(self) -> dict[str, int]:
+        """Nombre d'éléments de chaque collection et de prêts en cours."""
+        counts = {
+            collection: self._db.execute(f"SELECT COUNT(*) FROM {collection}").fetchone()[0]
+            for collection in COLLECTIONS
+        }
+        counts["active_loans"] = self._db.execute(
+            "SELECT COUNT(DISTINCT book_id) FROM loans WHERE returned = 'false'"
+        ).fetchone()[0]
+        return counts
+
+    @metrics.timed("query")
+    def page(self, collection: str, sort: str | None = None, offset: int = 0, limit: int | None = None):
+        """Retourne une page d'une collection et le nombre total d'éléments.
+
+        Le tri et le découpage sont faits par la base (``ORDER BY``, ``LIMIT``
+        et ``OFFSET``) à l'aide de ses index.
+        """
+        descending = bool(sort) and sort.startswith("-")
+        field = sort.lstrip("-") if sort else "id"
+        orders = ORDERS[collection]
+        if field not in orders:
+            raise ValueError(f"Unknown sort field: {field}")
+        direction = " DESC" if descending else ""
+        order = ", ".join(term + direction for term in orders[field])
+        total = self._db.execute(f"SELECT COUNT(*) FROM {collection}").fetchone()[0]
+        offset = max(offset, 0)
+        columns, build = self._reader(collection)
+        rows = self._db.execute(
+            f"SELECT {columns} FROM {collection} ORDER BY {order} LIMIT ? OFFSET ?",
+            (-1 if limit is None else max(limit, 0), offset),
+        )
+        return [build(row) for row in rows], total
+
+    @staticmethod
+    def _reader(collection: str):
+        if collection == "books":
+            return _BOOK_COLUMNS, _book
+        if collection == "users":
+            return _USER_COLUMNS, _user
+        return _LOAN_COLUMNS, _loan
+
+    @staticmethod
+    def _word_conditions(field: str, text: str) -> tuple[list[str], list]:
+        """Conditions SQL « chaque mot de ``text`` commence un mot de ``field`` »."""
+        conditions, parameters = [], []
+        for token in sorted(set(tokenize(text))):
+            conditions.append(
+                "id IN (SELECT book_id FROM book_words WHERE field = ? AND word >= ? AND word < ?)"
+            )
+            parameters += [field, token, _prefix_end(token)]
+        return conditions, parameters
+
+    def _select_books(self, conditions: list[str], parameters: list, order: str = "id") -> list[ET.Element]:
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        rows = self._db.execute(f"SELECT {_BOOK_COLUMNS} FROM books{where} ORDER BY {order}", parameters)
+        return [_book(row) for row in rows]
+
+    def _rank_text(self, text: str) -> list[tuple[str, float]]:
+        """Livres dont le titre, l'auteur ou le genre contient chaque mot de ``text``, classés."""
+        matches, lengths = [], {}
+        for token in sorted(set(tokenize(text))):
+            postings: dict[str, dict[str, int]] = {}
+            rows = self._db.execute(
+                "SELECT term, book_id, weight, length FROM book_terms JOIN book_text USING (book_id) "
+                "WHERE term >= ? AND term < ?",
+                (token, _prefix_end(token)),
+            )
+            for term, book_id, weight, length in rows:
+                key = str(book_id)
+                postings.setdefault(term, {})[key] = weight
+                lengths[key] = length
+            matches.append(list(postings.values()))
+        documents = int(self._meta("text", "documents"))
+        return bm25_rank(matches, documents, int(self._meta("text", "length")), lengths)
+
+    @metrics.timed("query")
+    def search_books(self, query: BookQuery) -> list[ET.Element]:
+        """Retourne les livres satisfaisant ``query``, dans l'ordre des identifiants.
+
+        Avec un critère ``text``, ils sont classés par pertinence comme dans
+        ``LibraryStore`` ; les autres critères filtrent ce classement.
+        """
+        if query.impossible:
+            return []
+        conditions, parameters = [], []
+        for field in WORD_FIELDS:
+            if getattr(query, field):
+                more, values = self._word_conditions(field, getattr(query, field))
+                conditions += more
+                parameters += values
+        if query.year_from is not None:
+            conditions.append("year_num >= ?")
+            parameters.append(query.year_from)
+        if query.year_to is not None:
+            conditions.append("year_num <= ?")
+            parameters.append(query.year_to)
+        if not query.text:
+            return self._select_books(conditions, parameters)
+        ranked = [int(key) for key, _ in self._rank_text(query.text)]
+        found = {}
+        # Par paquets, sous la limite de paramètres d'une requête SQLite.
+        for start in range(0, len(ranked), 500):
+            chunk = ranked[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            for book in self._select_books([f"id IN ({placeholders})", *conditions], [*chunk, *parameters]):
+                found[book.get("id")] = book
+        return [found[str(book_id)] for book_id in ranked if str(book_id) in found]
+
+    @metrics.timed("query")
+    def search_loans(self, query: LoanQuery) -> list[ET.Element]:
+        """Retourne les prêts satisfaisant ``query``, dans le même ordre que ``LibraryStore``."""
+        conditions, parameters = [] if query.include_returned else [_ACTIVE], []
+        for condition, value in (
+            ("date_out >= ?", query.out_low),
+            ("date_out <= ?", query.out_high),
+            ("date_due < ?", query.due_before),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        order = "date_out" if query.has_out or query.due_before is None else "date_due"
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        rows = self._db.execute(
+            f"SELECT {_LOAN_COLUMNS} FROM loans{where} ORDER BY {order}, pos", parameters
+        )
+        return [_loan(row) for row in rows]
+
+    def lookup(self, collection: str, field: str, op: str, value) -> list[ET.Element] | None:
+        """Éléments candidats pour la condition « ``field`` ``op`` ``value`` ».
+
+        Même contrat que ``LibraryStore.lookup`` : ``None`` lorsqu'aucun index
+        ne s'applique, et l'appelant revérifie la condition.
+        """
+        if op not in INDEXED_FIELDS.get((collection, field), ()):
+            return None
+        value = "" if value is None else value
+        if field == "@id":
+            element = (self.book if collection == "books" else self.user)(as_key(value))
+            return [element] if element is not None else []
+        if (collection, field) == ("books", "title"):
+            return self._select_books(["title = ?"], [as_key(value)], "pos")
+        if (collection, field) == ("users", "name"):
+            rows = self._db.execute(
+                f"SELECT {_USER_COLUMNS} FROM users WHERE name = ? ORDER BY pos", (as_key(value),)
+            )
+            return [_user(row) for row in rows]
+        if (collection, field) == ("loans", "@returned"):
+            return list(self.iter_active_loans()) if value == "false" else None
+        if field == "year":
+            bounds = year_bounds(op, value)
+            if bounds is None:
+                return []
+            conditions, parameters = ["year_num IS NOT NULL"], []
+            for condition, bound in zip(("year_num >= ?", "year_num <= ?"), bounds):
+                if bound is not None:
+                    conditions.append(condition)
+                    parameters.append(bound)
+            return self._select_books(conditions, parameters)
+        if not tokenize(as_key(value)):
+            return None
+        return self._select_books(*self._word_conditions(field, as_key(value)))
+
+    def iter_books(self):
+        """Parcourt les livres dans l'ordre du document."""
+        return map(_book, self._db.execute(f"SELECT {_BOOK_COLUMNS} FROM books ORDER BY pos"))
+
+    def iter_users(self):
+        """Parcourt les utilisateurs dans l'ordre du document."""
+        return map(_user, self._db.execute(f"SELECT {_USER_COLUMNS} FROM users ORDER BY pos"))
+
+    def iter_loans(self):
+        """Parcourt tous les prêts, rendus ou non."""
+        return map(_loan, self._db.execute(f"SELECT {_LOAN_COLUMNS} FROM loans ORDER BY pos"))
+
+    def iter_active_loans(self):
+        """Parcourt les prêts en cours (le premier de chaque livre)."""
+        rows = self._db.execute(
+            f"SELECT {_LOAN_COLUMNS} FROM loans WHERE pos IN "
+            "(SELECT MIN(pos) FROM loans WHERE returned = 'false' GROUP BY book_id) ORDER BY pos"
+        )
+        return map(_loan, rows)
+
+    def archive_policy(self) -> tuple[int, str] | None:
+        """Retourne l'âge (en jours) et le découpage de l'archivage automatique."""
+        days = self._meta("loans", "archive_after_days")
+        if days is None:
+            return None
+        return int(days), self._meta("loans", "archive_by") or "month"
+
+    def archived_before(self) -> str:
+        """Date avant laquelle les prêts rendus ont déjà été archivés (``""`` : jamais)."""
+        return self._meta("loans", "archived_before") or ""
+
+    def to_tree(self) -> ET.ElementTree:
+        """Reconstitue l'arbre XML complet de la bibliothèque."""
+        root = ET.Element("library", self._attributes("library"))
+        for collection, records in (
+            ("books", self.iter_books()),
+            ("users", self.iter_users()),
+            ("loans", self.iter_loans()),
+        ):
+            container = ET.SubElement(root, collection, self._attributes(collection))
+            container.extend(records)
+        return ET.ElementTree(root)
+
+    # -- statistiques --------------------------------------------------
+
+    def _stat_rows(self, kinds):
+        placeholders = ", ".join("?" for _ in kinds)
+        return self._db.execute(
+            f"SELECT kind, key, month, value FROM stats WHERE kind IN ({placeholders})", tuple(kinds)
+        )
+
+    def _stat_months(self, book_id: str) -> list[tuple[str, int]]:
+        return self._db.execute(
+            "SELECT month, value FROM stats WHERE kind = 'book' AND key = ?", (str(book_id),)
+        ).fetchall()
+
+    def _update_stats(self, deltas: list) -> None:
+        summed: dict[tuple[str, str, str], int] = {}
+        for key, delta in deltas:
+            summed[key] = summed.get(key, 0) + delta
+        self._db.executemany(
+            "INSERT INTO stats (kind, key, month, value) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (kind, key, month) DO UPDATE SET value = value + excluded.value",
+            [(*key, delta) for key, delta in summed.items() if delta],
+        )
+        self._db.executemany(
+            "DELETE FROM stats WHERE kind = ? AND key = ? AND month = ? AND value = 0", list(summed)
+        )
+
+    def _replace_stats(self, counters: dict) -> None:
+        self._db.execute("DELETE FROM stats")
+        self._db.executemany(
+            "INSERT INTO stats (kind, key, month, value) VALUES (?, ?, ?, ?)",
+            [(*key, value) for key, value in counters.items()],
+        )
+        self._set_meta("stats", "built", "1")
+
+    # -- index plein texte ---------------------------------------------
+
+    def _index_text(self, book_id: int, book: ET.Element | None) -> None:
+        """Remplace les mots de ``book`` dans l'index plein texte (``None`` : livre retiré)."""
+        documents, length = int(self._meta("text", "documents")), int(self._meta("text", "length"))
+        row = self._db.execute("SELECT length FROM book_text WHERE book_id = ?", (book_id,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM book_terms WHERE book_id = ?", (book_id,))
+            self._db.execute("DELETE FROM book_text WHERE book_id = ?", (book_id,))
+            documents, length = documents - 1, length - row[0]
+        if book is not None:
+            terms = text_terms(book)
+            self._db.executemany(
+                "INSERT INTO book_terms (term, book_id, weight) VALUES (?, ?, ?)",
+                [(term, book_id, weight) for term, weight in terms.items()],
+            )
+            self._db.execute(
+                "INSERT INTO book_text (book_id, length) VALUES (?, ?)", (book_id, sum(terms.values()))
+            )
+            documents, length = documents + 1, length + sum(terms.values())
+        self._set_meta("text", "documents", str(documents))
+        self._set_meta("text", "length", str(length))
+
+    def _rebuild_text(self) -> None:
+        """Remplit l'index plein texte à partir de tous les livres."""
+        terms, lengths = [], []
+        for book in self.iter_books():
+            book_id = int(book.get("id"))
+            weights = text_terms(book)
+            terms += [(term, book_id, weight) for term, weight in weights.items()]
+            lengths.append((book_id, sum(weights.values())))
+        self._db.execute("DELETE FROM book_terms")
+        self._db.execute("DELETE FROM book_text")
+        self._db.executemany("INSERT INTO book_terms (term, book_id, weight) VALUES (?, ?, ?)", terms)
+        self._db.executemany("INSERT INTO book_text (book_id, length) VALUES (?, ?)", lengths)
+        self._set_meta("text", "documents", str(len(lengths)))
+        self._set_meta("text", "length", str(sum(length for _, length in lengths)))
+
+    # -- opérations ----------------------------------------------------
+
+    def _index_words(self, book_id: int, values: dict) -> None:
+        for field in WORD_FIELDS:
+            if field in values:
+                self._db.execute("DELETE FROM book_words WHERE book_id = ? AND field = ?", (book_id, field))
+                self._db.executemany(
+                    "INSERT INTO book_words (field, word, book_id) VALUES (?, ?, ?)",
+                    [(field, word, book_id) for word in set(tokenize(values[field]))],
+                )
+
+    def _apply_add_book(self, op: dict) -> ET.Element:
+        book_id = int(op["id"])
+        self._db.execute(
+            "INSERT INTO books (id, pos, title, author, genre, year, title_key, author_key, year_num) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                book_id,
+                self._next_pos("books"),
+                *(op[field] for field in BOOK_FIELDS),
+                fold(op["title"]),
+                fold(op["author"]),
+                _year_number(op["year"]),
+            ),
+        )
+        self._index_words(book_id, op)
+        book = _book((book_id, *(op[field] for field in BOOK_FIELDS)))
+        self._index_text(book_id, book)
+        self._bump_sequence("books", book_id)
+        return book
+
+    def _apply_update_book(self, op: dict) -> None:
+        book_id = int(op["id"])
+        if self.book(op["id"]) is None:
+            raise KeyError(op["id"])
+        values = {field: op[field] for field in BOOK_FIELDS if field in op}
+        if "title" in values:
+            values["title_key"] = fold(values["title"])
+        if "author" in values:
+            values["author_key"] = fold(values["author"])
+        if "year" in values:
+            values["year_num"] = _year_number(values["year"])
+        if values:
+            assignments = ", ".join(f"{column} = ?" for column in values)
+            self._db.execute(f"UPDATE books SET {assignments} WHERE id = ?", (*values.values(), book_id))
+        self._index_words(book_id, op)
+        if any(field in op for field in TEXT_FIELDS):
+            self._index_text(book_id, self.book(op["id"]))
+
+    def _apply_delete_book(self, op: dict) -> None:
+        book_id = int(op["id"])
+        if self._db.execute("DELETE FROM books WHERE id = ?", (book_id,)).rowcount == 0:
+            raise KeyError(op["id"])
+        self._db.execute("DELETE FROM book_words WHERE book_id = ?", (book_id,))
+        self._index_text(book_id, None)
+
+    def _apply_add_user(self, op: dict) -> ET.Element:
+        user_id = int(op["id"])
+        self._db.execute(
+            "INSERT INTO users (id, pos, name, name_key) VALUES (?, ?, ?, ?)",
+            (user_id, self._next_pos("users"), op["name"], fold(op["name"])),
+        )
+        self._bump_sequence("users", user_id)
+        return _user((user_id, op["name"]))
+
+    def _apply_update_user(self, op: dict) -> None:
+        cursor = self._db.execute(
+            "UPDATE users SET name = ?, name_key = ? WHERE id = ?",
+            (op["name"], fold(op["name"]), int(op["id"])),
+        )
+        if cursor.rowcount == 0:
+            raise KeyError(op["id"])
+
+    def _apply_delete_user(self, op: dict) -> None:
+        if self._db.execute("DELETE FROM users WHERE id = ?", (int(op["id"]),)).rowcount == 0:
+            raise KeyError(op["id"])
+
+    def _apply_add_loan(self, op: dict) -> ET.Element:
+        values = {field: op[field] for field in ("book_id", "user_id", "date_out", "date_due")}
+        values["returned"] = "false"
+        if "date_return" in op:
+            values["returned"] = "true"
+            values["date_return"] = op["date_return"]
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        self._db.execute(f"INSERT INTO loans ({columns}) VALUES ({placeholders})", tuple(values.values()))
+        return ET.Element("loan", values)
+
+    def _apply_return_loan(self, op: dict) -> None:
+        pos = self._active_pos(op["book_id"])
+        if pos is None:
+            raise KeyError(op["book_id"])
+        self._db.execute(
+            "UPDATE loans SET returned = 'true', date_return = ? WHERE pos = ?", (op["date_return"], pos)
+        )
+
+    def _apply_extend_loan(self, op: dict) -> None:
+        pos = self._active_pos(op["book_id"])
+        if pos is None:
+            raise KeyError(op["book_id"])
+        self._db.execute("UPDATE loans SET date_due = ? WHERE pos = ?", (op["date_due"], pos))
+
+    def _apply_archive_loans(self, op: dict) -> list[ET.Element]:
+        condition = "returned = 'true' AND COALESCE(date_return, '') < ?"
+        rows = self._db.execute(
+            f"SELECT {_LOAN_COLUMNS} FROM loans WHERE {condition} ORDER BY pos", (op["before"],)
+        ).fetchall()
+        self._db.execute(f"DELETE FROM loans WHERE {condition}", (op["before"],))
+        self._set_meta("loans", "archived_before", max(op["before"], self.archived_before()))
+        return [_loan(row) for row in rows]
+
+    def _apply_set_archive_policy(self, op: dict) -> None:
+        if op["after_days"] > 0:
+            self._set_meta("loans", "archive_after_days", str(op["after_days"]))
+            self._set_meta("loans", "archive_by", op["by"])
+        else:
+            self._db.execute(
+                "DELETE FROM meta WHERE element = 'loans' AND name IN ('archive_after_days', 'archive_by')"
+            )
+
+    # -- import --------------------------------------------------------
+
+    @classmethod
+    def create(cls, path: Path, tree: ET.ElementTree, archived=()) -> "SQLiteStore":
+        """Crée la base ``path`` avec le contenu de ``tree``.
+
+        ``archived`` fournit les prêts archivés, comptés dans les statistiques.
+
+        Lève ``ValueError`` si l'arbre contient des éléments ou attributs que
+        la base ne saurait pas restituer.
+        """
+        store = cls(path)
+        root = tree.getroot()
+        meta = [("library", name, value) for name, value in root.attrib.items()]
+        books, words, users, loans = [], [], [], []
+        highest = {"books": 0, "users": 0}
+        for container in root:
+            if container.tag not in COLLECTIONS:
+                raise ValueError(f"Unsupported element <{container.tag}> in <library>")
+            meta += [(container.tag, name, value) for name, value in container.attrib.items()]
+            for pos, record in enumerate(container, 1):
+                if container.tag == "loans":
+                    loans.append((pos, *_loan_values(record)))
+                    continue
+                identifier = _record_id(record, container.tag)
+                highest[container.tag] = max(highest[container.tag], identifier)
+                if container.tag == "books":
+                    fields = _child_texts(record, BOOK_FIELDS)
+                    title, author, _, year = fields
+                    books.append((identifier, pos, *fields, fold(title), fold(author), _year_number(year)))
+                    for field, text in zip(BOOK_FIELDS, fields):
+                        if field in WORD_FIELDS:
+                            words += [(field, word, identifier) for word in set(tokenize(text))]
+                else:
+                    (name,) = _child_texts(record, ("name",))
+                    users.append((identifier, pos, name, fold(name)))
+        db = store._db
+        db.executemany("INSERT INTO meta (element, name, value) VALUES (?, ?, ?)", meta)
+        db.executemany("INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", books)
+        db.executemany("INSERT INTO book_words (field, word, book_id) VALUES (?, ?, ?)", words)
+        db.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", users)
+        db.executemany(f"INSERT INTO loans (pos, {_LOAN_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", loans)
+        # Même règle que ``LibraryStore`` : le compteur dépasse le plus grand identifiant.
+        for collection, value in highest.items():
+            store._bump_sequence(collection, value)
+        store.rebuild_stats(archived)
+        store._rebuild_text()
+        store.commit()
+        return store
+
+
+def _record_id(record: ET.Element, collection: str) -> int:
+    expected = collection[:-1]
+    if record.tag != expected or set(record.attrib) != {"id"}:
+        raise ValueError(f"Unsupported <{record.tag}> in <{collection}>: expected <{expected} id=...>")
+    identifier = _identifier(record.get("id"))
+    if identifier is None:
+        raise ValueError(f"Unsupported identifier {record.get('id')!r} in <{collection}>")
+    return identifier
+
+
+def _child_texts(record: ET.Element, fields: tuple[str, ...]) -> list[str | None]:
+    """Textes des sous-éléments ``fields`` (``None`` : absent, ``""`` : vide)."""
+    texts = dict.fromkeys(fields)
+    for child in record:
+        if child.tag not in texts or texts[child.tag] is not None or len(child) or child.attrib:
+            raise ValueError(f"Unsupported <{child.tag}> in <{record.tag} id={record.get('id')!r}>")
+        texts[child.tag] = child.text or ""
+    return list(texts.values())
+
+
+def _loan_values(record: ET.Element) -> list[str | None]:
+    if record.tag != "loan" or len(record) or not set(record.attrib) <= set(LOAN_FIELDS):
+        raise ValueError(f"Unsupported <{record.tag}> in <loans>")
+    return [record.get(field) for field in LOAN_FIELDS]
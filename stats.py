@@ -0,0 +1,179 @@
+"""Statistiques de circulation des prêts.
+
+Les statistiques sont des compteurs ``(kind, key, month) -> nombre`` :
+
+- ``book`` : prêts de chaque livre par mois de sortie ; ils permettent de
+  réattribuer ces prêts lorsque le livre change d'auteur ou de genre, ou
+  disparaît du catalogue ;
+- ``genre`` : prêts par genre et par mois de sortie ;
+- ``author`` et ``origin`` : prêts par auteur et par origine de l'auteur ;
+- ``user`` : prêts par utilisateur ;
+- ``duration`` : nombre de prêts rendus (``returned``) et cumul de leurs
+  durées en jours (``days``).
+
+Seuls ``book`` et ``genre`` sont ventilés par mois (``month`` vaut ``""``
+pour les autres). Les moteurs de stockage appliquent, à chaque opération, les
+variations calculées ici. L'archivage n'y change rien : un prêt archivé reste
+compté, et un recalcul complet relit les segments d'archive.
+"""
+
+import datetime
+import heapq
+import xml.etree.ElementTree as ET
+
+from search_index import fold
+
+KINDS = ("book", "genre", "author", "origin", "user", "duration")
+
+# Origine des auteurs : noms connus d'abord, puis nom de famille.
+SENEGALESE_AUTHORS = {
+    "mariama ba",
+    "cheikh hamidou kane",
+    "ousmane sembene",
+    "leopold sedar senghor",
+    "aminata sow fall",
+    "boubacar boris diop",
+    "fatou diome",
+    "abdoulaye sadji",
+    "birago diop",
+    "ken bugul",
+    "mohamed mbougar sarr",
+    "david diop",
+}
+FRENCH_AUTHORS = {
+    "victor hugo",
+    "albert camus",
+    "emile zola",
+    "marguerite duras",
+    "annie ernaux",
+    "gustave flaubert",
+    "simone de beauvoir",
+    "marcel proust",
+    "george sand",
+    "jules verne",
+    "honore de balzac",
+    "patrick modiano",
+}
+SENEGALESE_NAMES = {
+    "ba", "cisse", "diallo", "diop", "diouf", "fall", "faye", "gueye", "kane",
+    "mbaye", "ndiaye", "niang", "sarr", "seck", "sembene", "senghor", "sow", "thiam",
+}
+FRENCH_NAMES = {
+    "bernard", "bonnet", "chevalier", "dubois", "durand", "faure", "fournier",
+    "garnier", "girard", "laurent", "lefevre", "martin", "mercier", "michel",
+    "moreau", "petit", "rousseau", "simon",
+}
+
+
+def author_origin(author: str | None) -> str:
+    """Origine d'un auteur : ``"senegalese"``, ``"french"`` ou ``"other"``."""
+    name = " ".join(fold(author).split())
+    if name in SENEGALESE_AUTHORS:
+        return "senegalese"
+    if name in FRENCH_AUTHORS:
+        return "french"
+    family = name.rsplit(" ", 1)[-1]
+    if family in SENEGALESE_NAMES:
+        return "senegalese"
+    if family in FRENCH_NAMES:
+        return "french"
+    return "other"
+
+
+def loan_days(loan: ET.Element) -> int | None:
+    """Durée d'un prêt rendu en jours, ou ``None`` si ses dates sont illisibles."""
+    try:
+        start = datetime.date.fromisoformat(loan.get("date_out") or "")
+        end = datetime.date.fromisoformat(loan.get("date_return") or "")
+    except ValueError:
+        return None
+    return (end - start).days
+
+
+def _book_deltas(book: ET.Element | None, month: str, count: int) -> list:
+    # Un livre supprimé (ou inconnu) compte sous un auteur et un genre vides.
+    author = genre = ""
+    if book is not None:
+        author, genre = book.findtext("author") or "", book.findtext("genre") or ""
+    return [
+        (("genre", genre, month), count),
+        (("author", author, ""), count),
+        (("origin", author_origin(author), ""), count),
+    ]
+
+
+def return_deltas(loan: ET.Element, sign: int = 1) -> list:
+    """Variations dues au retour de ``loan`` (``sign=-1`` pour les retirer)."""
+    days = loan_days(loan)
+    if days is None:
+        return []
+    return [(("duration", "returned", ""), sign), (("duration", "days", ""), sign * days)]
+
+
+def loan_deltas(loan: ET.Element, book: ET.Element | None, sign: int = 1) -> list:
+    """Variations dues à l'ajout de ``loan`` (``sign=-1`` pour son retrait)."""
+    month = (loan.get("date_out") or "")[:7]
+    deltas = [
+        (("book", loan.get("book_id"), month), sign),
+        (("user", loan.get("user_id"), ""), sign),
+        *_book_deltas(book, month, sign),
+    ]
+    if loan.get("returned") == "true":
+        deltas += return_deltas(loan, sign)
+    return deltas
+
+
+def rebook_deltas(months, old: ET.Element | None, new: ET.Element | None) -> list:
+    """Variations qui déplacent les prêts d'un livre de ``old`` vers ``new``.
+
+    ``months`` donne les paires (mois, nombre de prêts) du compteur ``book``.
+    """
+    deltas = []
+    for month, count in months:
+        deltas += _book_deltas(old, month, -count)
+        deltas += _book_deltas(new, month, count)
+    return deltas
+
+
+def compute(books, loans) -> dict:
+    """Recalcule tous les compteurs en un seul passage sur les prêts."""
+    by_id = {book.get("id"): book for book in books}
+    counters: dict[tuple[str, str, str], int] = {}
+    for loan in loans:
+        for key, delta in loan_deltas(loan, by_id.get(loan.get("book_id"))):
+            counters[key] = counters.get(key, 0) + delta
+    return {key: value for key, value in counters.items() if value}
+
+
+def _most_first(item: tuple[str, int]) -> tuple[int, str]:
+    return -item[1], item[0]
+
+
+def summarize(rows, top: int = 10) -> dict:
+    """Rapport lisible à partir des lignes ``(kind, key, month, value)``."""
+    genres, months, genre_months, authors, origins, users, duration = {}, {}, {}, {}, {}, {}, {}
+    for kind, key, month, value in rows:
+        if kind == "genre":
+            genres[key] = genres.get(key, 0) + value
+            months[month] = months.get(month, 0) + value
+            genre_months[(month, key)] = value
+        elif kind == "author":
+            authors[key] = value
+        elif kind == "origin":
+            origins[key] = value
+        elif kind == "user":
+            users[key] = value
+        elif kind == "duration":
+            duration[key] = value
+    returned = duration.get("returned", 0)
+    return {
+        "loans": sum(genres.values()),
+        "returned": returned,
+        "average_days": duration.get("days", 0) / returned if returned else None,
+        "origins": origins,
+        "genres": sorted(genres.items(), key=_most_first),
+        "authors": heapq.nsmallest(top, authors.items(), key=_most_first),
+        "users": heapq.nsmallest(top, users.items(), key=_most_first),
+        "months": sorted(months.items()),
+        "genre_months": sorted(genre_months.items()),
+    }
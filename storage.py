@@ -0,0 +1,319 @@
+"""Interface commune des moteurs de stockage de la bibliothèque.
+
+Deux moteurs la réalisent :
+
+- ``store.LibraryStore`` : l'arbre ElementTree de ``library.xml`` et ses index
+  en mémoire ;
+- ``sqlite_store.SQLiteStore`` : une base SQLite (module ``sqlite3``) avec ses
+  propres index et transactions.
+
+Dans les deux cas, les enregistrements lus sont des éléments ``<book>``,
+``<user>`` et ``<loan>`` identiques à ceux du fichier XML, et chaque
+modification est une opération (un dictionnaire sérialisable en JSON)
+construite ici puis exécutée par la méthode ``_apply_<op>`` du moteur.
+"""
+
+import copy
+import itertools
+import math
+import xml.etree.ElementTree as ET
+
+import stats
+
+COLLECTIONS = ("books", "users", "loans")
+
+# Collection modifiée par chaque opération.
+OP_COLLECTIONS = {
+    "add_book": "books",
+    "update_book": "books",
+    "delete_book": "books",
+    "add_user": "users",
+    "update_user": "users",
+    "delete_user": "users",
+    "add_loan": "loans",
+    "return_loan": "loans",
+    "extend_loan": "loans",
+    "archive_loans": "loans",
+    "set_archive_policy": "loans",
+}
+
+
+# Conditions servies par ``lookup`` : (collection, champ) -> opérateurs.
+INDEXED_FIELDS = {
+    ("books", "@id"): {"="},
+    ("books", "title"): {"="},
+    ("books", "author"): {"="},
+    ("books", "genre"): {"="},
+    ("books", "year"): {"=", "<", "<=", ">", ">="},
+    ("users", "@id"): {"="},
+    ("users", "name"): {"="},
+    ("loans", "@returned"): {"="},
+}
+
+
+def as_key(value) -> str:
+    """Identifiant sous forme de chaîne (``3.0`` → ``"3"``)."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def year_bounds(op: str, value):
+    """Bornes entières inclusives de « year ``op`` ``value`` », ou ``None``."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if op == "=":
+        return (int(number), int(number)) if number.is_integer() else None
+    if op in ("<", "<="):
+        high = math.floor(number)
+        return None, high - 1 if op == "<" and number.is_integer() else high
+    low = math.ceil(number)
+    return low + 1 if op == ">" and number.is_integer() else low, None
+
+
+class Storage:
+    """Opérations communes ; les lectures et les ``_apply_<op>`` sont propres au moteur.
+
+    Un moteur fournit :
+
+    - les lectures ``book``, ``user``, ``find_book``, ``find_user``,
+      ``active_loan``, ``user_loans``, ``open_loans``, ``counts``, ``page``,
+      ``search_books``, ``search_loans``, ``lookup``, ``iter_books``,
+      ``iter_users``, ``iter_loans``, ``iter_active_loans``,
+      ``archive_policy`` et ``archived_before`` ;
+    - ``to_tree()``, l'arbre XML complet de la bibliothèque ;
+    - ``_allocate_id(collection)`` et ``_record_seq()`` ;
+    - une méthode ``_apply_<op>`` par opération de ``OP_COLLECTIONS`` ;
+    - le rangement des compteurs de ``stats`` : ``_stats_tracked``,
+      ``_build_stats``, ``_stat_rows``, ``_stat_months``, ``_update_stats``
+      et ``_replace_stats``.
+    """
+
+    # Numéro de la dernière opération intégrée au stockage.
+    seq = 0
+
+    def __init__(self) -> None:
+        # Opérations appliquées mais pas encore enregistrées.
+        self.pending: list[dict] = []
+
+    def loaded(self, collection: str) -> bool:
+        """Indique si la collection est déjà en mémoire."""
+        return True
+
+    def load_all(self) -> None:
+        """Charge les collections qui ne le sont pas encore."""
+
+    def dirty_collections(self) -> set[str]:
+        """Collections modifiées par les opérations en attente."""
+        return {OP_COLLECTIONS[op["op"]] for op in self.pending}
+
+    def _allocate_id(self, collection: str) -> str:
+        """Réserve le prochain identifiant de ``collection`` sans jamais le réutiliser."""
+        raise NotImplementedError
+
+    def _record_seq(self) -> None:
+        """Reporte ``seq`` dans le stockage."""
+        raise NotImplementedError
+
+    # -- opérations ----------------------------------------------------
+
+    def _commit(self, op: dict):
+        """Applique une opération produite localement et la garde en attente."""
+        result = self.apply(op)
+        self.seq += 1
+        op["seq"] = self.seq
+        self._record_seq()
+        self.pending.append(op)
+        return result
+
+    def apply(self, op: dict):
+        """Exécute une opération décrite par un dictionnaire.
+
+        C'est l'unique chemin de modification : les méthodes publiques
+        construisent l'opération puis l'appliquent, et la relecture du
+        journal rejoue les mêmes dictionnaires.
+        """
+        handler = getattr(self, f"_apply_{op['op']}", None)
+        if handler is None:
+            raise ValueError(f"Unknown operation: {op['op']}")
+        if not self._stats_tracked():
+            return handler(op)
+        before = self._stats_before(op)
+        result = handler(op)
+        deltas = self._stats_deltas(op, before, result)
+        if deltas:
+            self._update_stats(deltas)
+        return result
+
+    def replay(self, ops) -> int:
+        """Rejoue des opérations journalisées plus récentes que le stockage.
+
+        Les opérations déjà intégrées (numéro de séquence inférieur ou égal à
+        ``seq``) sont ignorées. Retourne le nombre d'opérations appliquées.
+        """
+        applied = 0
+        for op in ops:
+            if op["seq"] <= self.seq:
+                continue
+            self.apply(op)
+            self.seq = op["seq"]
+            applied += 1
+        self._record_seq()
+        return applied
+
+    # -- statistiques --------------------------------------------------
+
+    def _stats_tracked(self) -> bool:
+        """Indique si les compteurs de ``stats`` doivent suivre les opérations."""
+        return True
+
+    def _build_stats(self, archived) -> None:
+        """Calcule les compteurs s'ils ne sont pas encore tenus à jour.
+
+        ``archived`` fournit les prêts archivés, qui restent comptés.
+        """
+
+    def _stat_rows(self, kinds):
+        """Lignes ``(kind, key, month, value)`` des compteurs de ``kinds``."""
+        raise NotImplementedError
+
+    def _stat_months(self, book_id: str) -> list[tuple[str, int]]:
+        """Paires (mois, nombre de prêts) du compteur ``book`` d'un livre."""
+        raise NotImplementedError
+
+    def _update_stats(self, deltas: list) -> None:
+        """Ajoute les variations ``((kind, key, month), delta)`` aux compteurs."""
+        raise NotImplementedError
+
+    def _replace_stats(self, counters: dict) -> None:
+        """Remplace tous les compteurs par ``counters``."""
+        raise NotImplementedError
+
+    def _stats_before(self, op: dict):
+        # État qu'une opération modifie sur place et dont les variations dépendent.
+        if op["op"] in ("add_book", "update_book", "delete_book"):
+            book = self.book(op["id"])
+            return copy.deepcopy(book) if book is not None else None
+        if op["op"] == "return_loan":
+            loan = self.active_loan(op["book_id"])
+            return loan.get("date_out") if loan is not None else None
+        return None
+
+    def _stats_deltas(self, op: dict, before, result) -> list:
+        kind = op["op"]
+        if kind in ("add_book", "update_book", "delete_book"):
+            return stats.rebook_deltas(self._stat_months(op["id"]), before, self.book(op["id"]))
+        if kind == "add_loan":
+            return stats.loan_deltas(result, self.book(op["book_id"]))
+        if kind == "return_loan":
+            loan = ET.Element("loan", date_out=before or "", date_return=op["date_return"])
+            return stats.return_deltas(loan)
+        # L'archivage ne change rien : les prêts archivés restent comptés.
+        return []
+
+    def stats(self, top: int = 10, archived=()) -> dict:
+        """Statistiques de circulation des prêts (voir ``stats.summarize``).
+
+        ``archived`` n'est parcouru que si les compteurs doivent être calculés.
+        """
+        self._build_stats(archived)
+        return stats.summarize(self._stat_rows(stats.KINDS[1:]), top)
+
+    def rebuild_stats(self, archived=()) -> tuple[int, int]:
+        """Recalcule les compteurs à partir des prêts, archivés compris, en un seul passage.
+
+        Retourne le nombre de compteurs et le nombre de ceux qui différaient
+        des valeurs tenues à jour.
+        """
+        counters = stats.compute(self.iter_books(), itertools.chain(archived, self.iter_loans()))
+        if not self._stats_tracked():
+            # Aucun compteur tenu à jour : rien à corriger.
+            self._replace_stats(counters)
+            return len(counters), 0
+        previous = {(kind, key, month): value for kind, key, month, value in self._stat_rows(stats.KINDS)}
+        changed = sum(1 for key in counters.keys() | previous.keys() if counters.get(key) != previous.get(key))
+        self._replace_stats(counters)
+        return len(counters), changed
+
+    # -- livres --------------------------------------------------------
+
+    def add_book(self, title: str, author: str, genre: str, year) -> ET.Element:
+        """Ajoute un livre et retourne l'élément créé."""
+        return self._commit(
+            {
+                "op": "add_book",
+                "id": self._allocate_id("books"),
+                "title": title,
+                "author": author,
+                "genre": genre,
+                "year": str(year),
+            }
+        )
+
+    def update_book(self, book: ET.Element, title=None, author=None, genre=None, year=None) -> None:
+        """Modifie les champs fournis d'un livre."""
+        op = {"op": "update_book", "id": book.get("id")}
+        if title:
+            op["title"] = title
+        if author:
+            op["author"] = author
+        if genre:
+            op["genre"] = genre
+        if year is not None:
+            op["year"] = str(year)
+        self._commit(op)
+
+    def delete_book(self, book: ET.Element) -> None:
+        """Retire un livre du catalogue."""
+        self._commit({"op": "delete_book", "id": book.get("id")})
+
+    # -- utilisateurs --------------------------------------------------
+
+    def add_user(self, name: str) -> ET.Element:
+        """Ajoute un utilisateur et retourne l'élément créé."""
+        return self._commit({"op": "add_user", "id": self._allocate_id("users"), "name": name})
+
+    def update_user(self, user: ET.Element, name: str) -> None:
+        """Renomme un utilisateur."""
+        self._commit({"op": "update_user", "id": user.get("id"), "name": name})
+
+    def delete_user(self, user: ET.Element) -> None:
+        """Retire un utilisateur."""
+        self._commit({"op": "delete_user", "id": user.get("id")})
+
+    # -- prêts ---------------------------------------------------------
+
+    def add_loan(
+        self, book_id: str, user_id: str, date_out: str, date_due: str, date_return: str | None = None
+    ) -> ET.Element:
+        """Enregistre un nouveau prêt, en cours ou déjà rendu si ``date_return`` est fourni."""
+        op = {
+            "op": "add_loan",
+            "book_id": str(book_id),
+            "user_id": str(user_id),
+            "date_out": date_out,
+            "date_due": date_due,
+        }
+        if date_return is not None:
+            op["date_return"] = date_return
+        return self._commit(op)
+
+    def return_loan(self, loan: ET.Element, date_return: str) -> None:
+        """Clôt un prêt en cours."""
+        self._commit(
+            {"op": "return_loan", "book_id": loan.get("book_id"), "date_return": date_return}
+        )
+
+    def extend_loan(self, loan: ET.Element, date_due: str) -> None:
+        """Repousse la date de retour prévue d'un prêt."""
+        self._commit({"op": "extend_loan", "book_id": loan.get("book_id"), "date_due": date_due})
+
+    def archive_loans(self, before: str) -> list[ET.Element]:
+        """Retire les prêts rendus avant la date ``before`` et les retourne."""
+        return self._commit({"op": "archive_loans", "before": before})
+
+    def set_archive_policy(self, after_days: int, by: str) -> None:
+        """Active (``after_days`` > 0) ou désactive l'archivage automatique."""
+        self._commit({"op": "set_archive_policy", "after_days": after_days, "by": by})
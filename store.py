@@ -0,0 +1,723 @@
+"""Accès indexé à l'arbre XML de la bibliothèque.
+
+Le magasin conserve l'arbre ElementTree comme représentation de référence et
+maintient à côté des dictionnaires (livre par id, utilisateur par id, prêt en
+cours par livre) afin que chaque recherche par identifiant coûte le même temps
+quelle que soit la taille du catalogue.
+
+Chaque modification est décrite par une opération (un dictionnaire sérialisable
+en JSON, voir ``storage.Storage``) exécutée par la méthode ``_apply_<op>`` du
+magasin ; ces mêmes opérations alimentent le journal d'écriture et sont
+rejouées au chargement.
+"""
+
+import itertools
+import threading
+import xml.etree.ElementTree as ET
+
+import metrics
+import stats
+from search_index import (
+    BookQuery,
+    LoanQuery,
+    RangeIndex,
+    SortedIndex,
+    TextIndex,
+    TokenIndex,
+    fold,
+    text_terms,
+    tokenize,
+)
+from storage import COLLECTIONS, INDEXED_FIELDS, Storage, as_key, year_bounds
+
+
+class LibraryStore(Storage):
+    """Arbre de la bibliothèque accompagné de ses index en mémoire.
+
+    Toutes les modifications doivent passer par les méthodes du magasin pour
+    que les index restent synchronisés avec l'arbre.
+    """
+
+    def __init__(self, tree: ET.ElementTree, loader=None, indexes: dict | None = None) -> None:
+        super().__init__()
+        self.tree = tree
+        root = tree.getroot()
+        # Numéro de la dernière opération intégrée à l'arbre.
+        self.seq = int(root.get("seq", 0))
+        # Avec un chargeur, les collections ne sont pas dans l'arbre : chacune
+        # est demandée à ``loader(collection)`` au premier accès à l'un de ses
+        # attributs (voir ``__getattr__``).
+        self._loader = loader
+        # Plusieurs lecteurs peuvent partager le magasin : un seul d'entre eux
+        # charge une collection manquante.
+        self._load_lock = threading.Lock()
+        self._orders: dict[tuple[str, str], SortedIndex] = {}
+        # Compteurs de ``stats``, repris du fichier ``library.stats`` ou
+        # calculés à la première demande, puis tenus à jour par ``apply`` ;
+        # oubliés dès que livres ou prêts sont relus.
+        self._stats: dict[tuple[str, str], dict[str, int]] | None = None
+        # Index par mots et par année repris d'un instantané (voir
+        # ``index_state``) : ils évitent de renormaliser chaque livre.
+        self._saved_indexes = indexes
+        # Relecture de l'index plein texte conservé pour le même fichier (voir
+        # ``restore_text``), faite avant la première modification d'un livre.
+        self._text_loader = None
+        if loader is None:
+            self.reindex()
+
+    def __getattr__(self, name: str):
+        # Appelé uniquement pour un attribut absent : collection pas encore chargée.
+        collection = _LAZY_ATTRIBUTES.get(name)
+        loader = self.__dict__.get("_loader")
+        if collection is None or loader is None:
+            raise AttributeError(name)
+        with self.__dict__["_load_lock"]:
+            if name not in self.__dict__:
+                with metrics.phase("parse"):
+                    self._attach(collection, loader(collection))
+        return self.__dict__[name]
+
+    @staticmethod
+    def _container(root: ET.Element, tag: str) -> ET.Element:
+        element = root.find(tag)
+        if element is None:
+            element = ET.SubElement(root, tag)
+        return element
+
+    def reindex(self) -> None:
+        """Reconstruit tous les index à partir de l'arbre."""
+        # Index triés pour la pagination, créés à la première demande.
+        self._orders = {}
+        root = self.tree.getroot()
+        for collection in COLLECTIONS:
+            self._attach(collection, self._container(root, collection))
+
+    def _attach(self, collection: str, container: ET.Element) -> None:
+        """Installe ``container`` comme collection et construit ses index."""
+        root = self.tree.getroot()
+        if root.find(collection) is not container:
+            root.append(container)
+        setattr(self, collection, container)
+        getattr(self, f"_build_{collection}_indexes")(container)
+        if collection != "users":
+            self._stats = None
+
+    def _build_books_indexes(self, books: ET.Element) -> None:
+        self._books_by_id: dict[str, ET.Element] = {}
+        self._books_by_title: dict[str, list[ET.Element]] = {}
+        saved, self._saved_indexes = self._saved_indexes, None
+        # Index plein texte, relu ou construit à la première recherche (voir
+        # ``_text_index``) puis tenu à jour.
+        self._text: TextIndex | None = None
+        if saved is not None:
+            self._authors = TokenIndex.from_state(saved["authors"])
+            self._genres = TokenIndex.from_state(saved["genres"])
+            self._years = RangeIndex.from_state(saved["years"])
+            for book in books.findall("book"):
+                self._books_by_id[book.get("id")] = book
+                self._books_by_title.setdefault(book.findtext("title"), []).append(book)
+        else:
+            self._authors = TokenIndex()
+            self._genres = TokenIndex()
+            self._years = RangeIndex()
+            for book in books.findall("book"):
+                self._index_book(book)
+        self._init_sequence(books, self._books_by_id)
+
+    def index_state(self) -> dict:
+        """Index par mots et par année des livres, à conserver dans un instantané."""
+        return {
+            "authors": self._authors.state(),
+            "genres": self._genres.state(),
+            "years": self._years.state(),
+        }
+
+    def text_state(self) -> dict | None:
+        """Index plein texte à conserver à côté du fichier, ou ``None`` s'il n'est pas construit.
+
+        Un index conservé mais pas encore relu l'est ici : sans cela, un
+        enregistrement qui ne touche pas aux livres laisserait l'ancien état
+        décrire un fichier qui n'existe plus.
+        """
+        if self._text is None and self._text_loader is None:
+            return None
+        return self._text_index().state()
+
+    def restore_text(self, load) -> None:
+        """Reprend l'index plein texte conservé par ``text_state`` pour le même fichier.
+
+        ``load()`` retourne cet état, ou ``None`` s'il est illisible ; il n'est
+        appelé qu'à la première recherche ou modification d'un livre.
+        """
+        self._text_loader = load
+
+    def _text_index(self) -> TextIndex:
+        """Index plein texte des livres, relu ou construit au premier besoin puis tenu à jour."""
+        if self._text is None:
+            load, self._text_loader = self._text_loader, None
+            state = load() if load is not None else None
+            if state is not None:
+                text = TextIndex.from_state(state)
+            else:
+                text = TextIndex()
+                for book_id, book in self._books_by_id.items():
+                    text.add(book_id, text_terms(book))
+            self._text = text
+        return self._text
+
+    def _build_users_indexes(self, users: ET.Element) -> None:
+        self._users_by_id: dict[str, ET.Element] = {}
+        self._users_by_name: dict[str, list[ET.Element]] = {}
+        for user in users.findall("user"):
+            self._index_user(user)
+        self._init_sequence(users, self._users_by_id)
+
+    def _build_loans_indexes(self, loans: ET.Element) -> None:
+        self._active_loans: dict[str, ET.Element] = {}
+        self._index_user_loans(loans)
+        for loan in loans.findall("loan"):
+            if loan.get("returned") == "false":
+                self._active_loans.setdefault(loan.get("book_id"), loan)
+        # Prêts en cours triés par date (sortie, retour prévu), créés à la
+        # première recherche puis tenus à jour à chaque prêt, retour ou
+        # prolongation.
+        self._active_orders: dict[str, SortedIndex] = {}
+
+    def _index_user_loans(self, loans: ET.Element) -> None:
+        # Historique de chaque utilisateur dans l'ordre du document et nombre
+        # de ses prêts non rendus.
+        self._loans_by_user: dict[str, list[ET.Element]] = {}
+        self._open_by_user: dict[str, int] = {}
+        for loan in loans.findall("loan"):
+            user_id = loan.get("user_id")
+            self._loans_by_user.setdefault(user_id, []).append(loan)
+            if loan.get("returned") == "false":
+                self._open_by_user[user_id] = self._open_by_user.get(user_id, 0) + 1
+
+    def loaded(self, collection: str) -> bool:
+        """Indique si la collection est déjà en mémoire."""
+        return collection in self.__dict__
+
+    def load_all(self) -> None:
+        """Charge les collections qui ne le sont pas encore."""
+        for collection in COLLECTIONS:
+            getattr(self, collection)
+
+    def reloaded(self, stale: set[str]) -> "LibraryStore":
+        """Nouveau magasin qui reprend les collections chargées hors de ``stale``.
+
+        Les collections de ``stale`` seront relues au premier accès. ``self``
+        n'est pas modifié : les lecteurs qui le parcourent encore ne voient
+        pas ses collections disparaître.
+        """
+        root = ET.Element("library", dict(self.tree.getroot().attrib))
+        store = LibraryStore(ET.ElementTree(root), loader=self._loader)
+        for collection in COLLECTIONS:
+            if collection in stale or not self.loaded(collection):
+                continue
+            root.append(self.__dict__[collection])
+            for name, owner in _LAZY_ATTRIBUTES.items():
+                if owner == collection:
+                    store.__dict__[name] = self.__dict__[name]
+            store._orders.update((key, index) for key, index in self._orders.items() if key[0] == collection)
+        if not stale & {"books", "loans"}:
+            store._stats = self._stats
+        return store
+
+    # -- identifiants --------------------------------------------------
+
+    @staticmethod
+    def _init_sequence(container: ET.Element, index: dict[str, ET.Element]) -> None:
+        """Pose l'attribut ``next_id`` sur les fichiers qui n'en ont pas encore.
+
+        Le compteur n'est jamais inférieur au plus grand identifiant présent,
+        même si le fichier a été modifié à la main.
+        """
+        highest = max((int(i) for i in index), default=0)
+        current = int(container.get("next_id", 0))
+        container.set("next_id", str(max(current, highest + 1)))
+
+    def _allocate_id(self, collection: str) -> str:
+        container = getattr(self, collection)
+        allocated = container.get("next_id")
+        container.set("next_id", str(int(allocated) + 1))
+        return allocated
+
+    def _record_seq(self) -> None:
+        self.tree.getroot().set("seq", str(self.seq))
+
+    # -- index ---------------------------------------------------------
+
+    def _index_book(self, book: ET.Element) -> None:
+        self._books_by_id[book.get("id")] = book
+        self._index_book_fields(book)
+
+    def _unindex_book(self, book: ET.Element) -> None:
+        self._books_by_id.pop(book.get("id"), None)
+        self._unindex_book_fields(book)
+
+    def _index_book_fields(self, book: ET.Element) -> None:
+        book_id = book.get("id")
+        self._books_by_title.setdefault(book.findtext("title"), []).append(book)
+        self._authors.add(book_id, book.findtext("author"))
+        self._genres.add(book_id, book.findtext("genre"))
+        self._years.add(book_id, book.findtext("year"))
+        if self._text is not None or self._text_loader is not None:
+            self._text_index().add(book_id, text_terms(book))
+        self._order_add("books", book)
+
+    def _unindex_book_fields(self, book: ET.Element) -> None:
+        book_id = book.get("id")
+        _discard(self._books_by_title, book.findtext("title"), book)
+        self._authors.remove(book_id, book.findtext("author"))
+        self._genres.remove(book_id, book.findtext("genre"))
+        self._years.remove(book_id, book.findtext("year"))
+        if self._text is not None or self._text_loader is not None:
+            self._text_index().remove(book_id, text_terms(book))
+        self._order_remove("books", book)
+
+    def _index_user(self, user: ET.Element) -> None:
+        self._users_by_id[user.get("id")] = user
+        self._users_by_name.setdefault(user.findtext("name"), []).append(user)
+        self._order_add("users", user)
+
+    def _unindex_user(self, user: ET.Element) -> None:
+        self._users_by_id.pop(user.get("id"), None)
+        _discard(self._users_by_name, user.findtext("name"), user)
+        self._order_remove("users", user)
+
+    def _order_add(self, collection: str, element: ET.Element) -> None:
+        for (name, _), index in self._orders.items():
+            if name == collection:
+                index.add(element)
+
+    def _order_remove(self, collection: str, element: ET.Element) -> None:
+        for (name, _), index in self._orders.items():
+            if name == collection:
+                index.remove(element)
+
+    # -- lectures ------------------------------------------------------
+
+    def book(self, book_id: str) -> ET.Element | None:
+        """Retourne le livre portant cet identifiant."""
+        return self._books_by_id.get(str(book_id))
+
+    def user(self, user_id: str) -> ET.Element | None:
+        """Retourne l'utilisateur portant cet identifiant."""
+        return self._users_by_id.get(str(user_id))
+
+    def find_book(self, identifier: str) -> ET.Element | None:
+        """Retourne le livre correspondant à l'id ou, à défaut, au titre."""
+        book = self.book(identifier)
+        if book is None:
+            matches = self._books_by_title.get(identifier)
+            book = matches[0] if matches else None
+        return book
+
+    def find_user(self, identifier: str) -> ET.Element | None:
+        """Retourne l'utilisateur correspondant à l'id ou, à défaut, au nom."""
+        user = self.user(identifier)
+        if user is None:
+            matches = self._users_by_name.get(identifier)
+            user = matches[0] if matches else None
+        return user
+
+    def active_loan(self, book_id: str) -> ET.Element | None:
+        """Retourne le prêt en cours du livre, s'il existe."""
+        return self._active_loans.get(str(book_id))
+
+    def user_loans(self, user_id: str) -> list[ET.Element]:
+        """Retourne les prêts de l'utilisateur, en cours ou rendus, dans l'ordre du document."""
+        return list(self._loans_by_user.get(str(user_id), ()))
+
+    def open_loans(self, user_id: str) -> int:
+        """Nombre de prêts non rendus de l'utilisateur."""
+        return self._open_by_user.get(str(user_id), 0)
+
+    def counts(self) -> dict[str, int]:
+        """Nombre d'éléments de chaque collection et de prêts en cours."""
+        return {
+            "books": len(self._books_by_id),
+            "users": len(self._users_by_id),
+            "loans": len(self.loans),
+            "active_loans": len(self._active_loans),
+        }
+
+    @metrics.timed("query")
+    def page(self, collection: str, sort: str | None = None, offset: int = 0, limit: int | None = None):
+        """Retourne une page d'une collection et le nombre total d'éléments.
+
+        ``sort`` nomme un champ de ``SORT_KEYS`` (préfixé de ``-`` pour l'ordre
+        décroissant) ; sans tri, l'ordre est celui du document. Seuls les
+        éléments de la page sont parcourus, grâce à un index trié tenu à jour
+        après sa première utilisation.
+        """
+        descending = bool(sort) and sort.startswith("-")
+        field = sort.lstrip("-") if sort else "id"
+        keys = SORT_KEYS[collection]
+        if field not in keys:
+            raise ValueError(f"Unknown sort field: {field}")
+        ordered = getattr(self, collection) if keys[field] is None else self._order(collection, field)
+        total = len(ordered)
+        offset = max(offset, 0)
+        stop = total if limit is None else min(total, offset + max(limit, 0))
+        if offset >= stop:
+            return [], total
+        if descending:
+            return ordered[total - stop:total - offset][::-1], total
+        return ordered[offset:stop], total
+
+    def _order(self, collection: str, field: str) -> SortedIndex:
+        """Index de toute la collection trié selon ``field``, créé au premier usage."""
+        ordered = self._orders.get((collection, field))
+        if ordered is None:
+            ordered = SortedIndex(SORT_KEYS[collection][field], getattr(self, collection))
+            self._orders[(collection, field)] = ordered
+        return ordered
+
+    def _active_order(self, field: str) -> SortedIndex:
+        """Prêts en cours triés selon ``field`` (``date_out`` ou ``date_due``)."""
+        ordered = self._active_orders.get(field)
+        if ordered is None:
+            ordered = SortedIndex(SORT_KEYS["loans"][field], self._active_loans.values())
+            self._active_orders[field] = ordered
+        return ordered
+
+    @metrics.timed("query")
+    def search_loans(self, query: LoanQuery) -> list[ET.Element]:
+        """Retourne les prêts satisfaisant ``query``.
+
+        Les prêts sont rangés par date de sortie, ou par date de retour prévue
+        lorsque seule ``due_before`` est donnée ; la tranche correspondante de
+        l'index trié est délimitée par dichotomie.
+        """
+        field = "date_out" if query.has_out or query.due_before is None else "date_due"
+        index = self._order("loans", field) if query.include_returned else self._active_order(field)
+        if field == "date_due":
+            return index.between(high=query.due_before, inclusive=False)
+        loans = index.between(query.out_low, query.out_high)
+        if query.due_before is not None:
+            loans = [loan for loan in loans if query.matches(loan)]
+        return loans
+
+    @metrics.timed("query")
+    def search_books(self, query: BookQuery) -> list[ET.Element]:
+        """Retourne les livres satisfaisant ``query``, dans l'ordre des identifiants.
+
+        Le critère le plus sélectif, estimé à partir des index, fournit les
+        candidats ; les autres critères sont vérifiés sur ces seuls candidats.
+        Avec un critère ``text``, l'index plein texte fournit les candidats déjà
+        classés par pertinence et cet ordre est conservé.
+        """
+        if query.impossible:
+            return []
+        if query.text:
+            books = (self._books_by_id[book_id] for book_id, _ in self._text_index().search(query.text))
+            if query.author or query.genre or query.has_year:
+                books = (book for book in books if query.matches(book))
+            return list(books)
+        plans = []
+        if query.author:
+            plans.append((self._authors, (query.author,)))
+        if query.genre:
+            plans.append((self._genres, (query.genre,)))
+        if query.has_year:
+            plans.append((self._years, (query.year_from, query.year_to)))
+        if not plans:
+            return list(self.iter_books())
+        index, arguments = min(plans, key=lambda plan: plan[0].estimate(*plan[1]))
+        books = (self._books_by_id[book_id] for book_id in index.lookup(*arguments))
+        if len(plans) > 1:
+            books = (book for book in books if query.matches(book))
+        return sorted(books, key=_id_order)
+
+    def lookup(self, collection: str, field: str, op: str, value) -> list[ET.Element] | None:
+        """Éléments candidats pour la condition « ``field`` ``op`` ``value`` ».
+
+        Retourne ``None`` lorsqu'aucun index ne s'applique (voir
+        ``INDEXED_FIELDS``). Les index par mots (auteur, genre) peuvent renvoyer
+        des éléments en trop : l'appelant revérifie la condition.
+        """
+        if op not in INDEXED_FIELDS.get((collection, field), ()):
+            return None
+        value = "" if value is None else value
+        if field == "@id":
+            element = (self.book if collection == "books" else self.user)(as_key(value))
+            return [element] if element is not None else []
+        if (collection, field) == ("books", "title"):
+            return list(self._books_by_title.get(as_key(value), []))
+        if (collection, field) == ("users", "name"):
+            return list(self._users_by_name.get(as_key(value), []))
+        if (collection, field) == ("loans", "@returned"):
+            return list(self._active_loans.values()) if value == "false" else None
+        if field == "year":
+            bounds = year_bounds(op, value)
+            if bounds is None:
+                return []
+            ids = self._years.lookup(*bounds)
+        else:
+            if not tokenize(as_key(value)):
+                return None
+            ids = (self._authors if field == "author" else self._genres).lookup(as_key(value))
+        return sorted((self._books_by_id[book_id] for book_id in ids), key=_id_order)
+
+    def iter_books(self):
+        """Parcourt les livres dans l'ordre du document."""
+        return iter(self._books_by_id.values())
+
+    def iter_users(self):
+        """Parcourt les utilisateurs dans l'ordre du document."""
+        return iter(self._users_by_id.values())
+
+    def iter_loans(self):
+        """Parcourt tous les prêts, rendus ou non."""
+        return iter(self.loans.findall("loan"))
+
+    def iter_active_loans(self):
+        """Parcourt les prêts en cours."""
+        return iter(self._active_loans.values())
+
+    # -- statistiques --------------------------------------------------
+
+    def _stats_tracked(self) -> bool:
+        return self._stats is not None
+
+    def _build_stats(self, archived) -> None:
+        if self._stats is None:
+            self._replace_stats(stats.compute(self.iter_books(), itertools.chain(archived, self.iter_loans())))
+
+    def stats_state(self) -> dict | None:
+        """Compteurs de ``stats`` à conserver à côté du fichier, ou ``None`` s'ils ne sont pas calculés."""
+        return self._stats
+
+    def restore_stats(self, state: dict) -> None:
+        """Reprend des compteurs conservés par ``stats_state`` pour le même fichier."""
+        self._stats = state
+
+    def _stat_rows(self, kinds):
+        for (kind, key), months in self._stats.items():
+            if kind in kinds:
+                for month, value in months.items():
+                    yield kind, key, month, value
+
+    def _stat_months(self, book_id: str) -> list[tuple[str, int]]:
+        return list(self._stats.get(("book", book_id), {}).items())
+
+    def _update_stats(self, deltas: list) -> None:
+        for (kind, key, month), delta in deltas:
+            months = self._stats.setdefault((kind, key), {})
+            value = months.get(month, 0) + delta
+            if value:
+                months[month] = value
+            else:
+                del months[month]
+                if not months:
+                    del self._stats[(kind, key)]
+
+    def _replace_stats(self, counters: dict) -> None:
+        # Construits à part puis publiés d'un coup : ``_build_stats`` peut
+        # tourner sous le verrou partagé des lecteurs, qui ne doivent voir
+        # que ``None`` ou des compteurs complets.
+        built: dict[tuple[str, str], dict[str, int]] = {}
+        for (kind, key, month), value in counters.items():
+            built.setdefault((kind, key), {})[month] = value
+        self._stats = built
+
+    def to_tree(self) -> ET.ElementTree:
+        """Retourne l'arbre complet, toutes collections chargées."""
+        self.load_all()
+        return self.tree
+
+    # -- opérations ----------------------------------------------------
+
+    # -- livres --------------------------------------------------------
+
+    def _apply_add_book(self, op: dict) -> ET.Element:
+        book = ET.SubElement(self.books, "book", id=op["id"])
+        ET.SubElement(book, "title").text = op["title"]
+        ET.SubElement(book, "author").text = op["author"]
+        ET.SubElement(book, "genre").text = op["genre"]
+        ET.SubElement(book, "year").text = op["year"]
+        _bump_sequence(self.books, op["id"])
+        self._index_book(book)
+        return book
+
+    def _apply_update_book(self, op: dict) -> None:
+        book = self._books_by_id[op["id"]]
+        self._unindex_book_fields(book)
+        for field in ("title", "author", "genre", "year"):
+            if field in op:
+                book.find(field).text = op[field]
+        self._index_book_fields(book)
+
+    def _apply_delete_book(self, op: dict) -> None:
+        book = self._books_by_id[op["id"]]
+        self.books.remove(book)
+        self._unindex_book(book)
+
+    # -- utilisateurs --------------------------------------------------
+
+    def _apply_add_user(self, op: dict) -> ET.Element:
+        user = ET.SubElement(self.users, "user", id=op["id"])
+        ET.SubElement(user, "name").text = op["name"]
+        _bump_sequence(self.users, op["id"])
+        self._index_user(user)
+        return user
+
+    def _apply_update_user(self, op: dict) -> None:
+        user = self._users_by_id[op["id"]]
+        _discard(self._users_by_name, user.findtext("name"), user)
+        self._order_remove("users", user)
+        user.find("name").text = op["name"]
+        self._users_by_name.setdefault(op["name"], []).append(user)
+        self._order_add("users", user)
+
+    def _apply_delete_user(self, op: dict) -> None:
+        user = self._users_by_id[op["id"]]
+        self.users.remove(user)
+        self._unindex_user(user)
+
+    # -- prêts ---------------------------------------------------------
+
+    def _apply_add_loan(self, op: dict) -> ET.Element:
+        loan = ET.SubElement(
+            self.loans,
+            "loan",
+            book_id=op["book_id"],
+            user_id=op["user_id"],
+            date_out=op["date_out"],
+            date_due=op["date_due"],
+            returned="false",
+        )
+        self._loans_by_user.setdefault(op["user_id"], []).append(loan)
+        if "date_return" in op:
+            loan.set("returned", "true")
+            loan.set("date_return", op["date_return"])
+        else:
+            self._active_loans[op["book_id"]] = loan
+            self._open_by_user[op["user_id"]] = self._open_by_user.get(op["user_id"], 0) + 1
+            for index in self._active_orders.values():
+                index.add(loan)
+        self._order_add("loans", loan)
+        return loan
+
+    def _apply_return_loan(self, op: dict) -> None:
+        loan = self._active_loans.pop(op["book_id"])
+        for index in self._active_orders.values():
+            index.remove(loan)
+        self._open_by_user[loan.get("user_id")] -= 1
+        loan.set("returned", "true")
+        loan.set("date_return", op["date_return"])
+
+    def _apply_extend_loan(self, op: dict) -> None:
+        loan = self._active_loans[op["book_id"]]
+        self._order_remove("loans", loan)
+        for index in self._active_orders.values():
+            index.remove(loan)
+        loan.set("date_due", op["date_due"])
+        self._order_add("loans", loan)
+        for index in self._active_orders.values():
+            index.add(loan)
+
+    def _apply_archive_loans(self, op: dict) -> list[ET.Element]:
+        kept, archived = [], []
+        for loan in self.loans.findall("loan"):
+            closed = loan.get("returned") == "true" and loan.get("date_return", "") < op["before"]
+            (archived if closed else kept).append(loan)
+        if archived:
+            # Reconstruire la liste évite un retrait linéaire par prêt.
+            self.loans[:] = kept
+            for key in [key for key in self._orders if key[0] == "loans"]:
+                del self._orders[key]
+            self._index_user_loans(self.loans)
+        self.loans.set("archived_before", max(op["before"], self.loans.get("archived_before", "")))
+        return archived
+
+    def archive_policy(self) -> tuple[int, str] | None:
+        """Retourne l'âge (en jours) et le découpage de l'archivage automatique."""
+        days = self.loans.get("archive_after_days")
+        if days is None:
+            return None
+        return int(days), self.loans.get("archive_by", "month")
+
+    def archived_before(self) -> str:
+        """Date avant laquelle les prêts rendus ont déjà été archivés (``""`` : jamais)."""
+        return self.loans.get("archived_before", "")
+
+    def _apply_set_archive_policy(self, op: dict) -> None:
+        if op["after_days"] > 0:
+            self.loans.set("archive_after_days", str(op["after_days"]))
+            self.loans.set("archive_by", op["by"])
+        else:
+            self.loans.attrib.pop("archive_after_days", None)
+            self.loans.attrib.pop("archive_by", None)
+
+
+# Attributs construits au chargement de chaque collection.
+_LAZY_ATTRIBUTES = {
+    "books": "books",
+    "_books_by_id": "books",
+    "_books_by_title": "books",
+    "_authors": "books",
+    "_genres": "books",
+    "_years": "books",
+    "_text": "books",
+    "users": "users",
+    "_users_by_id": "users",
+    "_users_by_name": "users",
+    "loans": "loans",
+    "_active_loans": "loans",
+    "_active_orders": "loans",
+    "_loans_by_user": "loans",
+    "_open_by_user": "loans",
+}
+
+
+def _text_key(tag: str):
+    return lambda element: fold(element.findtext(tag))
+
+
+def _year_key(element: ET.Element):
+    year = element.findtext("year") or ""
+    return (0, int(year), "") if year.isdigit() else (1, 0, year)
+
+
+# Champs de tri de chaque collection ; ``None`` désigne l'ordre du document.
+SORT_KEYS = {
+    "books": {
+        "id": None,
+        "title": _text_key("title"),
+        "author": _text_key("author"),
+        "year": _year_key,
+    },
+    "users": {"id": None, "name": _text_key("name")},
+    "loans": {
+        "id": None,
+        "date_out": lambda loan: loan.get("date_out") or "",
+        "date_due": lambda loan: loan.get("date_due") or "",
+    },
+}
+
+
+def _id_order(element: ET.Element):
+    identifier = element.get("id")
+    return (0, int(identifier), "") if identifier.isdigit() else (1, 0, identifier)
+
+
+def _bump_sequence(container: ET.Element, used_id: str) -> None:
+    """Garantit que le compteur ``next_id`` dépasse un identifiant rejoué."""
+    if int(container.get("next_id", 1)) <= int(used_id):
+        container.set("next_id", str(int(used_id) + 1))
+
+
+def _discard(index: dict[str, list[ET.Element]], key: str, element: ET.Element) -> None:
+    """Retire ``element`` de la liste associée à ``key`` dans ``index``."""
+    matches = index.get(key)
+    if not matches:
+        return
+    for position, candidate in enumerate(matches):
+        if candidate is element:
+            del matches[position]
+            break
+    if not matches:
+        del index[key]
@@ -0,0 +1,58 @@
+"""Lecture en flux du fichier de bibliothèque pour les commandes de consultation.
+
+Les enregistrements sont produits au fil de l'analyse puis détachés de leur
+conteneur dès que l'appelant passe au suivant : la mémoire reste constante
+quelle que soit la taille du fichier et l'affichage commence immédiatement.
+"""
+
+import itertools
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+CONTAINERS = {"books", "users", "loans"}
+RECORDS = {"book", "user", "loan"}
+
+
+def iter_records(path: Path, tags: set[str]):
+    """Produit, dans l'ordre du document, les enregistrements dont la balise est dans ``tags``.
+
+    Un élément produit n'est valable que jusqu'à la reprise du générateur :
+    l'appelant doit en extraire ce dont il a besoin avant de demander le
+    suivant.
+    """
+    container = None
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if element.tag in CONTAINERS:
+                container = element
+            continue
+        if element.tag not in RECORDS:
+            continue
+        if element.tag in tags:
+            yield element
+        if container is not None:
+            container.remove(element)
+
+
+def iter_loans_with_names(paths):
+    """Produit chaque prêt avec le titre du livre et le nom de l'utilisateur.
+
+    ``paths`` est la liste des fichiers à lire : ``library.xml`` seul, ou les
+    fichiers des livres, utilisateurs et prêts du stockage éclaté. Seules les
+    correspondances id → titre et id → nom sont gardées en mémoire ; elles
+    sont remplies au passage, les livres et utilisateurs précédant les prêts.
+    """
+    titles: dict[str, str] = {}
+    names: dict[str, str] = {}
+    records = itertools.chain.from_iterable(iter_records(path, RECORDS) for path in paths)
+    for element in records:
+        if element.tag == "book":
+            titles[element.get("id")] = element.findtext("title")
+        elif element.tag == "user":
+            names[element.get("id")] = element.findtext("name")
+        else:
+            yield (
+                element,
+                titles.get(element.get("book_id"), element.get("book_id")),
+                names.get(element.get("user_id"), element.get("user_id")),
+            )
@@ -1,11 +1,26 @@
 """Serveur Web pour consulter et enrichir la bibliothèque pour les no-codeurs."""
 
 
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import parse_qs, urlencode, urlparse
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+import contextlib
+import functools
+import gzip
 import html
-import xml.etree.ElementTree as ET
-from main import load_library, save_library
+import itertools
+import threading
+import time
+import zlib
+import main
+import metrics
+from main import library_lock, library_version, load_store, save_store
+from query import QueryError, compile_query, display
+from archive import is_period
+from search_index import BookQuery, LoanQuery
+from store import SORT_KEYS
 
 STYLE = """
 body {font-family: Arial, sans-serif; margin:2em; background:#f5f5f5;}
@@ -17,19 +32,90 @@ th, td {border:1px solid #ccc; padding:8px; text-align:left;}
 th {background:#eee;}
 form {background:#fafafa; padding:1em; border:1px solid #ddd; border-radius:6px; max-width:400px; margin:1em auto;}
 label {display:block; margin-bottom:0.5em; font-weight:bold;}
-input, select {width:100%; padding:0.5em; border:1px solid #ccc; border-radius:4px; margin-top:0.25em;}
+input, select, textarea {width:100%; padding:0.5em; border:1px solid #ccc; border-radius:4px; margin-top:0.25em;}
 input[type='submit'] {background:#333; color:white; border:none; margin-top:1em; padding:0.7em 1.5em; border-radius:4px; cursor:pointer;}
 input[type='submit']:hover {background:#555;}
 
 """
 
 
-def page(title: str, body: str) -> str:
-    return f"""<!DOCTYPE html>
+class ReadWriteLock:
+    """Verrou autorisant plusieurs lecteurs simultanés ou un seul écrivain.
+
+    Les écrivains en attente passent avant les nouveaux lecteurs afin qu'un
+    flot continu de consultations ne bloque pas les modifications.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+# Protège le magasin partagé entre les fils du serveur.
+STORE_LOCK = ReadWriteLock()
+
+
+def reader(func):
+    """Exécute ``func`` sous le verrou partagé de lecture."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with STORE_LOCK.read():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def writer(func):
+    """Exécute ``func`` seul, y compris vis-à-vis des autres processus."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with STORE_LOCK.write(), library_lock():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+# Gabarit des pages, encodé une fois pour toutes : seuls le titre et le corps
+# sont produits à chaque requête.
+PAGE_HEAD = """<!DOCTYPE html>
 <html lang='fr'>
 <head>
     <meta charset='utf-8'>
-    <title>{html.escape(title)}</title>
+    <title>""".encode("utf-8")
+PAGE_NAV = f"""</title>
     <style>{STYLE}</style>
 </head>
 <body>
@@ -46,179 +132,249 @@ def page(title: str, body: str) -> str:
         <a href='/return-book'>Retour</a>
         <a href='/extend-loan'>Prolonger</a>
         <a href='/search-books'>Recherche</a>
+        <a href='/search-loans'>Recherche prêts</a>
+        <a href='/overdue'>Retards</a>
+        <a href='/stats'>Statistiques</a>
+        <a href='/query'>Requête</a>
 
     </nav>
 </header>
 <main>
-{body}
+""".encode("utf-8")
+PAGE_FOOT = b"""
 </main>
 </body>
 </html>"""
 
 
-def list_books_html() -> str:
-    tree = load_library()
-    rows = []
-    for book in tree.getroot().findall("books/book"):
-        row = (
-            f"<tr><td>{html.escape(book.get('id'))}</td>"
-            f"<td>{html.escape(book.findtext('title'))}</td>"
-            f"<td>{html.escape(book.findtext('author'))}</td></tr>"
-        )
-        rows.append(row)
-    table = "<table><tr><th>ID</th><th>Titre</th><th>Auteur</th></tr>" + "".join(rows) + "</table>"
-    return table
+def page_parts(title: str, body):
+    """Morceaux encodés d'une page ; ``body`` est un texte ou une suite de fragments."""
+    yield PAGE_HEAD
+    yield html.escape(title).encode("utf-8")
+    yield PAGE_NAV
+    if isinstance(body, str):
+        body = (body,)
+    for fragment in body:
+        yield fragment.encode("utf-8")
+    yield PAGE_FOOT
+
+
+PAGE_SIZE = 100
+
+
+def _int_param(params, name: str, default: int) -> int:
+    try:
+        return int(params.get(name, [default])[0])
+    except ValueError:
+        return default
+
+
+def _paging(params, collection: str):
+    """Lit ``sort``, ``offset`` et ``limit`` dans les paramètres de l'URL."""
+    sort = params.get("sort", [None])[0]
+    if sort and sort.lstrip("-") not in SORT_KEYS[collection]:
+        sort = None
+    offset = max(_int_param(params, "offset", 0), 0)
+    limit = max(_int_param(params, "limit", PAGE_SIZE), 1)
+    return sort, offset, limit
 
 
+def _page_link(path: str, sort, offset: int, limit: int, label: str) -> str:
+    query = {"offset": offset, "limit": limit}
+    if sort:
+        query["sort"] = sort
+    return f"<a href='{path}?{html.escape(urlencode(query))}'>{label}</a>"
+
+
+def _pager(path: str, sort, offset: int, limit: int, total: int) -> str:
+    """Liens vers les pages précédente et suivante."""
+    end = min(offset + limit, total)
+    parts = []
+    if offset > 0:
+        parts.append(_page_link(path, sort, max(offset - limit, 0), limit, "&laquo; Précédent"))
+    parts.append(f"Lignes {offset + 1 if end else 0}–{end} sur {total}")
+    if end < total:
+        parts.append(_page_link(path, sort, offset + limit, limit, "Suivant &raquo;"))
+    return "<p>" + " | ".join(parts) + "</p>"
+
+
+def _sort_header(path: str, field: str, label: str, sort, limit: int) -> str:
+    """En-tête de colonne triant sur ``field``, puis en ordre inverse."""
+    target = f"-{field}" if sort == field else field
+    return f"<th>{_page_link(path, target, 0, limit, label)}</th>"
+
+
+def _book_rows(books):
+    """Lignes de tableau des livres.
+
+    Identifiant, titre et auteur sont relevés tout de suite, sous le verrou de
+    l'appelant ; les lignes ne sont mises en forme qu'au moment de l'envoi.
+    """
+    fields = [(book.get("id"), book.findtext("title"), book.findtext("author")) for book in books]
+    return (
+        f"<tr><td>{html.escape(book_id)}</td>"
+        f"<td>{html.escape(title)}</td>"
+        f"<td>{html.escape(author)}</td></tr>"
+        for book_id, title, author in fields
+    )
+
+
+def _table(header: str, rows, after: str = ""):
+    """Fragments d'un tableau dont les lignes sont mises en forme au fil de l'envoi."""
+    yield "<table>" + header
+    yield from rows
+    yield "</table>" + after
+
+
+@reader
+def list_books_html(params=None):
+    sort, offset, limit = _paging(params or {}, "books")
+    books, total = load_store().page("books", sort, offset, limit)
+    header = (
+        "<tr>"
+        + _sort_header("/books", "id", "ID", sort, limit)
+        + _sort_header("/books", "title", "Titre", sort, limit)
+        + _sort_header("/books", "author", "Auteur", sort, limit)
+        + "</tr>"
+    )
+    pager = _pager("/books", sort, offset, limit, total)
+    return _table(header, _book_rows(books), pager)
+
+
+@writer
 def add_book_params(params):
     required = {"title", "author", "genre", "year"}
     if not required.issubset(params.keys()):
         return False
-    tree = load_library()
-    books = tree.getroot().find("books")
-    ids = [int(b.get("id")) for b in books.findall("book")]
-    next_id = max(ids, default=0) + 1
-    book = ET.SubElement(books, "book", id=str(next_id))
-    ET.SubElement(book, "title").text = params["title"][0]
-    ET.SubElement(book, "author").text = params["author"][0]
-    ET.SubElement(book, "genre").text = params["genre"][0]
-    ET.SubElement(book, "year").text = params["year"][0]
-    save_library(tree)
+    store = load_store()
+    store.add_book(
+        params["title"][0], params["author"][0], params["genre"][0], params["year"][0]
+    )
+    save_store(store)
     return True
 
 
-def list_users_html() -> str:
-    tree = load_library()
-    rows = []
-    for user in tree.getroot().findall("users/user"):
-        row = (
-            f"<tr><td>{html.escape(user.get('id'))}</td>"
-            f"<td>{html.escape(user.findtext('name'))}</td></tr>"
-        )
-        rows.append(row)
-    table = "<table><tr><th>ID</th><th>Nom</th></tr>" + "".join(rows) + "</table>"
-    return table
+def _user_rows(users):
+    """Lignes de tableau des utilisateurs, relevées comme dans ``_book_rows``."""
+    fields = [(user.get("id"), user.findtext("name")) for user in users]
+    return (
+        f"<tr><td>{html.escape(user_id)}</td>"
+        f"<td><a href='/user-loans?{html.escape(urlencode({'id': user_id}))}'>"
+        f"{html.escape(name)}</a></td></tr>"
+        for user_id, name in fields
+    )
 
 
+@reader
+def list_users_html(params=None):
+    sort, offset, limit = _paging(params or {}, "users")
+    users, total = load_store().page("users", sort, offset, limit)
+    header = (
+        "<tr>"
+        + _sort_header("/users", "id", "ID", sort, limit)
+        + _sort_header("/users", "name", "Nom", sort, limit)
+        + "</tr>"
+    )
+    pager = _pager("/users", sort, offset, limit, total)
+    return _table(header, _user_rows(users), pager)
+
+
+@writer
 def add_user_params(params):
     if "name" not in params:
         return False
-    tree = load_library()
-    users = tree.getroot().find("users")
-    ids = [int(u.get("id")) for u in users.findall("user")]
-    next_id = max(ids, default=0) + 1
-    user = ET.SubElement(users, "user", id=str(next_id))
-    ET.SubElement(user, "name").text = params["name"][0]
-    save_library(tree)
+    store = load_store()
+    store.add_user(params["name"][0])
+    save_store(store)
     return True
 
 
+@writer
 def update_book_params(params):
     if "id" not in params:
         return False
-    tree = load_library()
-    book = tree.getroot().find(f"books/book[@id='{params['id'][0]}']")
+    store = load_store()
+    book = store.book(params["id"][0])
     if book is None:
         return False
-    if "title" in params:
-        book.find("title").text = params["title"][0]
-    if "author" in params:
-        book.find("author").text = params["author"][0]
-    if "genre" in params:
-        book.find("genre").text = params["genre"][0]
-    if "year" in params:
-        book.find("year").text = params["year"][0]
-    save_library(tree)
+    store.update_book(
+        book,
+        title=params.get("title", [None])[0],
+        author=params.get("author", [None])[0],
+        genre=params.get("genre", [None])[0],
+        year=params.get("year", [None])[0],
+    )
+    save_store(store)
     return True
 
 
+@writer
 def delete_book_params(params):
     if "id" not in params:
         return False
-    tree = load_library()
-    books = tree.getroot().find("books")
-    book = books.find(f"book[@id='{params['id'][0]}']")
+    store = load_store()
+    book = store.book(params["id"][0])
     if book is None:
         return False
-    books.remove(book)
-    save_library(tree)
+    store.delete_book(book)
+    save_store(store)
     return True
 
 
+@writer
 def update_user_params(params):
     if "id" not in params or "name" not in params:
         return False
-    tree = load_library()
-    user = tree.getroot().find(f"users/user[@id='{params['id'][0]}']")
+    store = load_store()
+    user = store.user(params["id"][0])
     if user is None:
         return False
-    user.find("name").text = params["name"][0]
-    save_library(tree)
+    store.update_user(user, params["name"][0])
+    save_store(store)
     return True
 
 
+@writer
 def delete_user_params(params):
     if "id" not in params:
         return False
-    tree = load_library()
-    users = tree.getroot().find("users")
-    user = users.find(f"user[@id='{params['id'][0]}']")
-    if user is None:
+    store = load_store()
+    user = store.user(params["id"][0])
+    if user is None or store.open_loans(user.get("id")):
         return False
-    users.remove(user)
-    save_library(tree)
+    store.delete_user(user)
+    save_store(store)
     return True
 
 
-def list_loans_html() -> str:
-    tree = load_library()
-    root = tree.getroot()
-    rows = []
-    for loan in root.findall("loans/loan"):
-        book = root.find(f"books/book[@id='{loan.get('book_id')}']")
-        user = root.find(f"users/user[@id='{loan.get('user_id')}']")
-        book_title = book.findtext("title") if book is not None else loan.get("book_id")
-        user_name = user.findtext("name") if user is not None else loan.get("user_id")
-        status = "retourne" if loan.get("returned") == "true" else "en cours"
-        row = (
-            f"<tr><td>{html.escape(book_title)}</td>"
-            f"<td>{html.escape(user_name)}</td>"
-            f"<td>{html.escape(loan.get('date_out'))}</td>"
-            f"<td>{html.escape(loan.get('date_due'))}</td>"
-            f"<td>{status}</td></tr>"
-        )
-        rows.append(row)
-    table = (
-        "<table><tr><th>Livre</th><th>Utilisateur</th><th>Sortie</th>"
-        "<th>Retour prévu</th><th>Statut</th></tr>" + "".join(rows) + "</table>"
+@reader
+def list_loans_html(params=None):
+    sort, offset, limit = _paging(params or {}, "loans")
+    store = load_store()
+    loans, total = store.page("loans", sort, offset, limit)
+    header = (
+        "<tr><th>Livre</th><th>Utilisateur</th>"
+        + _sort_header("/loans", "date_out", "Sortie", sort, limit)
+        + _sort_header("/loans", "date_due", "Retour prévu", sort, limit)
+        + "<th>Statut</th></tr>"
     )
-    return table
+    pager = _pager("/loans", sort, offset, limit, total)
+    return _table(header, _loan_rows(store, loans, _loan_status), pager)
 
 
+@writer
 def loan_book_params(params):
     required = {"book_id", "user_id"}
     if not required.issubset(params.keys()):
         return False, "Paramètres manquants."
-    tree = load_library()
-    root = tree.getroot()
-    book_id = params["book_id"][0]
-    user_id = params["user_id"][0]
-
-    book = root.find(f"books/book[@id='{book_id}']")
-    if book is None:
-        book = root.find(f"books/book[title='{book_id}']")
-    user = root.find(f"users/user[@id='{user_id}']")
-    if user is None:
-        user = root.find(f"users/user[name='{user_id}']")
+    store = load_store()
+    book = store.find_book(params["book_id"][0])
+    user = store.find_user(params["user_id"][0])
     if book is None:
         return False, "Livre introuvable."
     if user is None:
         return False, "Utilisateur introuvable."
-    loans = root.find("loans")
-    existing = loans.find(
-        f"loan[@book_id='{book.get('id')}'][@returned='false']"
-    )
-    if existing is not None:
+    if store.active_loan(book.get("id")) is not None:
         return False, "Livre déjà emprunté."
     import datetime
 
@@ -227,339 +383,801 @@ def loan_book_params(params):
         "date_due",
         [(datetime.date.today() + datetime.timedelta(days=30)).isoformat()],
     )[0]
-    ET.SubElement(
-        loans,
-        "loan",
-        book_id=book.get("id"),
-        user_id=user.get("id"),
-        date_out=date_out,
-        date_due=date_due,
-        returned="false",
-    )
-    save_library(tree)
+    store.add_loan(book.get("id"), user.get("id"), date_out, date_due)
+    save_store(store)
     return True, "Prêt enregistré."
 
 
-def _resolve_book_id(root: ET.Element, identifier: str) -> str | None:
-    """Retourne l'identifiant du livre selon son id ou son titre."""
-    book = root.find(f"books/book[@id='{identifier}']")
-    if book is None:
-        book = root.find(f"books/book[title='{identifier}']")
-    return book.get("id") if book is not None else None
+def _active_loan_for(store, identifier):
+    """Prêt en cours du livre désigné par son id (sans lire le catalogue) ou son titre."""
+    loan = store.active_loan(identifier)
+    if loan is None:
+        book = store.find_book(identifier)
+        loan = store.active_loan(book.get("id")) if book is not None else None
+    return loan
 
 
+@writer
 def return_book_params(params):
     if "book_id" not in params:
         return False
-    tree = load_library()
-    root = tree.getroot()
-    book_id = _resolve_book_id(root, params["book_id"][0])
-    if book_id is None:
-        return False
-    loans = root.find("loans")
-    loan = loans.find(
-        f"loan[@book_id='{book_id}'][@returned='false']"
-    )
+    store = load_store()
+    loan = _active_loan_for(store, params["book_id"][0])
     if loan is None:
         return False
     import datetime
 
-    loan.set(
-        "date_return",
-        params.get("date_return", [datetime.date.today().isoformat()])[0],
+    store.return_loan(
+        loan, params.get("date_return", [datetime.date.today().isoformat()])[0]
     )
-    loan.set("returned", "true")
-    save_library(tree)
+    save_store(store)
     return True
 
 
+@writer
 def extend_loan_params(params):
     if "book_id" not in params or "new_date" not in params:
         return False
-    tree = load_library()
-    root = tree.getroot()
-    book_id = _resolve_book_id(root, params["book_id"][0])
-    if book_id is None:
-        return False
-    loans = root.find("loans")
-    loan = loans.find(
-        f"loan[@book_id='{book_id}'][@returned='false']"
-    )
+    store = load_store()
+    loan = _active_loan_for(store, params["book_id"][0])
     if loan is None:
         return False
-    loan.set("date_due", params["new_date"][0])
-    save_library(tree)
+    store.extend_loan(loan, params["new_date"][0])
+    save_store(store)
     return True
 
 
-def search_books_html(params) -> str:
-    tree = load_library()
-    rows = []
-    for book in tree.getroot().findall("books/book"):
-        if "author" in params and params["author"][0].lower() not in book.findtext("author").lower():
-            continue
-        if "genre" in params and params["genre"][0].lower() not in book.findtext("genre").lower():
-            continue
-        if "year" in params and params["year"][0] != book.findtext("year"):
-            continue
-        row = (
-            f"<tr><td>{html.escape(book.get('id'))}</td>"
-            f"<td>{html.escape(book.findtext('title'))}</td>"
-            f"<td>{html.escape(book.findtext('author'))}</td></tr>"
+@reader
+def search_books_html(params):
+    """Livres filtrés par auteur, genre ou année ; ``q`` les classe par pertinence."""
+    query = BookQuery(
+        *(params.get(name, [None])[0] for name in ("author", "genre", "year", "year_from", "year_to", "q"))
+    )
+    books = load_store().search_books(query)
+    if not books:
+        return "<p>Aucun résultat.</p>"
+    return _table("<tr><th>ID</th><th>Titre</th><th>Auteur</th></tr>", _book_rows(books))
+
+
+LOAN_HEADER = "<tr><th>Livre</th><th>Utilisateur</th><th>Sortie</th><th>Retour prévu</th><th>{last}</th></tr>"
+
+
+def _loan_status(loan) -> str:
+    return "retourne" if loan.get("returned") == "true" else "en cours"
+
+
+def _loan_rows(store, loans, extra):
+    """Lignes de tableau des prêts ; ``extra(loan)`` fournit la dernière colonne.
+
+    Titres, noms, dates et dernière colonne sont relevés tout de suite, sous
+    le verrou de l'appelant ; les lignes ne sont mises en forme qu'au moment
+    de l'envoi.
+    """
+    fields = []
+    for loan in loans:
+        book = store.book(loan.get("book_id"))
+        user = store.user(loan.get("user_id"))
+        fields.append(
+            (
+                book.findtext("title") if book is not None else loan.get("book_id"),
+                user.findtext("name") if user is not None else loan.get("user_id"),
+                loan.get("date_out") or "",
+                loan.get("date_due") or "",
+                extra(loan),
+            )
         )
-        rows.append(row)
-    if rows:
-        table = "<table><tr><th>ID</th><th>Titre</th><th>Auteur</th></tr>" + "".join(rows) + "</table>"
-    else:
-        table = "<p>Aucun résultat.</p>"
-    return table
+    return (
+        "<tr>" + "".join(f"<td>{html.escape(value)}</td>" for value in row) + "</tr>"
+        for row in fields
+    )
+
+
+@reader
+def search_loans_html(params):
+    """Prêts filtrés par date de sortie (``out_from``, ``out_to``) ou de retour prévue."""
+    import datetime
+
+    out_from, out_to, due_before = (params.get(name, [""])[0] for name in ("out_from", "out_to", "due_before"))
+    try:
+        if due_before:
+            due_before = datetime.date.fromisoformat(due_before).isoformat()
+    except ValueError:
+        return "<p>Paramètres invalides.</p>"
+    if not all(is_period(value) for value in (out_from, out_to) if value):
+        return "<p>Paramètres invalides.</p>"
+    query = LoanQuery(out_from, out_to, due_before, "include_returned" in params)
+    store = load_store()
+    loans = store.search_loans(query)
+    if not loans:
+        return "<p>Aucun résultat.</p>"
+    rows = _loan_rows(store, loans, _loan_status)
+    header = LOAN_HEADER.format(last="Statut")
+    return itertools.chain((f"<p>{len(loans)} prêt(s).</p>",), _table(header, rows))
+
+
+@reader
+def overdue_html(params):
+    """Prêts en cours dont le retour était prévu avant ``on`` (aujourd'hui par défaut)."""
+    import datetime
+
+    try:
+        on = datetime.date.fromisoformat(params.get("on", [""])[0] or datetime.date.today().isoformat())
+    except ValueError:
+        return "<p>Paramètres invalides.</p>"
+    store = load_store()
+    loans = store.search_loans(LoanQuery(due_before=on.isoformat()))
+    if not loans:
+        return f"<p>Aucun prêt en retard au {on.isoformat()}.</p>"
+
+    def days_late(loan) -> str:
+        try:
+            return str((on - datetime.date.fromisoformat(loan.get("date_due") or "")).days)
+        except ValueError:
+            return ""
+
+    rows = _loan_rows(store, loans, days_late)
+    header = LOAN_HEADER.format(last="Jours de retard")
+    summary = f"<p>{len(loans)} prêt(s) en retard au {on.isoformat()}.</p>"
+    return itertools.chain((summary,), _table(header, rows))
+
+
+@reader
+def user_loans_html(params):
+    """Prêts en cours et rendus de l'utilisateur ``id`` (identifiant ou nom)."""
+    store = load_store()
+    user = store.find_user(params["id"][0])
+    if user is None:
+        return "<p>Utilisateur introuvable.</p>"
+    loans = store.user_loans(user.get("id"))
+    active = store.open_loans(user.get("id"))
+    summary = (
+        f"<p>{html.escape(user.findtext('name'))} : {len(loans)} prêt(s), "
+        f"{active} en cours, {len(loans) - active} rendu(s).</p>"
+    )
+    if not loans:
+        return summary
+    rows = _loan_rows(
+        store,
+        loans,
+        lambda loan: f"rendu le {loan.get('date_return')}" if loan.get("returned") == "true" else "en cours",
+    )
+    header = LOAN_HEADER.format(last="Statut")
+    return itertools.chain((summary,), _table(header, rows))
+
+
+def _count_table(title: str, rows) -> str:
+    """Tableau à deux colonnes (libellé, nombre de prêts)."""
+    cells = "".join(
+        f"<tr><td>{html.escape(label or '(inconnu)')}</td><td>{count}</td></tr>" for label, count in rows
+    )
+    return f"<h2>{html.escape(title)}</h2><table><tr><th></th><th>Prêts</th></tr>{cells}</table>"
+
+
+@reader
+def stats_html(params) -> str:
+    """Statistiques de circulation ; ``top`` règle la longueur des classements."""
+    try:
+        top = int(params.get("top", ["10"])[0])
+    except ValueError:
+        return "<p>Paramètres invalides.</p>"
+    store = load_store()
+    report = store.stats(top, main.archived_loans())
+    origins = report["origins"]
+    summary = f"<p>{report['loans']} prêt(s)"
+    if report["average_days"] is not None:
+        summary += f", {report['returned']} rendu(s) en {report['average_days']:.1f} jours en moyenne"
+    summary += ".</p>"
+    users = []
+    for user_id, count in report["users"]:
+        user = store.user(user_id)
+        users.append((user.findtext("name") if user is not None else user_id, count))
+    months = {}
+    for (month, genre), count in report["genre_months"]:
+        months.setdefault(month, []).append(f"{genre or '(inconnu)'} {count}")
+    month_rows = "".join(
+        f"<tr><td>{html.escape(month or '(inconnu)')}</td><td>{count}</td>"
+        f"<td>{html.escape(', '.join(months[month]))}</td></tr>"
+        for month, count in report["months"]
+    )
+    return (
+        summary
+        + _count_table(
+            "Origine des auteurs",
+            [
+                ("Sénégalais", origins.get("senegalese", 0)),
+                ("Français", origins.get("french", 0)),
+                ("Autres", origins.get("other", 0)),
+            ],
+        )
+        + _count_table("Auteurs les plus empruntés", report["authors"])
+        + _count_table("Prêts par genre", report["genres"])
+        + _count_table("Emprunteurs les plus actifs", users)
+        + "<h2>Prêts par mois</h2><table><tr><th>Mois</th><th>Prêts</th><th>Par genre</th></tr>"
+        + month_rows
+        + "</table>"
+    )
+
+
+# Nombre de lignes affichées par défaut pour une requête.
+QUERY_LIMIT = 200
+
+
+def query_form(text: str = "") -> str:
+    return (
+        "<form>"
+        f"<label>Requête: <textarea name='q' rows='6'>{html.escape(text)}</textarea></label>"
+        "<input type='submit' value='Exécuter'>"
+        "</form>"
+    )
+
+
+@reader
+def query_html(params):
+    """Évalue la requête ``q`` et affiche ses résultats dans un tableau."""
+    text = params["q"][0]
+    try:
+        limit = int(params.get("limit", [QUERY_LIMIT])[0])
+        compiled = compile_query(text)
+        with metrics.phase("query"):
+            rows = list(itertools.islice(compiled.rows(load_store()), limit + 1))
+    except (QueryError, ValueError) as exc:
+        return query_form(text) + f"<p>Requête invalide : {html.escape(str(exc))}</p>"
+    if not rows:
+        return query_form(text) + "<p>Aucun résultat.</p>"
+    more = f"<p>Seules les {limit} premières lignes sont affichées.</p>" if len(rows) > limit else ""
+    # Les valeurs sont relevées sous le verrou : seule la mise en forme est différée.
+    shown = [tuple(display(item) for item in row) for row in itertools.islice(rows, limit)]
+    body = ("<tr>" + "".join(f"<td>{html.escape(value)}</td>" for value in row) + "</tr>" for row in shown)
+    return itertools.chain((query_form(text),), _table("", body, more))
+
+
+def _options(choices):
+    """Balises ``<option>`` des paires (valeur, libellé), mises en forme à l'envoi."""
+    return (
+        f"<option value='{html.escape(value)}'>{html.escape(label or '')}</option>"
+        for value, label in choices
+    )
+
+
+@reader
+def _active_loan_options():
+    """Construit les options du formulaire listant les livres empruntés."""
+    store = load_store()
+    choices = []
+    for loan in store.iter_active_loans():
+        book = store.book(loan.get("book_id"))
+        title = book.findtext("title") if book is not None else loan.get("book_id")
+        choices.append((loan.get("book_id"), title))
+    return _options(choices)
+
+
+@reader
+def _book_and_user_options():
+    """Construit les options du formulaire d'emprunt (livres, utilisateurs)."""
+    store = load_store()
+    books = [(b.get("id"), b.findtext("title")) for b in store.iter_books()]
+    users = [(u.get("id"), u.findtext("name")) for u in store.iter_users()]
+    return _options(books), _options(users)
+
+
+class PageCache:
+    """Petit cache LRU des pages rendues, indexé par URL et version de la bibliothèque."""
+
+    def __init__(self, size: int = 64):
+        self._size = size
+        self._pages: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is not None:
+                self._pages.move_to_end(key)
+            return entry
+
+    def put(self, key, body: bytes) -> dict:
+        entry = {"identity": body}
+        with self._lock:
+            self._pages[key] = entry
+            self._pages.move_to_end(key)
+            while len(self._pages) > self._size:
+                self._pages.popitem(last=False)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+
+
+PAGE_CACHE = PageCache()
+
+# Pages sans effet de bord, qui peuvent être validées et mises en cache.
+CACHEABLE_PATHS = {
+    "/",
+    "/books",
+    "/users",
+    "/loans",
+    "/search-books",
+    "/search-loans",
+    "/user-loans",
+    "/stats",
+    "/query",
+}
+# Formulaires, cachables uniquement lorsqu'ils sont affichés sans paramètre.
+FORM_PATHS = {
+    "/add-book",
+    "/update-book",
+    "/add-user",
+    "/update-user",
+    "/loan-book",
+    "/return-book",
+    "/extend-loan",
+}
+# En dessous de cette taille, la compression ne fait rien gagner.
+GZIP_MIN_BYTES = 512
+# Taille des blocs d'une page envoyée au fil du rendu ; une page plus courte
+# part d'un seul bloc.
+STREAM_CHUNK_BYTES = 16 * 1024
+# Au-delà, une page envoyée au fil du rendu n'est pas gardée en cache.
+PAGE_CACHE_MAX_BYTES = 1024 * 1024
+# Routes suivies individuellement par /metrics ; les autres sont regroupées.
+# « /overdue » dépend de la date du jour : la version des fichiers ne suffit
+# pas à la valider, elle n'est donc jamais mise en cache.
+ROUTES = CACHEABLE_PATHS | FORM_PATHS | {"/delete-book", "/delete-user", "/metrics", "/overdue"}
+
+
+@reader
+def metrics_text() -> str:
+    """Mesures du serveur et état de la bibliothèque au format Prometheus."""
+    store = load_store()
+    counts = store.counts()
+    files = {f'file="{path.name}"': path.stat().st_size for path in main.library_files()}
+    gauges = metrics.gauge("library_file_bytes", "Size of the library files.", files)
+    gauges += metrics.gauge(
+        "library_elements",
+        "Number of records in the library.",
+        {f'kind="{kind}"': count for kind, count in counts.items()},
+    )
+    return metrics.REGISTRY.render(gauges)
+
+
+def _settled(last_modified: float) -> bool:
+    """Indique si la seconde de ``last_modified`` est écoulée.
+
+    ``Last-Modified`` n'a qu'une précision d'une seconde : tant que celle de
+    la dernière modification dure, une autre modification pourrait s'y
+    ajouter sans changer la date. La date n'est donc ni annoncée ni
+    comparée à ``If-Modified-Since`` avant la seconde suivante.
+    """
+    return int(last_modified) < int(time.time())
 
 
 class LibraryHandler(BaseHTTPRequestHandler):
+    # Le serveur à fils reste en HTTP/1.0 : une connexion gardée ouverte y
+    # occuperait un fil, et le seul fil du serveur par défaut, jusqu'à ce que
+    # le client la ferme. Seul ``BufferedLibraryHandler`` (``--async``)
+    # répond en HTTP/1.1.
+    protocol_version = "HTTP/1.0"
+
+    def _cache_key(self, parsed):
+        """Retourne la clé de cache de la requête, ou ``None`` si elle modifie la bibliothèque."""
+        if parsed.path in CACHEABLE_PATHS or (parsed.path in FORM_PATHS and not parsed.query):
+            return parsed.path, parsed.query
+        return None
+
+    def _not_modified(self, etag: str, last_modified: float) -> bool:
+        """Indique si la copie du client est encore valide."""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return _settled(last_modified) and int(last_modified) <= since
+        return False
+
+    def _send_page(self, title: str, body) -> None:
+        """Envoie une page HTML ; ``body`` est un texte ou une suite de fragments.
+
+        Une page plus courte que ``STREAM_CHUNK_BYTES`` part d'un bloc, avec sa
+        longueur ; une page plus longue est envoyée au fil du rendu (voir
+        ``_stream_page``).
+        """
+        parts = page_parts(title, body)
+        buffered = bytearray()
+        for part in parts:
+            buffered += part
+            if len(buffered) >= STREAM_CHUNK_BYTES:
+                self._stream_page(buffered, parts)
+                return
+        entry = {"identity": bytes(buffered)}
+        if self._page_key is not None:
+            entry = PAGE_CACHE.put(self._page_key, entry["identity"])
+        self._send_entry(entry)
+
+    def _stream_page(self, first: bytearray, parts) -> None:
+        """Envoie une longue page par blocs d'environ ``STREAM_CHUNK_BYTES``.
+
+        Avec ``BufferedLibraryHandler`` et un client HTTP/1.1, les blocs sont
+        découpés (``Transfer-Encoding: chunked``) ; sinon, et toujours avec le
+        serveur à fils qui répond en HTTP/1.0, la fin de la réponse est
+        marquée par la fermeture de la connexion. La compression gzip se fait bloc par bloc. La page n'est
+        gardée en cache que si elle ne dépasse pas ``PAGE_CACHE_MAX_BYTES``.
+        """
+        chunked = self.request_version == "HTTP/1.1" and self.protocol_version == "HTTP/1.1"
+        compressor = None
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Vary", "Accept-Encoding")
+        if compressor is not None:
+            self.send_header("Content-Encoding", "gzip")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self._send_validators()
+        self.end_headers()
+        kept = bytearray(first) if self._page_key is not None else None
+        pending = first
+        try:
+            for part in parts:
+                pending += part
+                if kept is not None:
+                    kept += part
+                    if len(kept) > PAGE_CACHE_MAX_BYTES:
+                        kept = None
+                if len(pending) >= STREAM_CHUNK_BYTES:
+                    self._write_block(pending, compressor, chunked)
+                    pending = bytearray()
+            self._write_block(pending, compressor, chunked, last=True)
+        except Exception:
+            # Les en-têtes sont partis : seule une connexion coupée signale
+            # au client que la page est incomplète.
+            self.close_connection = True
+            raise
+        if kept is not None:
+            PAGE_CACHE.put(self._page_key, bytes(kept))
+
+    def _write_block(self, data: bytes, compressor, chunked: bool, last: bool = False) -> None:
+        if compressor is not None:
+            data = compressor.compress(data) + (compressor.flush() if last else b"")
+        if chunked:
+            # Un bloc vide terminerait la réponse : il n'est jamais envoyé seul.
+            data = b"%x\r\n" % len(data) + data + b"\r\n" if data else b""
+            if last:
+                data += b"0\r\n\r\n"
+        if data:
+            self.wfile.write(data)
+
+    def _send_entry(self, entry: dict) -> None:
+        """Envoie une page, compressée si le client l'accepte."""
+        body = entry["identity"]
+        gzip_ok = "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzip_ok and len(body) >= GZIP_MIN_BYTES:
+            if "gzip" not in entry:
+                entry["gzip"] = gzip.compress(body, compresslevel=6)
+            body = entry["gzip"]
+        else:
+            gzip_ok = False
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Vary", "Accept-Encoding")
+        if gzip_ok:
+            self.send_header("Content-Encoding", "gzip")
+        self._send_validators()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_validators(self) -> None:
+        if self._etag is not None:
+            self.send_header("ETag", self._etag)
+            if _settled(self._last_modified):
+                self.send_header("Last-Modified", formatdate(int(self._last_modified), usegmt=True))
+            self.send_header("Cache-Control", "no-cache")
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
     def do_GET(self):
-        parsed = urlparse(self.path)
-        if parsed.path == "/":
-            body = "<p>Bienvenue dans la bibliothèque.</p>"
-            html_page = page("Accueil", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/books":
-            table = list_books_html()
-            html_page = page("Liste des livres", table)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/add-book":
-            params = parse_qs(parsed.query)
-            if params:
-                added = add_book_params(params)
-                message = "Livre ajouté." if added else "Paramètres manquants." 
-                body = f"<p>{message}</p>"
-                html_page = page("Ajout d'un livre", body)
-                self.send_response(200)
-                self.send_header("Content-Type", "text/html; charset=utf-8")
-                self.end_headers()
-                self.wfile.write(html_page.encode("utf-8"))
-            else:
-                form = (
-                    "<form>"
-                    "<label>Titre: <input name='title'></label>"
-                    "<label>Auteur: <input name='author'></label>"
-                    "<label>Genre: <input name='genre'></label>"
-                    "<label>Année: <input name='year'></label>"
-                    "<input type='submit' value='Ajouter'>"
-                    "</form>"
-                )
-                html_page = page("Ajouter un livre", form)
-                self.send_response(200)
-                self.send_header("Content-Type", "text/html; charset=utf-8")
-                self.end_headers()
-                self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/search-books":
-            params = parse_qs(parsed.query)
-            if params:
-                table = search_books_html(params)
-            else:
-                form = (
-                    "<form>"
-                    "<label>Auteur: <input name='author'></label>"
-                    "<label>Genre: <input name='genre'></label>"
-                    "<label>Année: <input name='year'></label>"
-                    "<input type='submit' value='Rechercher'>"
-                    "</form>"
-                )
-                table = form
-            html_page = page("Recherche de livres", table)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/update-book":
-            params = parse_qs(parsed.query)
-            if params:
-                updated = update_book_params(params)
-                message = "Livre modifié." if updated else "Paramètres manquants."
-                body = f"<p>{message}</p>"
-            else:
-                body = (
-                    "<form>"
-                    "<label>ID: <input name='id'></label>"
-                    "<label>Titre: <input name='title'></label>"
-                    "<label>Auteur: <input name='author'></label>"
-                    "<label>Genre: <input name='genre'></label>"
-                    "<label>Année: <input name='year'></label>"
-                    "<input type='submit' value='Mettre à jour'>"
-                    "</form>"
-                )
-            html_page = page("Modification d'un livre", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/delete-book":
-            params = parse_qs(parsed.query)
-            deleted = delete_book_params(params)
-            body = "<p>Livre supprimé.</p>" if deleted else "<p>Suppression impossible.</p>"
-            html_page = page("Suppression d'un livre", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/users":
-            table = list_users_html()
-            html_page = page("Liste des utilisateurs", table)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/add-user":
-            params = parse_qs(parsed.query)
-            if params:
-                added = add_user_params(params)
-                message = "Utilisateur ajouté." if added else "Paramètres manquants."
-                body = f"<p>{message}</p>"
-            else:
-                body = (
-                    "<form>"
-                    "<label>Nom: <input name='name'></label>"
-                    "<input type='submit' value='Ajouter'>"
-                    "</form>"
-                )
-            html_page = page("Ajout d'un utilisateur", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/update-user":
-            params = parse_qs(parsed.query)
-            if params:
-                updated = update_user_params(params)
-                message = "Utilisateur modifié." if updated else "Paramètres manquants."
-                body = f"<p>{message}</p>"
-            else:
-                body = (
-                    "<form>"
-                    "<label>ID: <input name='id'></label>"
-                    "<label>Nom: <input name='name'></label>"
-
-                    "<input type='submit' value='Mettre à jour'>"
-                    "</form>"
-                )
-            html_page = page("Modification d'un utilisateur", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/delete-user":
-            params = parse_qs(parsed.query)
-            deleted = delete_user_params(params)
-            body = (
-                "<p>Utilisateur supprimé.</p>" if deleted else "<p>Suppression impossible.</p>"
+        route = urlparse(self.path).path
+        self._status = None
+        start = time.perf_counter()
+        try:
+            with metrics.phase("render"):
+                self._handle_get()
+        finally:
+            metrics.REGISTRY.observe_request(
+                route if route in ROUTES else "other",
+                self._status or 500,
+                time.perf_counter() - start,
             )
-            html_page = page("Suppression d'un utilisateur", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/loans":
-            table = list_loans_html()
-            html_page = page("Liste des prêts", table)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/loan-book":
-            params = parse_qs(parsed.query)
-            if params:
-                done, message = loan_book_params(params)
-                body = f"<p>{html.escape(message)}</p>"
-            else:
-                tree = load_library()
-                root = tree.getroot()
-                book_opts = "".join(
-                    f"<option value='{b.get('id')}'>{html.escape(b.findtext('title'))}</option>"
-                    for b in root.findall("books/book")
-                )
-                user_opts = "".join(
-                    f"<option value='{u.get('id')}'>{html.escape(u.findtext('name'))}</option>"
-                    for u in root.findall("users/user")
-                )
-                body = (
-                    "<form>"
-                    f"<label>Livre: <select name='book_id'>{book_opts}</select></label>"
-                    f"<label>Utilisateur: <select name='user_id'>{user_opts}</select></label>"
-                    "<label>Date sortie: <input name='date_out'></label>"
-                    "<label>Date retour prévue: <input name='date_due'></label>"
-                    "<input type='submit' value='Enregistrer'>"
-                    "</form>"
-                )
-            html_page = page("Enregistrer un prêt", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/return-book":
-            params = parse_qs(parsed.query)
-            if params:
-                done = return_book_params(params)
-                body = "<p>Livre rendu.</p>" if done else "<p>Opération impossible.</p>"
-            else:
-                tree = load_library()
-                root = tree.getroot()
-                loan_opts = "".join(
-                    f"<option value='{l.get('book_id')}'>{html.escape(root.find("books/book[@id='%s']" % l.get('book_id')).findtext('title'))}</option>"
-                    for l in root.findall("loans/loan[@returned='false']")
-                )
-                body = (
-                    "<form>"
-                    f"<label>Livre: <select name='book_id'>{loan_opts}</select></label>"
-                    "<label>Date de retour: <input name='date_return'></label>"
-                    "<input type='submit' value='Rendre'>"
-                    "</form>"
-                )
-            html_page = page("Retour d'un livre", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
-        elif parsed.path == "/extend-loan":
-            params = parse_qs(parsed.query)
-            if params:
-                done = extend_loan_params(params)
-                body = (
-                    "<p>Prêt prolongé.</p>" if done else "<p>Opération impossible.</p>"
-                )
-            else:
-                tree = load_library()
-                root = tree.getroot()
-                loan_opts = "".join(
-                    f"<option value='{l.get('book_id')}'>{html.escape(root.find("books/book[@id='%s']" % l.get('book_id')).findtext('title'))}</option>"
-                    for l in root.findall("loans/loan[@returned='false']")
-                )
-                body = (
-                    "<form>"
-                    f"<label>Livre: <select name='book_id'>{loan_opts}</select></label>"
-                    "<label>Nouvelle date: <input name='new_date'></label>"
-                    "<input type='submit' value='Prolonger'>"
-                    "</form>"
-                )
-
-            html_page = page("Prolonger un prêt", body)
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(html_page.encode("utf-8"))
 
-        else:
+    def _send_text(self, text: str, content_type: str) -> None:
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle_get(self):
+        parsed = urlparse(self.path)
+        self._etag = None
+        self._page_key = None
+        cache_key = self._cache_key(parsed)
+        if cache_key is not None:
+            version, self._last_modified = library_version()
+            self._etag = f'"{version}"'
+            if self._not_modified(self._etag, self._last_modified):
+                self.send_response(304)
+                self._send_validators()
+                self.end_headers()
+                return
+            self._page_key = (version,) + cache_key
+            cached = PAGE_CACHE.get(self._page_key)
+            if cached is not None:
+                self._send_entry(cached)
+                return
+        route = self._GET_ROUTES.get(parsed.path)
+        if route is None:
             self.send_error(404)
+            return
+        result = route(self, parse_qs(parsed.query))
+        if result is not None:
+            self._send_page(*result)
+
+    # Chaque route reçoit les paramètres de l'URL et retourne le titre et le
+    # corps de la page, ou ``None`` si elle a envoyé sa réponse elle-même.
+
+    def _metrics(self, params):
+        self._send_text(metrics_text(), "text/plain; version=0.0.4; charset=utf-8")
+
+    def _home(self, params):
+        return "Accueil", "<p>Bienvenue dans la bibliothèque.</p>"
+
+    def _books(self, params):
+        return "Liste des livres", list_books_html(params)
+
+    def _add_book(self, params):
+        if params:
+            added = add_book_params(params)
+            message = "Livre ajouté." if added else "Paramètres manquants."
+            return "Ajout d'un livre", f"<p>{message}</p>"
+        form = (
+            "<form>"
+            "<label>Titre: <input name='title'></label>"
+            "<label>Auteur: <input name='author'></label>"
+            "<label>Genre: <input name='genre'></label>"
+            "<label>Année: <input name='year'></label>"
+            "<input type='submit' value='Ajouter'>"
+            "</form>"
+        )
+        return "Ajouter un livre", form
+
+    def _search_books(self, params):
+        if params:
+            return "Recherche de livres", search_books_html(params)
+        form = (
+            "<form>"
+            "<label>Titre, auteur ou genre: <input name='q'></label>"
+            "<label>Auteur: <input name='author'></label>"
+            "<label>Genre: <input name='genre'></label>"
+            "<label>Année: <input name='year'></label>"
+            "<label>Année à partir de: <input name='year_from'></label>"
+            "<label>Année jusqu'à: <input name='year_to'></label>"
+            "<input type='submit' value='Rechercher'>"
+            "</form>"
+        )
+        return "Recherche de livres", form
+
+    def _search_loans(self, params):
+        if params:
+            return "Recherche de prêts", search_loans_html(params)
+        form = (
+            "<form>"
+            "<label>Sortis à partir de: <input name='out_from' placeholder='AAAA-MM-JJ'></label>"
+            "<label>Sortis jusqu'à: <input name='out_to' placeholder='AAAA-MM-JJ'></label>"
+            "<label>Retour prévu avant: <input name='due_before' placeholder='AAAA-MM-JJ'></label>"
+            "<label><input type='checkbox' name='include_returned'> Inclure les prêts rendus</label>"
+            "<input type='submit' value='Rechercher'>"
+            "</form>"
+        )
+        return "Recherche de prêts", form
+
+    def _user_loans(self, params):
+        if "id" in params:
+            return "Prêts d'un utilisateur", user_loans_html(params)
+        form = (
+            "<form>"
+            "<label>Utilisateur (ID ou nom): <input name='id'></label>"
+            "<input type='submit' value='Afficher'>"
+            "</form>"
+        )
+        return "Prêts d'un utilisateur", form
+
+    def _overdue(self, params):
+        return "Prêts en retard", overdue_html(params)
+
+    def _stats(self, params):
+        return "Statistiques", stats_html(params)
+
+    def _query(self, params):
+        return "Requête", query_html(params) if "q" in params else query_form()
+
+    def _update_book(self, params):
+        if params:
+            updated = update_book_params(params)
+            message = "Livre modifié." if updated else "Paramètres manquants."
+            return "Modification d'un livre", f"<p>{message}</p>"
+        form = (
+            "<form>"
+            "<label>ID: <input name='id'></label>"
+            "<label>Titre: <input name='title'></label>"
+            "<label>Auteur: <input name='author'></label>"
+            "<label>Genre: <input name='genre'></label>"
+            "<label>Année: <input name='year'></label>"
+            "<input type='submit' value='Mettre à jour'>"
+            "</form>"
+        )
+        return "Modification d'un livre", form
 
+    def _delete_book(self, params):
+        deleted = delete_book_params(params)
+        body = "<p>Livre supprimé.</p>" if deleted else "<p>Suppression impossible.</p>"
+        return "Suppression d'un livre", body
 
-def run(server_class=HTTPServer, handler_class=LibraryHandler, port=8000):
+    def _users(self, params):
+        return "Liste des utilisateurs", list_users_html(params)
+
+    def _add_user(self, params):
+        if params:
+            added = add_user_params(params)
+            message = "Utilisateur ajouté." if added else "Paramètres manquants."
+            return "Ajout d'un utilisateur", f"<p>{message}</p>"
+        form = (
+            "<form>"
+            "<label>Nom: <input name='name'></label>"
+            "<input type='submit' value='Ajouter'>"
+            "</form>"
+        )
+        return "Ajout d'un utilisateur", form
+
+    def _update_user(self, params):
+        if params:
+            updated = update_user_params(params)
+            message = "Utilisateur modifié." if updated else "Paramètres manquants."
+            return "Modification d'un utilisateur", f"<p>{message}</p>"
+        form = (
+            "<form>"
+            "<label>ID: <input name='id'></label>"
+            "<label>Nom: <input name='name'></label>"
+            "<input type='submit' value='Mettre à jour'>"
+            "</form>"
+        )
+        return "Modification d'un utilisateur", form
+
+    def _delete_user(self, params):
+        deleted = delete_user_params(params)
+        body = "<p>Utilisateur supprimé.</p>" if deleted else "<p>Suppression impossible.</p>"
+        return "Suppression d'un utilisateur", body
+
+    def _loans(self, params):
+        return "Liste des prêts", list_loans_html(params)
+
+    def _loan_book(self, params):
+        if params:
+            done, message = loan_book_params(params)
+            return "Enregistrer un prêt", f"<p>{html.escape(message)}</p>"
+        book_opts, user_opts = _book_and_user_options()
+        form = itertools.chain(
+            ("<form><label>Livre: <select name='book_id'>",),
+            book_opts,
+            ("</select></label><label>Utilisateur: <select name='user_id'>",),
+            user_opts,
+            (
+                "</select></label>"
+                "<label>Date sortie: <input name='date_out'></label>"
+                "<label>Date retour prévue: <input name='date_due'></label>"
+                "<input type='submit' value='Enregistrer'>"
+                "</form>",
+            ),
+        )
+        return "Enregistrer un prêt", form
+
+    def _return_book(self, params):
+        if params:
+            done = return_book_params(params)
+            return "Retour d'un livre", "<p>Livre rendu.</p>" if done else "<p>Opération impossible.</p>"
+        form = itertools.chain(
+            ("<form><label>Livre: <select name='book_id'>",),
+            _active_loan_options(),
+            (
+                "</select></label>"
+                "<label>Date de retour: <input name='date_return'></label>"
+                "<input type='submit' value='Rendre'>"
+                "</form>",
+            ),
+        )
+        return "Retour d'un livre", form
+
+    def _extend_loan(self, params):
+        if params:
+            done = extend_loan_params(params)
+            return "Prolonger un prêt", "<p>Prêt prolongé.</p>" if done else "<p>Opération impossible.</p>"
+        form = itertools.chain(
+            ("<form><label>Livre: <select name='book_id'>",),
+            _active_loan_options(),
+            (
+                "</select></label>"
+                "<label>Nouvelle date: <input name='new_date'></label>"
+                "<input type='submit' value='Prolonger'>"
+                "</form>",
+            ),
+        )
+        return "Prolonger un prêt", form
+
+    _GET_ROUTES = {
+        "/metrics": _metrics,
+        "/": _home,
+        "/books": _books,
+        "/add-book": _add_book,
+        "/search-books": _search_books,
+        "/search-loans": _search_loans,
+        "/user-loans": _user_loans,
+        "/overdue": _overdue,
+        "/stats": _stats,
+        "/query": _query,
+        "/update-book": _update_book,
+        "/delete-book": _delete_book,
+        "/users": _users,
+        "/add-user": _add_user,
+        "/update-user": _update_user,
+        "/delete-user": _delete_user,
+        "/loans": _loans,
+        "/loan-book": _loan_book,
+        "/return-book": _return_book,
+        "/extend-loan": _extend_loan,
+    }
+
+
+class PooledHTTPServer(HTTPServer):
+    """Serveur HTTP qui traite les requêtes dans un groupe de fils de taille fixe."""
+
+    def __init__(self, server_address, handler_class, workers=8):
+        super().__init__(server_address, handler_class)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+def run(server_class=HTTPServer, handler_class=LibraryHandler, port=8000, workers=1):
     server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
+    if workers > 1:
+        httpd = PooledHTTPServer(server_address, handler_class, workers=workers)
+    else:
+        httpd = server_class(server_address, handler_class)
     print(f"Serveur demarre sur le port {port}")
     httpd.serve_forever()
 